@@ -0,0 +1,88 @@
+"""
+Times scheme programs on each evaluation engine
+
+run python3 bench.py [engine ...] to compare engines, each benchmark is
+parsed once and then evaluated REPEATS times in a fresh context
+
+run python3 bench.py --streams [engine] to time taking the nth element of
+self-referential streams for growing n, which stays linear because forcing
+a promise keeps its value
+"""
+import sys
+import time
+
+from eval import expr_to_str, frontend
+from scheme import ENGINES
+
+REPEATS = 200
+STREAMS_FLAG = "--streams"
+STREAM_SIZES = [10, 20, 40, 80, 160]
+
+BENCHMARKS = {
+    "decr": r'(begin (define (decr count) (if (eq? count 0) 0 (decr (- count 1)))) (decr 150))',
+    "sum": r'(begin (define (sum n acc) (if (eq? n 0) acc (sum (- n 1) (+ acc n)))) (sum 150 0))',
+    "for/list": r'(begin (define xs (quote (1 2 3 4 5 6 7 8 9 10))) (for/list ((i xs) (j xs)) (* (+ i j) (- i j))))',
+    "macro": r'(begin (define-macro (square x) (* x x)) (define (squares n acc) (if (eq? n 0) acc (squares (- n 1) (+ acc (square n))))) (squares 150 0))',
+    "cons-list": r'(begin (define (build n acc) (if (eq? n 0) acc (build (- n 1) (cons n acc)))) (define (total xs acc) (if (eq? xs nil) acc (total (cdr xs) (+ acc (car xs))))) (total (build 150 nil) 0))',
+    "match": r'(begin (define (walk n) (match (list n (cons n n)) ((list 0 _) 0) ((list i (cons j k)) (walk (- i 1))))) (walk 100))',
+}
+
+
+STREAM_PRELUDE = r'''
+(define (nth s k) (if (eq? k 0) (car s) (nth (cdr-stream s) (- k 1))))
+(define (ints k) (cons-stream k (ints (+ k 1))))
+(define (stream-filter p s)
+  (if (p (car s))
+      (cons-stream (car s) (stream-filter p (cdr-stream s)))
+      (stream-filter p (cdr-stream s))))
+(define (add-streams a b)
+  (cons-stream (+ (car a) (car b)) (add-streams (cdr-stream a) (cdr-stream b))))
+(define fibs (cons-stream 0 (cons-stream 1 (add-streams (cdr-stream fibs) fibs))))
+(define (divides? d n) (eq? n (* d (/ n d))))
+(define (prime-iter n ps)
+  (cond ((gt? (* (car ps) (car ps)) n) #t)
+        ((divides? (car ps) n) #f)
+        (else (prime-iter n (cdr-stream ps)))))
+(define primes (cons-stream 2 (stream-filter (lambda (n) (prime-iter n primes)) (ints 3))))
+'''
+
+STREAMS = ["fibs", "primes"]
+
+
+def time_engine(engine, expr):
+    evaluate = ENGINES[engine]
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        value = evaluate(expr, {})
+    return time.perf_counter() - start, value
+
+
+def time_streams(engine):
+    print(f"{'stream':<12}" + "".join(f"{n:>12}" for n in STREAM_SIZES))
+    for stream in STREAMS:
+        timings = []
+        for n in STREAM_SIZES:
+            expr = frontend(f"(begin {STREAM_PRELUDE} (nth {stream} {n}))")
+            start = time.perf_counter()
+            ENGINES[engine](expr, {})
+            timings.append(time.perf_counter() - start)
+        print(f"{stream:<12}" + "".join(f"{t:>11.3f}s" for t in timings))
+
+
+if __name__ == "__main__":
+    if STREAMS_FLAG in sys.argv:
+        args = [arg for arg in sys.argv[1:] if arg != STREAMS_FLAG]
+        time_streams(args[0] if args else "tree")
+        sys.exit(0)
+    engines = sys.argv[1:] or list(ENGINES)
+    print(f"{'benchmark':<12}" + "".join(f"{e:>12}" for e in engines))
+    for name, string in BENCHMARKS.items():
+        expr = frontend(string)
+        timings = []
+        values = set()
+        for engine in engines:
+            elapsed, value = time_engine(engine, expr)
+            timings.append(elapsed)
+            values.add(expr_to_str(value))
+        assert len(values) == 1, f"engines disagree on {name}: {values}"
+        print(f"{name:<12}" + "".join(f"{t:>11.3f}s" for t in timings))
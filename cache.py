@@ -0,0 +1,139 @@
+"""
+On disk cache of parsed and macro expanded scheme programs
+
+cached_frontend(file_name, string) returns frontend(string), reading it
+from a .scmc file in the __scmcache__ directory next to the source when one
+was written for the same source and interpreter, and writing one otherwise,
+so that warm starts skip lexing, parsing, postparsing and expansion.
+
+A .scmc file is MAGIC followed by a pickle of the key it was written for,
+the gensym counter after expansion, and the program. The key hashes the
+source with INTERPRETER_FILES and the python version, so that any change
+to the frontend or the classes it builds misses the cache. A file that is
+stale, unreadable or corrupt is a miss, and failing to write one is
+ignored, the cache only ever saves time.
+
+Run python3 cache.py file.scm to time a cold and a warm start of a file.
+"""
+import hashlib
+import os
+import pickle
+import sys
+import time
+
+import eval as evaluator
+from eval import *
+
+
+MAGIC = b"SCMC1\n"
+CACHE_DIRECTORY = "__scmcache__"
+CACHE_EXTENSION = ".scmc"
+
+# sources of the frontend, whose contents are part of every key
+INTERPRETER_FILES = ["eval.py"]
+
+# digest of INTERPRETER_FILES and the python version, see interpreter_version
+INTERPRETER_VERSION = None
+
+
+def interpreter_version():
+    global INTERPRETER_VERSION
+    if INTERPRETER_VERSION is None:
+        digest = hashlib.sha256(sys.version.encode())
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in INTERPRETER_FILES:
+            fp = open(os.path.join(directory, name), "rb")
+            digest.update(fp.read())
+            fp.close()
+        INTERPRETER_VERSION = digest.hexdigest()
+    return INTERPRETER_VERSION
+
+
+def cache_key(string):
+    digest = hashlib.sha256(interpreter_version().encode())
+    digest.update(string.encode())
+    return digest.hexdigest()
+
+
+def cache_path(file_name):
+    directory, base = os.path.split(os.path.abspath(file_name))
+    name = os.path.splitext(base)[0] + CACHE_EXTENSION
+    return os.path.join(directory, CACHE_DIRECTORY, name)
+
+
+def intern_symbols(expr):
+    # unpickled symbols are new strings, the engines compare them by identity
+    if type(expr) == str:
+        return sys.intern(expr)
+    elif type(expr) == list:
+        return [intern_symbols(e) for e in expr]
+    return expr
+
+
+def read_cache(path, key):
+    """
+    returns the program cached at path for key, or None on a miss
+    """
+    try:
+        fp = open(path, "rb")
+        try:
+            if fp.read(len(MAGIC)) != MAGIC:
+                return None
+            cached_key, counter, program = pickle.load(fp)
+        finally:
+            fp.close()
+    except Exception:
+        return None
+    if cached_key != key:
+        return None
+    # later gensyms must not reuse the names in the cached program
+    evaluator.COUNTER = max(evaluator.COUNTER, counter)
+    return intern_symbols(program)
+
+
+def write_cache(path, key, program):
+    # written aside and renamed, so that readers never see half a file
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fp = open(temporary, "wb")
+        try:
+            fp.write(MAGIC)
+            pickle.dump((key, evaluator.COUNTER, program), fp,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            fp.close()
+        os.replace(temporary, path)
+    except (OSError, pickle.PicklingError, RecursionError):
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def cached_frontend(file_name, string):
+    """
+    returns frontend(string) for the source string of file_name, from the
+    cache when it holds it
+    """
+    path = cache_path(file_name)
+    key = cache_key(string)
+    program = read_cache(path, key)
+    if program is None:
+        program = frontend(string)
+        write_cache(path, key, program)
+    return program
+
+
+if __name__ == "__main__":
+    for file_name in sys.argv[1:]:
+        fp = open(file_name, "r")
+        string = fp.read()
+        fp.close()
+        start = time.perf_counter()
+        cold = frontend(string)
+        cold_time = time.perf_counter() - start
+        write_cache(cache_path(file_name), cache_key(string), cold)
+        start = time.perf_counter()
+        warm = cached_frontend(file_name, string)
+        warm_time = time.perf_counter() - start
+        assert expr_to_str(warm) == expr_to_str(cold)
+        print(f"{file_name}: frontend {cold_time:.4f}s, cached {warm_time:.4f}s")
@@ -3,7 +3,7 @@ cps.py translates scheme code in continuation passing style.
 """
 from constants import *
 from scheme_classes import *
-from eval import eval_expr, expr_to_str
+from eval import eval_program, expr_to_str
 
 K = "k"
 K_COUNTER = 0
@@ -102,7 +102,7 @@ def main():
         starting = [LAMBDA, [K], K]
         result = [cps, starting]
         print(f"CPS result is: {result}")
-        evaluated = expr_to_str(eval_expr(result, {}, False))
+        evaluated = expr_to_str(eval_program(result, {}))
         print(f"Evaluation gives: {evaluated}")
 
 
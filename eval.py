@@ -15,8 +15,60 @@ https://www.scheme.com/tspl4/grammar.html
 
 from copy import deepcopy
 
+from collections import OrderedDict, deque
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import concurrent.futures
+
+import pickle
+
 from functools import reduce
 
+from itertools import count, islice
+
+import contextvars
+
+import importlib
+import os
+import sys
+import threading
+import time
+
+
+def import_past_ast(name):
+    """
+    imports the module name, which imports the standard library ast module,
+    as numpy and asyncio do. ast.py in this directory shadows it when the
+    interpreter runs from here, so the directory is left off the path while
+    importing.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    path = sys.path
+    local_ast = sys.modules.pop("ast", None)
+    sys.path = [p for p in path if os.path.abspath(p or os.curdir) != here]
+    try:
+        return importlib.import_module(name)
+    finally:
+        sys.path = path
+        sys.modules.pop("ast", None)
+        if local_ast is not None:
+            sys.modules["ast"] = local_ast
+
+
+def import_numpy():
+    """
+    numpy if it is installed, which only vectors need
+    """
+    try:
+        return import_past_ast("numpy")
+    except ImportError:
+        return None
+
+
+numpy = import_numpy()
+# imported by the first eval_async, evaluation never needs it otherwise
+asyncio = None
+
 PRINT_CONS = False
 
 
@@ -85,6 +137,50 @@ NEQ = "neq?"
 COND = "cond"
 ELSE = "else"
 DELAY = "delay"
+DELAY_FORCE = "delay-force"
+MAKE_PROMISE = "make-promise"
+IS_PROMISE = "promise?"
+STREAM_MAP = "stream-map"
+STREAM_FILTER = "stream-filter"
+STREAM_TAKE = "stream-take"
+STREAM_TO_LIST = "stream->list"
+INTEGERS_FROM = "integers-from"
+MAKE_VECTOR = "make-vector"
+LIST_TO_VECTOR = "list->vector"
+VECTOR_TO_LIST = "vector->list"
+VECTOR_LENGTH = "vector-length"
+VECTOR_REF = "vector-ref"
+VECTOR_MAP = "vector-map"
+VECTOR_ADD = "vector+"
+VECTOR_MUL = "vector*"
+VECTOR_SUM = "vector-sum"
+VECTOR_DOT = "vector-dot"
+VECTOR_FOLD = "vector-fold"
+DEFINE_MEMO = "define-memo"
+MEMOIZE = "memoize"
+MEMO_CLEAR = "memo-clear!"
+MEMO_STATS = "memo-stats"
+MAX_SIZE = "max-size"
+PMAP = "pmap"
+CHUNK_SIZE = "chunk-size"
+HASH = "hash"
+MAKE_HASH = "make-hash"
+HASH_SET = "hash-set"
+HASH_SET_BANG = "hash-set!"
+HASH_REF = "hash-ref"
+HASH_REMOVE_BANG = "hash-remove!"
+HASH_KEYS = "hash-keys"
+HASH_COUNT = "hash-count"
+FUTURE = "future"
+TOUCH = "touch"
+FUTURE_ALL = "future-all"
+SET_FUTURE_WORKERS = "set-future-workers!"
+SPAWN = "spawn"
+SLEEP = "sleep"
+MAKE_CHANNEL = "make-channel"
+CHANNEL_PUT = "channel-put!"
+CHANNEL_GET = "channel-get"
+KEYWORD_PREFIX = "#:"
 FORCE = "force"
 CONS_STREAM = "cons-stream"
 CDR_STREAM = "cdr-stream"
@@ -94,6 +190,12 @@ NIL = "nil"
 MATCH = "match"  # very basic match
 UNDERSCORE = "_"
 
+# the reader interns symbols, so the constants above are interned too, to be
+# the very strings it makes for them and compare to them by identity
+for name, value in list(globals().items()):
+    if name.isupper() and type(value) == str:
+        globals()[name] = sys.intern(value)
+
 PREPARSE_SYMBOLS_MAP = {
     TICK: QUOTE,
     BACKTICK: QUASIQUOTE,
@@ -101,6 +203,15 @@ PREPARSE_SYMBOLS_MAP = {
     COMMA: UNQUOTE
 }
 
+# heads that eval_expr dispatches on, which are never variables in head position
+SPECIAL_FORMS = {
+    ADD, SUB, MUL, DIV, EXP, CONCAT, QUOTE, PRINTLN, SET, EQ, QUASIQUOTE,
+    UNQUOTE, LIST, UNQUOTE_SPLICING, IF, LET, LETSTAR, AND, OR, NEQ, LT, LTE,
+    GT, GTE, NOT, BEGIN, DEFINE, LAMBDA, CAR, CDR, CONS, APPLY, MAP,
+    DEFINE_MACRO, COND, FOR, FORLIST, DELAY, DELAY_FORCE, FORCE, CONS_STREAM,
+    CDR_STREAM, APPEND, MATCH, FUTURE,
+}
+
 
 COUNTER = 0
 GENERATED_SYMBOL = "gen_sym"
@@ -109,7 +220,7 @@ GENERATED_SYMBOL = "gen_sym"
 def gensym():
     global COUNTER
     COUNTER += 1
-    return f"__{GENERATED_SYMBOL}_{COUNTER}__"
+    return sys.intern(f"__{GENERATED_SYMBOL}_{COUNTER}__")
 
 
 class String():
@@ -124,8 +235,28 @@ class String():
         return self.string
 
 
+class Keyword():
+    """
+    self evaluating #:name token, names the optional arguments of
+    builtins, e.g. (memoize f #:max-size 100)
+    """
+
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+
+    def get_name(self):
+        return self.name
+
+    def __eq__(self, other):
+        return type(other) == Keyword and self.name == other.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+
 class Lambda():
-    def __init__(self, args, bodies, is_variadic):
+    def __init__(self, args, bodies, is_variadic, env, compiled_body=None):
         assert type(args) == list
         assert len(args) >= 0  # 0 arg function allowed for defines
         assert type(bodies) == list
@@ -135,6 +266,14 @@ class Lambda():
         self.args = args
         self.bodies = bodies
         self.is_variadic = is_variadic
+        # frame the lambda was created in
+        self.env = env
+        # closure for the bodies, shared by every lambda made from one form
+        self.compiled_body = compiled_body
+        # bytecode for the bodies, set by the vm engine
+        self.bytecode = None
+        # the bodies in a begin, for the tree walker
+        self.body = None
 
     def get_args(self):
         return self.args
@@ -145,17 +284,128 @@ class Lambda():
     def get_is_variadic(self):
         return self.is_variadic
 
+    def get_env(self):
+        return self.env
 
-class Delay():
-    def __init__(self, expr):
+    def __getstate__(self):
+        # compiled forms are rebuilt after a lambda is sent to a pmap worker
+        state = dict(self.__dict__)
+        state["compiled_body"] = None
+        state["bytecode"] = None
+        state["body"] = None
+        return state
+
+    def get_body(self):
+        # built on the first call, not on every one
+        if self.body is None:
+            self.body = [BEGIN] + self.bodies
+        return self.body
+
+    def get_compiled_body(self):
+        # lambdas made by the tree walker are compiled on their first call
+        if self.compiled_body is None:
+            self.compiled_body = compile_body(self.bodies, True)
+        return self.compiled_body
+
+
+class Primitive():
+    """
+    builtin operator used as a value, e.g. the + in (apply + (list 1 2))
+    """
+
+    def __init__(self, name, function):
+        super().__init__()
+        self.name = name
+        self.function = function
+
+    def get_name(self):
+        return self.name
+
+    def get_function(self):
+        return self.function
+
+    def __reduce__(self):
+        # builtins are sent to pmap workers by name
+        if BUILTINS.get(self.name) is self:
+            return (BUILTINS.get, (self.name,))
+        return super().__reduce__()
+
+
+class PromiseState():
+    def __init__(self, expr, env, is_lazy, thunk):
         super().__init__()
+        self.is_forced = False
+        self.value = None
         self.expr = expr
+        self.env = env
+        self.is_lazy = is_lazy
+        # python function computing the value instead of expr, for streams
+        self.thunk = thunk
+
+
+class Delay():
+    """
+    promise made by delay, delay-force, make-promise or cons-stream. It is
+    evaluated at most once: forcing keeps the value and drops the
+    expression and frame. A delay-force promise evaluates to another
+    promise, and the two then share one state, so that forcing a chain of
+    them runs in constant space.
+    """
+
+    def __init__(self, expr, env, is_lazy=False, thunk=None):
+        super().__init__()
+        self.state = PromiseState(expr, env, is_lazy, thunk)
 
     def get_expr(self):
-        return self.expr
+        return self.state.expr
+
+    def get_env(self):
+        return self.state.env
+
+    def get_is_lazy(self):
+        return self.state.is_lazy
+
+    def get_thunk(self):
+        return self.state.thunk
+
+    def get_is_forced(self):
+        return self.state.is_forced
+
+    def get_value(self):
+        return self.state.value
+
+    def resolve(self, value):
+        state = self.state
+        state.is_forced = True
+        state.value = value
+        state.expr = None
+        state.env = None
+        state.thunk = None
+
+    def follow(self, promise):
+        """
+        self was a delay-force that evaluated to promise: self takes over
+        promise's state, and promise shares it from now on
+        """
+        assert type(promise) == Delay
+        state = self.state
+        other = promise.state
+        state.is_forced = other.is_forced
+        state.value = other.value
+        state.expr = other.expr
+        state.env = other.env
+        state.is_lazy = other.is_lazy
+        state.thunk = other.thunk
+        promise.state = state
 
 
 class Cons():
+    """
+    pair, and the cell of every list value: a proper list is a chain of
+    Cons ending in the empty list []. Cells are never mutated, so lists
+    share their tails.
+    """
+
     def __init__(self, left, right):
         super().__init__()
         self.left = left
@@ -167,35 +417,101 @@ class Cons():
     def get_right(self):
         return self.right
 
+    def __eq__(self, other):
+        # an explicit stack of the parts left to compare, lists can be long
+        # and nested deeply in their cars as well as their cdrs
+        pairs = [(self, other)]
+        while pairs != []:
+            left, right = pairs.pop()
+            if type(left) == Cons and type(right) == Cons:
+                pairs.append((left.right, right.right))
+                pairs.append((left.left, right.left))
+            elif type(left) == Cons or type(right) == Cons or left != right:
+                return False
+        return True
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # pickles the spine as one python list, rather than recursing
+        elements = []
+        tail = self
+        while type(tail) == Cons:
+            elements.append(tail.left)
+            tail = tail.right
+        return (cons_chain, (elements, tail))
+
+
+def make_list(values):
+    """
+    proper list of the elements of a python sequence, built back to front
+    """
+    return cons_chain(values, [])
+
+
+def cons_chain(values, tail):
+    lst = tail
+    for value in reversed(values):
+        lst = Cons(value, lst)
+    return lst
+
+
+def list_values(lst):
+    """
+    python list of the elements of a proper list, for the places that
+    index or zip their arguments, like map, apply and for
+    """
+    values = []
+    while type(lst) == Cons:
+        values.append(lst.left)
+        lst = lst.right
+    if lst != []:
+        raise RuntimeError(f"Expected a proper list, ending in: {expr_to_str(lst)}.")
+    return values
+
+
+def append_lists(*lsts):
+    # copies every list but the last, which the result shares
+    if lsts == ():
+        return []
+    result = lsts[-1]
+    assert type(result) in [Cons, list]
+    for lst in reversed(lsts[:-1]):
+        for value in reversed(list_values(lst)):
+            result = Cons(value, result)
+    return result
+
+
+def datum(expr):
+    """
+    value of parsed data, as quoted: its lists become proper lists
+    """
+    if type(expr) != list:
+        return expr
+    return make_list([datum(e) for e in expr])
+
 
 class Macro():
-    def __init__(self, args, bodies):
+    """
+    macro known to the expansion phase, never a runtime value. Its template,
+    a lambda with the renamed parameters, is defined once where the macro
+    is, under the fresh name, and uses expand to applications of that name,
+    so the free names of the template are those of the definition site.
+    """
+
+    def __init__(self, name, args, bodies):
         assert type(args) == list
         assert len(args) >= 1
         assert type(bodies) == list
         assert len(bodies) >= 1
         super().__init__()
+        self.name = name
         self.args = args
         self.bodies = bodies
+        self.template = [LAMBDA, args] + bodies
 
-    def replicate(self):
-        # need to process to generate random symbols
-        args = deepcopy(self.args)
-        bodies = deepcopy(self.bodies)
-        sym_map = {}
-        for arg in args:
-            sym_map[arg] = gensym()
-        self.args = [sym_map[arg] for arg in args]
-        new_bodies = []
-        for body in bodies:
-            new_body = []
-            for sym in body:
-                if sym in sym_map:
-                    new_body.append(sym_map[sym])
-                else:
-                    new_body.append(sym)
-            new_bodies.append(new_body)
-        self.bodies = new_bodies
+    def get_name(self):
+        return self.name
 
     def get_args(self):
         return self.args
@@ -203,6 +519,164 @@ class Macro():
     def get_bodies(self):
         return self.bodies
 
+    def get_template(self):
+        return self.template
+
+
+class LocalRef():
+    """
+    variable resolved to slot in the frame depth frames above the current one
+    """
+
+    def __init__(self, name, depth, slot):
+        super().__init__()
+        self.name = name
+        self.depth = depth
+        self.slot = slot
+
+    def get_name(self):
+        return self.name
+
+    def get_depth(self):
+        return self.depth
+
+    def get_slot(self):
+        return self.slot
+
+
+class GlobalRef():
+    """
+    global variable in operator position, made by the resolver for each
+    call site. It caches the value the variable had, and the body of that
+    value if it is a lambda, until a define or set! of any global changes
+    GLOBALS_VERSION, or the site runs with another global context.
+    """
+
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+        # (globals, version, value, body) as one tuple, so that futures
+        # running the same site never see half an update
+        self.entry = None
+
+    def get_name(self):
+        return self.name
+
+    def __reduce__(self):
+        return (GlobalRef, (self.name,))
+
+
+# bumped by every define or set! of a global, see GlobalRef
+GLOBALS_VERSION = 0
+
+
+def set_global(global_ctx, name, value):
+    global GLOBALS_VERSION
+    # written before the bump, see lookup_entry
+    global_ctx[name] = value
+    GLOBALS_VERSION += 1
+
+
+def lookup_entry(ref, ctx):
+    global_ctx = ctx.globals
+    entry = ref.entry
+    if entry is None or entry[1] != GLOBALS_VERSION or entry[0] is not global_ctx:
+        # read before the lookup, so that a racing define invalidates it
+        version = GLOBALS_VERSION
+        value = lookup_global(ref.name, ctx)
+        body = value.get_body() if type(value) == Lambda else None
+        entry = (global_ctx, version, value, body)
+        ref.entry = entry
+    return entry
+
+
+def lookup_ref(ref, ctx):
+    return lookup_entry(ref, ctx)[2]
+
+
+class Frame():
+    """
+    environment frame made by a lambda call, let, for iteration or match
+    clause: a fixed array of slots linked to the enclosing frame. The
+    outermost frame has no slots and refers to the global context dict,
+    where top level define and set! write.
+    """
+
+    def __init__(self, slots, parent, global_ctx=None):
+        super().__init__()
+        self.slots = slots
+        self.parent = parent
+        # call frames are given the globals of the running evaluation
+        if global_ctx is None and parent is not None:
+            global_ctx = parent.globals
+        self.globals = global_ctx
+
+    def lookup(self, depth, slot):
+        frame = self
+        for _ in range(depth):
+            frame = frame.parent
+        return frame.slots[slot]
+
+    def assign(self, depth, slot, value):
+        frame = self
+        for _ in range(depth):
+            frame = frame.parent
+        if frame.globals is not EVAL_GLOBALS.get():
+            check_write(frame.globals, "variable")
+        frame.slots[slot] = value
+
+    def define(self, slot, value):
+        # internal defines get slots past the ones the frame was made with
+        slots = self.slots
+        while len(slots) <= slot:
+            slots.append(None)
+        slots[slot] = value
+
+    def __reduce__(self):
+        # a pmap worker has its own global frame, which stands in for this one
+        if self.parent is None:
+            return (shipped_frame, ())
+        # slots go in the state, as they may hold closures over this frame
+        return (Frame, ([], self.parent), {"slots": self.slots})
+
+
+class TailCall():
+    """
+    expression left to evaluate in tail position. Handlers return it instead
+    of recursing, and the caller loops on it, so that tail calls run in
+    constant python stack. For the closure engine expr is a compiled closure.
+    """
+
+    def __init__(self, expr, ctx):
+        super().__init__()
+        self.expr = expr
+        self.ctx = ctx
+
+
+def global_frame(ctx):
+    assert type(ctx) in [dict, LayeredGlobals]
+    return Frame([], None, ctx)
+
+
+# global context of the evaluation running in this thread or asyncio task,
+# see in_globals
+EVAL_GLOBALS = contextvars.ContextVar("EVAL_GLOBALS", default=None)
+
+
+def in_globals(global_ctx, function, *args):
+    """
+    returns function(*args) evaluated with global_ctx as the global context
+    of every procedure it calls. A call takes its globals from the running
+    evaluation rather than from the frame its procedure was made in, so
+    that the procedures of a base context, run in a fork of it, read and
+    write the fork.
+    """
+    token = EVAL_GLOBALS.set(global_ctx)
+    try:
+        return function(*args)
+    finally:
+        EVAL_GLOBALS.reset(token)
+
 
 def bool_to_str(b):
     assert type(b) == bool
@@ -221,7 +695,35 @@ def lambda_to_str(expr):
     return f'(lambda ({args_str}) {bodies_combined})'
 
 
-def expr_to_str(expr):
+class Vector():
+    """
+    fixed length vector of numbers held in a numpy array, so that the
+    vector primitives and map with builtin arithmetic run as one numpy
+    operation instead of one python call per element
+    """
+
+    def __init__(self, array):
+        super().__init__()
+        self.array = array
+
+    def get_array(self):
+        return self.array
+
+    def __eq__(self, other):
+        return type(other) == Vector and bool(numpy.array_equal(self.array, other.array))
+
+    __hash__ = None
+
+
+QUOTE_PREFIXES = {
+    QUOTE: TICK,
+    QUASIQUOTE: BACKTICK,
+    UNQUOTE: COMMA,
+    UNQUOTE_SPLICING: AT,
+}
+
+
+def atom_to_str(expr):
     if type(expr) == int:
         return str(expr)
     elif type(expr) == bool:
@@ -230,59 +732,237 @@ def expr_to_str(expr):
         return expr
     elif type(expr) == String:
         return f'"{expr.get_string()}"'
+    elif type(expr) == Keyword:
+        return f'{KEYWORD_PREFIX}{expr.get_name()}'
     elif type(expr) == Lambda:
         return lambda_to_str(expr)
-    elif type(expr) == Cons:
-        if PRINT_CONS:
-            return f'(cons {expr_to_str(expr.get_left())} {expr_to_str(expr.get_right())})'
-        else:
-            return f'({expr_to_str(expr.get_left())} . {expr_to_str(expr.get_right())})'
+    elif type(expr) in [LocalRef, GlobalRef]:
+        return expr.get_name()
+    elif type(expr) == Primitive:
+        return f'#[primitive {expr.get_name()}]'
+    elif type(expr) == Vector:
+        return f'#({" ".join(map(expr_to_str, expr.get_array().tolist()))})'
     elif type(expr) == Delay:
+        if expr.get_is_forced():
+            return f'#[promise (forced)]'
         return f'#[promise (unforced)]'
-    elif type(expr) == Macro:
-        raise RuntimeError(
-            f"Macro can never be an evaluated expression: {expr}")
+    elif type(expr) in [Hash, ImmutableHash]:
+        return hash_to_str(expr)
+    elif type(expr) == Future:
+        if expr.get_is_done():
+            return f'#[future (done)]'
+        return f'#[future (running)]'
+    elif type(expr) == Task:
+        if expr.get_is_done():
+            return f'#[task (done)]'
+        return f'#[task (running)]'
+    elif type(expr) == Channel:
+        return f'#[channel ({expr.get_size()})]'
+    raise RuntimeError(f"Cannot print expression: {expr}.")
 
-    assert type(expr) == list
-    if len(expr) == 0:
-        return NIL
 
-    # special forms:
-    head = expr[0]
-    if head == QUOTE:
-        assert len(expr) == 2
-        return f"{TICK}{expr_to_str(expr[1])}"
-    elif head == QUASIQUOTE:
-        assert len(expr) == 2
-        return f"{BACKTICK}{expr_to_str(expr[1])}"
-    elif head == UNQUOTE:
-        assert len(expr) == 2
-        return f"{COMMA}{expr_to_str(expr[1])}"
-    elif head == UNQUOTE_SPLICING:
-        assert len(expr) == 2
-        return f"{AT}{expr_to_str(expr[1])}"
+def expr_to_str(expr):
+    """
+    prints with an explicit stack of (is_text, item) pairs rather than
+    recursion, so that arbitrarily deep cons chains can be printed
+    """
+    output = []
+    stack = [(False, expr)]
+    while stack != []:
+        is_text, expr = stack.pop()
+        if is_text:
+            output.append(expr)
+        elif type(expr) == Cons:
+            elements = []
+            tail = expr
+            while type(tail) == Cons:
+                elements.append(tail.get_left())
+                tail = tail.get_right()
+            if tail != [] or PRINT_CONS:
+                # chains that are not lists print as nested pairs
+                opening, separator = ("(cons ", " ") if PRINT_CONS else ("(", " . ")
+                stack.append((True, ")" * len(elements)))
+                stack.append((False, tail))
+                for element in reversed(elements):
+                    stack.append((True, separator))
+                    stack.append((False, element))
+                    stack.append((True, opening))
+            elif len(elements) == 2 and type(elements[0]) == str and \
+                    elements[0] in QUOTE_PREFIXES:
+                stack.append((False, elements[1]))
+                stack.append((True, QUOTE_PREFIXES[elements[0]]))
+            else:
+                stack.append((True, ")"))
+                for i in range(len(elements) - 1, -1, -1):
+                    stack.append((False, elements[i]))
+                    if i > 0:
+                        stack.append((True, " "))
+                stack.append((True, "("))
+        elif type(expr) != list:
+            output.append(atom_to_str(expr))
+        elif len(expr) == 0:
+            output.append(NIL)
+        # special forms:
+        elif type(expr[0]) == str and expr[0] in QUOTE_PREFIXES:
+            assert len(expr) == 2
+            stack.append((False, expr[1]))
+            stack.append((True, QUOTE_PREFIXES[expr[0]]))
+        else:
+            stack.append((True, ")"))
+            for i in range(len(expr) - 1, -1, -1):
+                stack.append((False, expr[i]))
+                if i > 0:
+                    stack.append((True, " "))
+            stack.append((True, "("))
+    return "".join(output)
 
-    output_lst = []
-    for e in expr:
-        output_lst.append(expr_to_str(e))
-    output = f"({' '.join(output_lst)})"
-    return output
+
+def lookup_global(name, ctx):
+    global_ctx = ctx.globals
+    if name in global_ctx:
+        return global_ctx[name]
+    elif name in BUILTINS:
+        return BUILTINS[name]
+    raise RuntimeError(f"Unbound symbol: {name}.")
+
+
+class ResourceExhausted(RuntimeError):
+    """
+    raised when an evaluation runs out of its Budget, with the resource it
+    ran out of and the steps it had taken
+    """
+
+    def __init__(self, resource, steps):
+        super().__init__(f"Resource exhausted: {resource} after {steps} steps.")
+        self.resource = resource
+        self.steps = steps
+
+
+STEPS = "steps"
+TIME = "time"
+ALLOCATIONS = "allocations"
+
+# steps between looks at the clock and at the allocated memory blocks
+BUDGET_CHECK_INTERVAL = 1024
 
 
-def eval_expr(expr, ctx, in_quasi):
+class Budget():
+    """
+    limits on an evaluation: at most max_steps steps, each an eval_expr
+    call or tail call, seconds of wall clock time, and max_allocations
+    memory blocks allocated beyond those in use when it starts. None is
+    no limit. Steps are counted on every budget, and the limits are only
+    checked every BUDGET_CHECK_INTERVAL steps, so that it is cheap enough
+    to leave on.
+    """
+
+    def __init__(self, max_steps=None, seconds=None, max_allocations=None):
+        super().__init__()
+        self.max_steps = max_steps
+        self.seconds = seconds
+        self.max_allocations = max_allocations
+        self.steps = 0
+        self.deadline = None
+        self.blocks = 0
+        self.next_check = 0
+
+    def get_steps(self):
+        return self.steps
+
+    def start(self):
+        if self.seconds is not None:
+            self.deadline = time.monotonic() + self.seconds
+        self.blocks = sys.getallocatedblocks()
+        self.next_check = self.steps
+        return self
+
+    def charge(self):
+        if self.steps >= self.next_check:
+            self.check()
+        self.steps += 1
+
+    def check(self):
+        if self.max_steps is not None and self.steps >= self.max_steps:
+            raise ResourceExhausted(STEPS, self.steps)
+        elif self.deadline is not None and time.monotonic() > self.deadline:
+            raise ResourceExhausted(TIME, self.steps)
+        elif self.max_allocations is not None and \
+                sys.getallocatedblocks() - self.blocks > self.max_allocations:
+            raise ResourceExhausted(ALLOCATIONS, self.steps)
+        self.next_check = self.steps + BUDGET_CHECK_INTERVAL
+        if self.max_steps is not None:
+            self.next_check = min(self.next_check, self.max_steps)
+
+
+# budget the evaluation running in this thread or asyncio task is charged
+# to, None when it is unlimited, see in_budget
+BUDGET = contextvars.ContextVar("BUDGET", default=None)
+
+
+def in_budget(budget, function, *args):
+    """
+    returns function(*args) charged to budget, a started Budget or None
+    """
+    token = BUDGET.set(budget)
+    try:
+        return function(*args)
+    finally:
+        BUDGET.reset(token)
+
+
+def charge_budget():
+    # one step of the engines that charge procedure calls, see Budget
+    budget = BUDGET.get()
+    if budget is not None:
+        budget.charge()
+
+
+def eval_expr(expr, ctx, in_quasi, budget=None):
+    """
+    evaluates a resolved expression in the frame ctx, see eval_program.
+    With a budget, the evaluation and everything it calls, futures
+    included, are charged to it until it returns. A global context in
+    place of the frame takes a parsed program, as eval_program does.
+    """
+    if type(ctx) != Frame:
+        if type(ctx) not in [dict, LayeredGlobals]:
+            raise RuntimeError(f"Expected a frame or global context to evaluate in: {ctx}.")
+        return eval_program(expr, ctx, budget)
+    if budget is not None:
+        return in_budget(budget.start(), eval_expr, expr, ctx, in_quasi)
+    budget = BUDGET.get()
+    if budget is not None:
+        budget.charge()
+    value = eval_form(expr, ctx, in_quasi)
+    # loop on tail calls instead of growing the python stack
+    while type(value) == TailCall:
+        if budget is not None:
+            budget.charge()
+        value = eval_form(value.expr, value.ctx, in_quasi)
+    return value
+
+
+def eval_form(expr, ctx, in_quasi):
+    """
+    evaluates one form, returning a TailCall for the expression in tail
+    position of if, begin, cond, let, match and applications
+    """
     if type(expr) == int:
         return expr
     elif type(expr) == bool:
         return expr
+    elif type(expr) == LocalRef:
+        return ctx.lookup(expr.depth, expr.slot)
+    elif type(expr) == GlobalRef:
+        return lookup_ref(expr, ctx)
     elif expr == NIL:
         return []
     elif type(expr) == str:
-        if expr in ctx:
-            return ctx[expr]
         # this is a symbol under quasi
-        elif in_quasi:
+        if in_quasi:
             return expr
-    elif type(expr) == String:
+        return lookup_global(expr, ctx)
+    elif type(expr) in [String, Keyword]:
         return expr
 
     assert type(expr) == list
@@ -290,105 +970,19 @@ def eval_expr(expr, ctx, in_quasi):
     assert len(expr) >= 1
 
     first = expr[0]
-    # Named Arithmetic Operators
-    if first == ADD:
-        return eval_add(expr, ctx, in_quasi)
-    elif first == SUB:
-        return eval_sub(expr, ctx, in_quasi)
-    elif first == MUL:
-        return eval_mul(expr, ctx, in_quasi)
-    elif first == DIV:
-        return eval_div(expr, ctx, in_quasi)
-    elif first == EXP:
-        return eval_exp(expr, ctx, in_quasi)
-    elif first == CONCAT:
-        return eval_concat(expr, ctx, in_quasi)
-    # Named Special Forms
-    elif first == QUOTE:
-        return eval_quote(expr, ctx, in_quasi)
-    elif first == PRINTLN:
-        return eval_println(expr, ctx, in_quasi)
-    elif first == SET:
-        return eval_set(expr, ctx, in_quasi)
-    elif first == EQ:
-        return eval_eq(expr, ctx, in_quasi)
-    elif first == QUASIQUOTE:
-        return eval_quasiquote(expr, ctx, in_quasi)
-    elif first == UNQUOTE:
-        return eval_unquote(expr, ctx, in_quasi)
-    elif first == LIST:
-        return eval_list(expr, ctx, in_quasi)
-    elif first == UNQUOTE_SPLICING:
-        return eval_unquotesplicing(expr, ctx, in_quasi)
-    elif first == IF:
-        return eval_if(expr, ctx, in_quasi)
-    elif first == LET:
-        return eval_let(expr, ctx, in_quasi, False)
-    elif first == LETSTAR:
-        return eval_let(expr, ctx, in_quasi, True)
-    elif first == AND:
-        return eval_and(expr, ctx, in_quasi)
-    elif first == OR:
-        return eval_or(expr, ctx, in_quasi)
-    elif first == NEQ:
-        return eval_neq(expr, ctx, in_quasi)
-    elif first == LT:
-        return eval_lt(expr, ctx, in_quasi)
-    elif first == LTE:
-        return eval_lte(expr, ctx, in_quasi)
-    elif first == GT:
-        return eval_gt(expr, ctx, in_quasi)
-    elif first == GTE:
-        return eval_gte(expr, ctx, in_quasi)
-    elif first == NOT:
-        return eval_not(expr, ctx, in_quasi)
-    elif first == BEGIN:
-        return eval_begin(expr, ctx, in_quasi)
-    elif first == DEFINE:
-        return eval_define(expr, ctx, in_quasi)
-    elif first == LAMBDA:
-        return eval_lambda(expr, ctx, in_quasi)
-    elif first == CAR:
-        return eval_car(expr, ctx, in_quasi)
-    elif first == CDR:
-        return eval_cdr(expr, ctx, in_quasi)
-    elif first == CONS:
-        return eval_cons(expr, ctx, in_quasi)
-    elif first == APPLY:
-        return eval_apply(expr, ctx, in_quasi)
-    elif first == MAP:
-        return eval_map(expr, ctx, in_quasi)
-    elif first == DEFINE_MACRO:
-        return eval_define_macro(expr, ctx, in_quasi)
-    elif first == COND:
-        return eval_cond(expr, ctx, in_quasi)
-    elif first == FOR:
-        return eval_for(expr, ctx, in_quasi, False)
-    elif first == FORLIST:
-        return eval_for(expr, ctx, in_quasi, True)
-    elif first == DELAY:
-        return eval_delay(expr, ctx, in_quasi)
-    elif first == FORCE:
-        return eval_force(expr, ctx, in_quasi)
-    elif first == CONS_STREAM:
-        return eval_consstream(expr, ctx, in_quasi)
-    elif first == CDR_STREAM:
-        return eval_cdrstream(expr, ctx, in_quasi)
-    elif first == APPEND:
-        return eval_append(expr, ctx, in_quasi)
-    elif first == MATCH:
-        return eval_match(expr, ctx, in_quasi)
-    # match on a macro
-    elif type(first) != list and first in ctx and type(ctx[first]) == Macro:
-        return eval_macro(expr, ctx, in_quasi)
+    # calls of global procedures skip the special form table
+    if type(first) == GlobalRef:
+        return eval_app(expr, ctx, in_quasi)
+    elif type(first) == str:
+        # symbols are interned, so the lookup compares by identity
+        evaluator = EVALUATORS.get(first)
+        if evaluator is not None:
+            return evaluator(expr, ctx, in_quasi)
     # return forms that are quasiquoted, comes before application
-    elif in_quasi:
+    if in_quasi:
         return eval_in_quasi_return(expr, ctx, in_quasi)
     # forms that are applications
-    elif len(expr) >= 1:
-        return eval_app(expr, ctx, in_quasi)
-    else:
-        raise RuntimeError(f"Expression could not be matched: {expr}.")
+    return eval_app(expr, ctx, in_quasi)
 
 
 def eval_in_quasi_return(expr, ctx, in_quasi):
@@ -398,11 +992,11 @@ def eval_in_quasi_return(expr, ctx, in_quasi):
         if type(v) == tuple:
             assert len(v) == 2 and v[1] == True
             vals, _ = v
-            for value in vals:
+            for value in list_values(vals):
                 lst.append(value)
         else:
             lst.append(v)
-    return lst
+    return make_list(lst)
 
 
 def eval_add(expr, ctx, in_quasi):
@@ -558,11 +1152,13 @@ def eval_set(expr, ctx, in_quasi):
     if in_quasi:
         return handle_quasi(expr, ctx, in_quasi)
     var = expr[1]
-    # var must be a python string
-    assert type(var) == str
     val = eval_expr(expr[2], ctx, in_quasi)
-    # mutate context
-    ctx[var] = val
+    # mutate the frame the variable resolved to, else the global context
+    if type(var) == LocalRef:
+        ctx.assign(var.get_depth(), var.get_slot(), val)
+    else:
+        assert type(var) == str
+        set_global(ctx.globals, var, val)
     return 0
 
 
@@ -589,8 +1185,8 @@ def eval_quasiquote(expr, ctx, in_quasi):
     assert expr[0] == QUASIQUOTE
     if in_quasi:
         # if quasiquote nested within quasiquote, just return expr
-        return expr
-    return eval_expr(expr[1], ctx, True)
+        return datum(expr)
+    return fill_template(expr[1], lambda e: eval_expr(e, ctx, False))
 
 
 def eval_unquotesplicing(expr, ctx, in_quasi):
@@ -607,14 +1203,14 @@ def eval_unquotesplicing(expr, ctx, in_quasi):
 
 
 def eval_list(expr, ctx, in_quasi):
-    assert len(expr) >= 2
+    assert len(expr) >= 1
     assert expr[0] == LIST
     if in_quasi:
         return handle_quasi(expr, ctx, in_quasi)
     lst = []
     for sub_expr in expr[1:]:
         lst.append(eval_expr(sub_expr, ctx, in_quasi))
-    return lst
+    return make_list(lst)
 
 
 def eval_if(expr, ctx, in_quasi):
@@ -625,8 +1221,8 @@ def eval_if(expr, ctx, in_quasi):
     b = eval_expr(expr[1], ctx, in_quasi)
     # require to be explicitly true
     if b == True:
-        return eval_expr(expr[2], ctx, in_quasi)
-    return eval_expr(expr[3], ctx, in_quasi)
+        return TailCall(expr[2], ctx)
+    return TailCall(expr[3], ctx)
 
 
 def eval_let(expr, ctx, in_quasi, update_let):
@@ -637,20 +1233,18 @@ def eval_let(expr, ctx, in_quasi, update_let):
     if in_quasi:
         return handle_quasi(expr, ctx, in_quasi)
     bindings = expr[1]
-    for binding in bindings:
-        assert type(binding) == list
-        assert len(binding) == 2
-        (name, e) = binding
-        if update_let:
-            ctx[name] = eval_expr(e, ctx, in_quasi)
-        else:
-            if name not in ctx:
-                ctx[name] = eval_expr(e, ctx, in_quasi)
+    # the resolver gives each binding the slot of its position
+    if update_let:
+        let_ctx = Frame([None] * len(bindings), ctx)
+        for slot, (_, e) in enumerate(bindings):
+            let_ctx.slots[slot] = eval_expr(e, let_ctx, in_quasi)
+    else:
+        values = [eval_expr(e, ctx, in_quasi) for (_, e) in bindings]
+        let_ctx = Frame(values, ctx)
     bodies = expr[2:]
-    v = None
-    for body in bodies:
-        v = eval_expr(body, ctx, in_quasi)
-    return v
+    for body in bodies[:-1]:
+        eval_expr(body, let_ctx, in_quasi)
+    return TailCall(bodies[-1], let_ctx)
 
 
 def eval_and(expr, ctx, in_quasi):
@@ -698,10 +1292,37 @@ def eval_begin(expr, ctx, in_quasi):
     assert expr[0] == BEGIN
     if in_quasi:
         return handle_quasi(expr, ctx, in_quasi)
-    v = None
-    for e in expr[1:]:
-        v = eval_expr(e, ctx, in_quasi)
-    return v
+    for e in expr[1:-1]:
+        eval_expr(e, ctx, in_quasi)
+    return TailCall(expr[-1], ctx)
+
+
+def parse_params(params):
+    """
+    returns the parameter names and whether the last one is variadic
+    """
+    final_params = []
+    is_variadic = False
+    if params == NIL:
+        # (lambda () ...) has parameters parsed as nil
+        params = []
+    for i, param in enumerate(params):
+        if i != len(params) - 1:
+            assert type(param) == str
+            final_params.append(param)
+        else:
+            # last argument can be called Variadic
+            if type(param) == list:
+                assert len(param) == 2
+                fst, snd = param
+                assert fst == VARIADIC
+                assert type(snd) == str
+                is_variadic = True
+                final_params.append(snd)
+            else:
+                assert type(param) == str
+                final_params.append(param)
+    return final_params, is_variadic
 
 
 def eval_define(expr, ctx, in_quasi):
@@ -712,47 +1333,28 @@ def eval_define(expr, ctx, in_quasi):
         return handle_quasi(expr, ctx, in_quasi)
     names = expr[1]
     if type(names) == list and len(names) >= 1:
-        # is a functional define
-        final_args = None
-        is_variadic = False
-        function_name = None
-        # no arguments functional define
-        if len(names) == 1:
-            final_args = []
-            is_variadic = False
-            function_name = names[0]
-        else:
-            assert len(names) >= 2
-            function_name = names[0]
-            args = names[1:]
-            is_variadic = False
-            final_args = []
-            for i, arg in enumerate(args):
-                if i != len(args) - 1:
-                    assert type(arg) == str
-                    final_args.append(arg)
-                else:
-                    # last argument can be called Variadic
-                    if type(arg) == list:
-                        assert len(arg) == 2
-                        fst, snd = arg
-                        assert fst == VARIADIC
-                        assert type(snd) == str
-                        is_variadic = True
-                        final_args.append(snd)
-                    else:
-                        assert type(arg) == str
-                        final_args.append(arg)
+        # is a functional define, possibly with no arguments
+        function_name = names[0]
+        final_args, is_variadic = parse_params(names[1:])
         bodies = expr[2:]
-        ctx[function_name] = Lambda(final_args, bodies, is_variadic)
-        return function_name
+        return define_name(function_name, Lambda(final_args, bodies, is_variadic, ctx), ctx)
     else:
         # variable define
-        assert type(names) == str
-        e = expr[2]
         assert expr[3:] == []
-        ctx[names] = eval_expr(expr[2], ctx, in_quasi)
-        return names
+        return define_name(names, eval_expr(expr[2], ctx, in_quasi), ctx)
+
+
+def define_name(name, value, ctx):
+    """
+    binds name in the current frame if the resolver made it local,
+    else in the global context, and returns the defined name
+    """
+    if type(name) == LocalRef:
+        ctx.define(name.get_slot(), value)
+        return name.get_name()
+    assert type(name) == str
+    set_global(ctx.globals, name, value)
+    return name
 
 
 def eval_lambda(expr, ctx, in_quasi):
@@ -761,27 +1363,9 @@ def eval_lambda(expr, ctx, in_quasi):
     assert expr[0] == LAMBDA
     if in_quasi:
         return handle_quasi(expr, ctx, in_quasi)
-    params = expr[1]
-    final_params = []
-    is_variadic = False
-    for i, param in enumerate(params):
-        if i != len(params) - 1:
-            assert type(param) == str
-            final_params.append(param)
-        else:
-            # last argument can be called Variadic
-            if type(param) == list:
-                assert len(param) == 2
-                fst, snd = param
-                assert fst == VARIADIC
-                assert type(snd) == str
-                is_variadic = True
-                final_params.append(snd)
-            else:
-                assert type(param) == str
-                final_params.append(param)
+    final_params, is_variadic = parse_params(expr[1])
     bodies = expr[2:]
-    return Lambda(final_params, bodies, is_variadic)
+    return Lambda(final_params, bodies, is_variadic, ctx)
 
 
 def eval_app(expr, ctx, in_quasi):
@@ -789,29 +1373,56 @@ def eval_app(expr, ctx, in_quasi):
     assert len(expr) >= 1
     if in_quasi:
         return handle_quasi(expr, ctx, in_quasi)
-    _lambda = eval_expr(expr[0], ctx, in_quasi)
+    operator = expr[0]
+    if type(operator) == GlobalRef:
+        # the call site caches the procedure and its body
+        _, _, _lambda, body = lookup_entry(operator, ctx)
+        args = [eval_expr(a, ctx, in_quasi) for a in expr[1:]]
+        if body is not None:
+            return TailCall(body, bind_args(_lambda, args))
+    else:
+        _lambda = eval_expr(operator, ctx, in_quasi)
+        args = [eval_expr(a, ctx, in_quasi) for a in expr[1:]]
+    if type(_lambda) == Primitive:
+        return _lambda.get_function()(*args)
     assert type(_lambda) == Lambda
-    args = list(map(lambda a: eval_expr(a, ctx, in_quasi), expr[1:]))
+    return TailCall(_lambda.get_body(), bind_args(_lambda, args))
+
+
+def bind_args(_lambda, args):
+    """
+    returns the frame for a call of _lambda on the argument values args,
+    with one slot per parameter
+    """
     param_names = _lambda.get_args()
     is_variadic = _lambda.get_is_variadic()
     if (not is_variadic and len(param_names) != len(args)) or len(param_names) > len(args):
         raise RuntimeError(
             f"Arities Mismatch in application: expected: {len(param_names)}, got {len(args)} instead.")
-    bodies = _lambda.get_bodies()
-    bodies_w_begin = [BEGIN] + bodies
-    if (not is_variadic):
-        for (param, arg) in zip(param_names, args):
-            assert type(param) == str
-            ctx[param] = arg
-        return eval_expr(bodies_w_begin, ctx, in_quasi)
+    # outside of in_globals, say in a pmap worker, calls keep the globals
+    # of the procedure
+    global_ctx = EVAL_GLOBALS.get()
+    if not is_variadic:
+        return Frame(args, _lambda.get_env(), global_ctx)
     common_length = len(param_names)
-    for (param, arg) in zip(param_names[:common_length - 1], args[:common_length - 1]):
-        assert type(param) == str
-        ctx[param] = arg
     # variadic part
-    ctx[param_names[common_length - 1]
-        ] = eval_expr([LIST] + args[common_length - 1:], ctx, in_quasi)
-    return eval_expr(bodies_w_begin, ctx, in_quasi)
+    slots = args[:common_length - 1] + [make_list(args[common_length - 1:])]
+    return Frame(slots, _lambda.get_env(), global_ctx)
+
+
+def apply_procedure(procedure, args):
+    """
+    applies a procedure value to already evaluated arguments, a lambda
+    runs on the engine that compiled it, if any
+    """
+    if type(procedure) == Primitive:
+        return procedure.get_function()(*args)
+    assert type(procedure) == Lambda
+    frame = bind_args(procedure, args)
+    if procedure.compiled_body is not None:
+        charge_budget()
+        return run_compiled(procedure.compiled_body, frame)
+    return eval_expr(procedure.get_body(), frame, False)
 
 
 def eval_cons(expr, ctx, in_quasi):
@@ -853,297 +1464,3278 @@ def eval_apply(expr, ctx, in_quasi):
     assert expr[0] == APPLY
     if in_quasi:
         return handle_quasi(expr, ctx, in_quasi)
-    function = expr[1]
-    lst = []
+    function = eval_expr(expr[1], ctx, in_quasi)
+    args = []
     for a in expr[2:-1]:
-        lst.append(a)
+        args.append(eval_expr(a, ctx, in_quasi))
+    # last arg must be a list
+    lst = eval_expr(expr[-1], ctx, in_quasi)
+    return apply_procedure(function, args + list_values(lst))
+
+
+def eval_map(expr, ctx, in_quasi):
+    assert type(expr) == list
+    assert len(expr) >= 3
+    assert expr[0] == MAP
+    if in_quasi:
+        return handle_quasi(expr, ctx, in_quasi)
+    function = eval_expr(expr[1], ctx, in_quasi)
+    lists = []
+    for lst in expr[2:]:
+        lists.append(eval_expr(lst, ctx, in_quasi))
+    return map_procedure(function, lists)
+
+
+def map_procedure(function, lists):
     # last arg must be a list
-    lst += eval_expr(expr[-1], ctx, in_quasi)
-    new_expr = [function] + lst
+    assert len(lists) > 0
+    if type(lists[0]) == Vector:
+        return vector_map(function, *lists)
+    lists = [list_values(lst) for lst in lists]
+    l = len(lists[0])
+    for lst in lists:
+        assert len(lst) == l
+    return make_list([apply_procedure(function, list(tup)) for tup in zip(*lists)])
+
+
+def eval_delay(expr, ctx, in_quasi, is_lazy):
+    assert type(expr) == list
+    assert len(expr) == 2
+    assert expr[0] in [DELAY, DELAY_FORCE]
+    if in_quasi:
+        return handle_quasi(expr, ctx, in_quasi)
+    return Delay(expr[1], ctx, is_lazy)
+
+
+def eval_future(expr, ctx, in_quasi):
+    assert type(expr) == list
+    assert len(expr) == 2
+    assert expr[0] == FUTURE
+    if in_quasi:
+        return handle_quasi(expr, ctx, in_quasi)
+    child = child_frame(ctx)
+    return future_of(child.globals, eval_expr, expr[1], child, False)
+
+
+def eval_consstream(expr, ctx, in_quasi):
+    assert type(expr) == list
+    assert len(expr) == 3
+    assert expr[0] == CONS_STREAM
+    if in_quasi:
+        return handle_quasi(expr, ctx, in_quasi)
+    new_expr = [CONS, expr[1], [DELAY, expr[2]]]
+    return eval_expr(new_expr, ctx, in_quasi)
+
+
+def eval_cdrstream(expr, ctx, in_quasi):
+    assert type(expr) == list
+    assert len(expr) == 2
+    assert expr[0] == CDR_STREAM
+    if in_quasi:
+        return handle_quasi(expr, ctx, in_quasi)
+    new_expr = [FORCE, [CDR, expr[1]]]
     return eval_expr(new_expr, ctx, in_quasi)
 
 
-def eval_map(expr, ctx, in_quasi):
-    assert type(expr) == list
+def eval_force(expr, ctx, in_quasi):
+    assert type(expr) == list
+    assert len(expr) == 2
+    assert expr[0] == FORCE
+    if in_quasi:
+        return handle_quasi(expr, ctx, in_quasi)
+    delay_expr = eval_expr(expr[1], ctx, in_quasi)
+    return force_delay(delay_expr)
+
+
+def force_delay(delay_expr):
+    assert type(delay_expr) == Delay
+    while not delay_expr.get_is_forced():
+        thunk = delay_expr.get_thunk()
+        if thunk is not None:
+            value = thunk()
+        else:
+            value = eval_expr(delay_expr.get_expr(),
+                              delay_expr.get_env(), False)
+        settle_promise(delay_expr, value)
+    return delay_expr.get_value()
+
+
+def settle_promise(promise, value):
+    """
+    records the value promise's expression evaluated to. A delay-force
+    promise is left unforced when it took over an unforced promise, and
+    forcing loops on it.
+    """
+    if promise.get_is_forced():
+        # forced again while its expression was evaluated, first value wins
+        return
+    elif promise.get_is_lazy():
+        promise.follow(value)
+    else:
+        promise.resolve(value)
+
+
+def make_promise(value):
+    if type(value) == Delay:
+        return value
+    promise = Delay(None, None)
+    promise.resolve(value)
+    return promise
+
+
+def iterate_stream(s):
+    """
+    yields the elements of a stream made by cons-stream or by the stream
+    library, forcing one tail at a time. Consumed cells are not kept.
+    A list is a finite stream.
+    """
+    while type(s) == Cons:
+        yield s.get_left()
+        s = s.get_right()
+        if type(s) == Delay:
+            s = force_delay(s)
+    assert type(s) == list
+    yield from s
+
+
+def generator_stream(values):
+    """
+    stream of the values of a python iterator: each cell's tail is a
+    promise that takes the next value when forced
+    """
+    for value in values:
+        return Cons(value, Delay(None, None, False, lambda: generator_stream(values)))
+    return []
+
+
+def stream_map(function, *streams):
+    assert len(streams) > 0
+    rows = zip(*map(iterate_stream, streams))
+    return generator_stream(apply_procedure(function, list(row)) for row in rows)
+
+
+def stream_filter(predicate, s):
+    def kept(values):
+        for value in values:
+            keep = apply_procedure(predicate, [value])
+            assert type(keep) == bool
+            if keep:
+                yield value
+    # the head is not captured, so cells already filtered can be freed
+    return generator_stream(kept(iterate_stream(s)))
+
+
+def stream_take(n, s):
+    assert type(n) == int and n >= 0
+    return generator_stream(islice(iterate_stream(s), n))
+
+
+def stream_to_list(s):
+    return make_list(list(iterate_stream(s)))
+
+
+def integers_from(n):
+    assert type(n) == int
+    return generator_stream(count(n))
+
+
+# builtin operators that run elementwise over whole arrays as numpy ufuncs
+VECTOR_UFUNCS = {} if numpy is None else {
+    ADD: numpy.add,
+    SUB: numpy.subtract,
+    MUL: numpy.multiply,
+    EQ: numpy.equal,
+    NEQ: numpy.not_equal,
+    LT: numpy.less,
+    GT: numpy.greater,
+    LTE: numpy.less_equal,
+    GTE: numpy.greater_equal,
+    NOT: numpy.logical_not,
+}
+
+
+def vector_ufunc(function, arrays):
+    """
+    ufunc doing what function does to the elements of arrays, or None when
+    function is not builtin arithmetic. +, - and * take more than two
+    arguments by folding the ufunc over them, and only int64 arrays, since
+    numpy adds and multiplies bools as logical or and and.
+    """
+    if type(function) != Primitive or function.get_name() not in VECTOR_UFUNCS:
+        return None
+    name = function.get_name()
+    if name in [ADD, SUB, MUL] and any(array.dtype != numpy.int64 for array in arrays):
+        return None
+    ufunc = VECTOR_UFUNCS[name]
+    n = len(arrays)
+    if ufunc.nin == n or (n > 2 and name in [ADD, SUB, MUL]):
+        return ufunc
+    return None
+
+
+def array_of(values):
+    """
+    int64 array of a python list of integers, or bool array of one of
+    booleans, as comparisons of vectors make. Anything else, mixes of the
+    two included, is an error rather than an object array.
+    """
+    if numpy is None:
+        raise RuntimeError("Vectors need numpy, install it with: pip3 install numpy.")
+    if all(type(value) == int for value in values):
+        try:
+            return numpy.array(values, dtype=numpy.int64)
+        except OverflowError:
+            raise_overflow(values)
+    elif all(type(value) == bool for value in values):
+        return numpy.array(values, dtype=bool)
+    raise RuntimeError(
+        f"Vector elements must be all integers or all booleans: {expr_to_str(make_list(values))}.")
+
+
+def raise_overflow(values):
+    raise RuntimeError(
+        f"Vector elements must fit in 64 bits: {expr_to_str(make_list(values))}.")
+
+
+def vector_array(v):
+    assert type(v) == Vector
+    return v.get_array()
+
+
+def make_vector(n, fill=0):
+    assert type(n) == int and n >= 0
+    assert type(fill) in [int, bool]
+    # numpy would hold a fill past 64 bits in an object array
+    array = array_of([fill])
+    return Vector(numpy.full(n, fill, dtype=array.dtype))
+
+
+def vector_ref(v, i):
+    array = vector_array(v)
+    assert type(i) == int
+    if not 0 <= i < len(array):
+        raise RuntimeError(f"Vector index {i} out of range for length {len(array)}.")
+    return array[i].item()
+
+
+def vector_map(function, *vectors):
+    assert len(vectors) > 0
+    arrays = [vector_array(v) for v in vectors]
+    for array in arrays:
+        assert len(array) == len(arrays[0])
+    ufunc = vector_ufunc(function, arrays)
+    if ufunc is not None:
+        return Vector(reduce(ufunc, arrays) if len(arrays) > 1 else ufunc(arrays[0]))
+    rows = zip(*[array.tolist() for array in arrays])
+    return Vector(array_of([apply_procedure(function, list(row)) for row in rows]))
+
+
+def vector_arithmetic(ufunc, operands):
+    # numbers among the operands are broadcast over the vectors
+    assert any(type(operand) == Vector for operand in operands)
+    arrays = []
+    for operand in operands:
+        assert type(operand) in [Vector, int]
+        if type(operand) == Vector:
+            assert operand.get_array().dtype == numpy.int64
+            arrays.append(operand.get_array())
+        else:
+            arrays.append(operand)
+    try:
+        return Vector(reduce(ufunc, arrays))
+    except OverflowError:
+        raise_overflow([operand for operand in operands if type(operand) == int])
+
+
+def vector_dot(v, w):
+    assert len(vector_array(v)) == len(vector_array(w))
+    return numpy.dot(v.get_array(), w.get_array()).item()
+
+
+def vector_fold(function, initial, v):
+    """
+    left fold, (function acc element), of v starting from initial
+    """
+    array = vector_array(v)
+    ufunc = vector_ufunc(function, [array, array])
+    if ufunc is not None and function.get_name() in [ADD, SUB, MUL] and \
+            type(initial) == int and -2 ** 63 <= initial < 2 ** 63:
+        return ufunc.reduce(array, initial=initial).item()
+    acc = initial
+    for value in array.tolist():
+        acc = apply_procedure(function, [acc, value])
+    return acc
+
+
+def eval_cond(expr, ctx, in_quasi):
+    assert type(expr) == list
+    assert len(expr) >= 2
+    assert expr[0] == COND
+    if in_quasi:
+        return handle_quasi(expr, ctx, in_quasi)
+    clauses = expr[1:]
+    for i, clause in enumerate(clauses):
+        assert type(clause) == list
+        assert len(clause) == 2
+        test, e = clause
+        if test == ELSE and i != len(clauses) - 1:
+            raise RuntimeError(f"Else must be last condition in cond: {expr}.")
+        if test == ELSE:
+            return TailCall(e, ctx)
+        b = eval_expr(test, ctx, in_quasi)
+        assert type(b) == bool
+        # if true on condition, evaluate other side
+        if b:
+            return TailCall(e, ctx)
+    # undefined return on no matching conditions
+    return 0
+
+
+def eval_for(expr, ctx, in_quasi, is_forlist):
+    assert type(expr) == list
+    assert len(expr) >= 3
+    assert (expr[0] == FOR and not is_forlist) or (
+        expr[0] == FORLIST and is_forlist)
+    if in_quasi:
+        return handle_quasi(expr, ctx, in_quasi)
+    bindings = expr[1]
+    bodies = expr[2:]
+    new_bodies = [BEGIN] + bodies
+    lists = []
+    for binding in bindings:
+        assert type(binding) == list
+        assert len(binding) == 2
+        var, lst = binding
+        assert type(var) == str
+        value_lst = eval_expr(lst, ctx, in_quasi)
+        lists.append(list_values(value_lst))
+    final_list = []
+    for values in zip(*lists):
+        # fresh frame for each iteration, one slot per variable
+        final_val = eval_expr(new_bodies, Frame(list(values), ctx), in_quasi)
+        final_list.append(final_val)
+    if is_forlist:
+        return make_list(final_list)
+    # for does not return list
+    return 0
+
+
+def eval_append(expr, ctx, in_quasi):
+    assert type(expr) == list
+    assert len(expr) >= 3
+    assert expr[0] == APPEND
+    if in_quasi:
+        return handle_quasi(expr, ctx, in_quasi)
+    lists = expr[1:]
+    evaluated_lists = []
+    for lst in lists:
+        evaluated_lists.append(eval_expr(lst, ctx, in_quasi))
+    return append_lists(*evaluated_lists)
+
+
+# kinds of normalized patterns, see normal_pattern
+WILD, BIND, EMPTY, PAIR, LITERAL = range(5)
+
+
+def normal_pattern(pattern, order):
+    """
+    resolved pattern as a tuple of its kind and parts: (WILD,),
+    (BIND, slot, n), (EMPTY,), (PAIR, car, cdr) or (LITERAL, value). list
+    patterns become chains of pairs ending in EMPTY, and quoted data the
+    patterns that match it, so that every test is of one cons, nil or
+    literal. Variables are numbered left to right from the count order, so
+    that the rightmost of repeated ones is bound last. None for a pattern
+    that matches nothing.
+    """
+    if type(pattern) != list:
+        if pattern == UNDERSCORE:
+            return (WILD,)
+        elif pattern == NIL:
+            return (EMPTY,)
+        # pattern variables are resolved to slots of the clause frame
+        elif type(pattern) == LocalRef:
+            return (BIND, pattern.get_slot(), next(order))
+        return (LITERAL, pattern)
+
+    assert len(pattern) >= 2
+    head = pattern[0]
+    if head == QUOTE:
+        assert len(pattern) == 2
+        return datum_pattern(pattern[1])
+    elif head == LIST:
+        normal = (EMPTY,)
+        for p in reversed([normal_pattern(p, order) for p in pattern[1:]]):
+            normal = pair_pattern(p, normal)
+        return normal
+    elif head == CONS:
+        assert len(pattern) >= 3
+        car = normal_pattern(pattern[1], order)
+        return pair_pattern(car, normal_pattern(pattern[2], order))
+    return None
+
+
+def pair_pattern(car, cdr):
+    if car is None or cdr is None:
+        return None
+    return (PAIR, car, cdr)
+
+
+def datum_pattern(datum):
+    if type(datum) == Cons:
+        return (PAIR, datum_pattern(datum.left), datum_pattern(datum.right))
+    elif datum == []:
+        return (EMPTY,)
+    return (LITERAL, datum)
+
+
+class MatchLeaf():
+    """
+    end of a decision tree: the clause that matched, and the (slot,
+    register) pairs its pattern variables are bound from
+    """
+
+    def __init__(self, clause, bindings):
+        super().__init__()
+        self.clause = clause
+        self.bindings = bindings
+
+
+class MatchSwitch():
+    """
+    test of one register of a decision tree. A cons goes on to pair, after
+    its car and cdr are pushed as the next two registers, nil to empty, a
+    literal to the tree of the equal key of literals, and any other value,
+    or one without a branch of its own, to otherwise. None for no match.
+    """
+
+    def __init__(self, register, pair, empty, literals, otherwise):
+        super().__init__()
+        self.register = register
+        self.pair = pair
+        self.empty = empty
+        self.literals = literals
+        self.otherwise = otherwise
+
+
+def match_tree(patterns):
+    """
+    compiles the patterns of a match, in order, into a decision tree that
+    tests each part of the value once, however many clauses test it
+    """
+    rows = []
+    for clause, pattern in enumerate(patterns):
+        normal = normal_pattern(pattern, count())
+        if normal is not None:
+            rows.append(([normal], clause, ()))
+    return decision_tree(rows, [0], 1)
+
+
+def decision_tree(rows, registers, size):
+    """
+    rows are the patterns left to test of the clauses that can still match,
+    in order, with their (n, slot, register) bindings so far, see
+    normal_pattern. registers are the registers the columns of patterns
+    test, and size the number of registers set when the tree runs.
+    """
+    if rows == []:
+        return None
+    patterns, clause, bindings = rows[0]
+    tested = [i for (i, p) in enumerate(patterns) if p[0] not in [WILD, BIND]]
+    if tested == []:
+        # the first clause left matches whatever is in the registers
+        binds = [(p[2], p[1], registers[i]) for (i, p) in enumerate(patterns) if p[0] == BIND]
+        return MatchLeaf(clause, tuple((slot, r) for (_, slot, r) in sorted(bindings + tuple(binds))))
+    column = tested[0]
+    register = registers[column]
+    rest = registers[:column] + registers[column + 1:]
+    kinds = set()
+    literal_rows = {}
+    for patterns, _, _ in rows:
+        kinds.add(patterns[column][0])
+        if patterns[column][0] == LITERAL:
+            literal_rows.setdefault(patterns[column][1], [])
+    pair_rows = []
+    empty_rows = []
+    other_rows = []
+    for patterns, clause, bindings in rows:
+        p = patterns[column]
+        others = patterns[:column] + patterns[column + 1:]
+        if p[0] == BIND:
+            bindings = bindings + ((p[2], p[1], register),)
+        if p[0] in [WILD, BIND]:
+            # clauses that do not test the register go down every branch
+            pair_rows.append((others + [(WILD,), (WILD,)], clause, bindings))
+            empty_rows.append((others, clause, bindings))
+            for literal in literal_rows:
+                literal_rows[literal].append((others, clause, bindings))
+            other_rows.append((others, clause, bindings))
+        elif p[0] == PAIR:
+            pair_rows.append((others + [p[1], p[2]], clause, bindings))
+        elif p[0] == EMPTY:
+            empty_rows.append((others, clause, bindings))
+        else:
+            literal_rows[p[1]].append((others, clause, bindings))
+    otherwise = decision_tree(other_rows, rest, size)
+    pair = None
+    if PAIR in kinds:
+        pair = decision_tree(pair_rows, rest + [size, size + 1], size + 2)
+    empty = otherwise
+    if EMPTY in kinds:
+        empty = decision_tree(empty_rows, rest, size)
+    literals = {literal: decision_tree(literal_rows[literal], rest, size)
+                for literal in literal_rows}
+    return MatchSwitch(register, pair, empty, literals, otherwise)
+
+
+def run_match_tree(tree, value, ctx):
+    """
+    returns the index of the first clause whose pattern matches value, and
+    a frame over ctx with its pattern variables bound, else None
+    """
+    registers = [value]
+    node = tree
+    while type(node) == MatchSwitch:
+        value = registers[node.register]
+        if type(value) == Cons:
+            if node.pair is not None:
+                registers.append(value.left)
+                registers.append(value.right)
+                node = node.pair
+                continue
+        elif value == []:
+            node = node.empty
+            continue
+        elif node.literals:
+            try:
+                node = node.literals[value]
+                continue
+            except (KeyError, TypeError):
+                pass
+        node = node.otherwise
+    if node is None:
+        return None
+    clause_ctx = Frame([], ctx)
+    for slot, register in node.bindings:
+        clause_ctx.define(slot, registers[register])
+    return node.clause, clause_ctx
+
+
+class MatchForm():
+    """
+    resolved clauses of a match, [MATCH, expr, MatchForm(clauses)], with
+    the decision tree of their patterns, compiled once by the resolver,
+    and their bodies as begin forms
+    """
+
+    def __init__(self, clauses):
+        super().__init__()
+        for clause in clauses:
+            assert type(clause) == list
+            assert len(clause) >= 2
+        self.clauses = clauses
+        self.tree = match_tree([clause[0] for clause in clauses])
+        self.bodies = [[BEGIN] + clause[1:] for clause in clauses]
+
+    def get_clauses(self):
+        return self.clauses
+
+    def get_tree(self):
+        return self.tree
+
+    def get_bodies(self):
+        return self.bodies
+
+
+def eval_match(expr, ctx, in_quasi):
+    assert type(expr) == list
+    assert len(expr) == 3
+    assert expr[0] == MATCH
+    if in_quasi:
+        return handle_quasi(expr, ctx, in_quasi)
+    tree, bodies = expr[2].get_tree(), expr[2].get_bodies()
+    val = eval_expr(expr[1], ctx, in_quasi)
+    matched = run_match_tree(tree, val, ctx)
+    if matched is None:
+        # no match , return any value, say 0
+        return 0
+    clause, clause_ctx = matched
+    return TailCall(bodies[clause], clause_ctx)
+
+
+def handle_quasi(expr, ctx, in_quasi):
+    assert type(expr) == list
+    assert len(expr) > 1
+    remainder = []
+    for e in expr:
+        v = eval_expr(e, ctx, in_quasi)
+        if type(v) == tuple:
+            assert len(v) == 2
+            (lst, _) = v
+            for elt in list_values(lst):
+                remainder.append(elt)
+        else:
+            remainder.append(v)
+    return make_list(remainder)
+
+
+# handlers of the special forms, which eval_form dispatches on
+EVALUATORS = {
+    ADD: eval_add,
+    SUB: eval_sub,
+    MUL: eval_mul,
+    DIV: eval_div,
+    EXP: eval_exp,
+    CONCAT: eval_concat,
+    QUOTE: eval_quote,
+    PRINTLN: eval_println,
+    SET: eval_set,
+    EQ: eval_eq,
+    QUASIQUOTE: eval_quasiquote,
+    UNQUOTE: eval_unquote,
+    LIST: eval_list,
+    UNQUOTE_SPLICING: eval_unquotesplicing,
+    IF: eval_if,
+    LET: lambda expr, ctx, in_quasi: eval_let(expr, ctx, in_quasi, False),
+    LETSTAR: lambda expr, ctx, in_quasi: eval_let(expr, ctx, in_quasi, True),
+    AND: eval_and,
+    OR: eval_or,
+    NEQ: eval_neq,
+    LT: eval_lt,
+    LTE: eval_lte,
+    GT: eval_gt,
+    GTE: eval_gte,
+    NOT: eval_not,
+    BEGIN: eval_begin,
+    DEFINE: eval_define,
+    LAMBDA: eval_lambda,
+    CAR: eval_car,
+    CDR: eval_cdr,
+    CONS: eval_cons,
+    APPLY: eval_apply,
+    MAP: eval_map,
+    COND: eval_cond,
+    FOR: lambda expr, ctx, in_quasi: eval_for(expr, ctx, in_quasi, False),
+    FORLIST: lambda expr, ctx, in_quasi: eval_for(expr, ctx, in_quasi, True),
+    DELAY: lambda expr, ctx, in_quasi: eval_delay(expr, ctx, in_quasi, False),
+    DELAY_FORCE: lambda expr, ctx, in_quasi: eval_delay(expr, ctx, in_quasi, True),
+    FORCE: eval_force,
+    CONS_STREAM: eval_consstream,
+    CDR_STREAM: eval_cdrstream,
+    APPEND: eval_append,
+    MATCH: eval_match,
+    FUTURE: eval_future,
+}
+
+
+# kinds of compiled quasiquote template nodes, see quasi_template
+QUOTED, HOLE, SPLICE, BUILD, BAD_SPLICE = range(5)
+
+
+def quasi_template(template):
+    """
+    compiles a resolved quasiquote template once into nodes: (QUOTED, value)
+    for a part without unquotes, built once and shared by every evaluation,
+    (HOLE, expr) for an unquoted expression, and (BUILD, items, tail) for a
+    list that holds holes, whose items are nodes or (SPLICE, list form), and
+    whose constant trailing elements are built once into the cons chain
+    tail. An unquote-splicing of anything but a list form is
+    (BAD_SPLICE, element), an error when it is evaluated.
+    """
+    if type(template) != list or template == []:
+        if template == NIL or template == []:
+            return (QUOTED, [])
+        return (QUOTED, template)
+    head = template[0]
+    if head in [UNQUOTE, UNQUOTE_SPLICING]:
+        assert len(template) == 2
+        return (HOLE, template[1])
+    elif head == QUASIQUOTE:
+        # if quasiquote nested within quasiquote, just return expr
+        return (QUOTED, datum(template))
+    items = []
+    for element in template:
+        if type(element) == list and len(element) == 2 and element[0] == UNQUOTE_SPLICING:
+            inner = element[1]
+            if type(inner) != list or len(inner) < 1 or inner[0] != LIST:
+                items.append((BAD_SPLICE, element))
+            else:
+                items.append((SPLICE, inner))
+        else:
+            items.append(quasi_template(element))
+    n = len(items)
+    while n > 0 and items[n - 1][0] == QUOTED:
+        n -= 1
+    tail = cons_chain([value for (_, value) in items[n:]], [])
+    if n == 0:
+        return (QUOTED, tail)
+    return (BUILD, items[:n], tail)
+
+
+def map_holes(node, function):
+    # the template with function of each hole and splice in place of it
+    kind = node[0]
+    if kind in [HOLE, SPLICE]:
+        return (kind, function(node[1]))
+    elif kind == BUILD:
+        return (BUILD, [map_holes(item, function) for item in node[1]], node[2])
+    return node
+
+
+def fill_template(node, evaluate):
+    """
+    value of a compiled template, with evaluate giving the value of each
+    hole and splice
+    """
+    kind = node[0]
+    if kind == QUOTED:
+        return node[1]
+    elif kind == HOLE:
+        return evaluate(node[1])
+    elif kind == BAD_SPLICE:
+        raise RuntimeError(
+            f"Inner Form in Unquote-Splicing must be a list form: {node[1]}.")
+    values = []
+    for item in node[1]:
+        if item[0] == SPLICE:
+            values += list_values(evaluate(item[1]))
+        else:
+            values.append(fill_template(item, evaluate))
+    return cons_chain(values, node[2])
+
+
+def parse_options(options, defaults):
+    """
+    values of the #:name value pairs that end the arguments of a builtin,
+    by name, with defaults for the names not given
+    """
+    if len(options) % 2 != 0:
+        raise RuntimeError(f"Expected keyword and value pairs: {options}.")
+    values = dict(defaults)
+    for keyword, value in zip(options[::2], options[1::2]):
+        if type(keyword) != Keyword or keyword.get_name() not in defaults:
+            raise RuntimeError(f"Unknown option: {expr_to_str(keyword)}.")
+        values[keyword.get_name()] = value
+    return values
+
+
+def hash_key(value):
+    """
+    hashable key of a value, equal for structurally equal values: lists
+    and pairs by their elements, strings by their text, and procedures and
+    promises by identity. The type is part of the key, so 1 and #t differ.
+    """
+    if type(value) not in [Cons, list]:
+        return atom_key(value)
+    # pairs and lists are keyed flat, in preorder, each by its length and
+    # then the keys of its parts, since python compares and hashes nested
+    # tuples recursively. An explicit stack of the parts left to key keeps
+    # deeply nested values from recursing here too.
+    tokens = []
+    stack = [value]
+    while stack != []:
+        value = stack.pop()
+        if type(value) == Cons:
+            elements = []
+            while type(value) == Cons:
+                elements.append(value.left)
+                value = value.right
+            tokens.append((Cons, len(elements)))
+            # the tail comes after the elements
+            stack.append(value)
+            stack += reversed(elements)
+        elif type(value) == list:
+            tokens.append((list, len(value)))
+            stack += reversed(value)
+        else:
+            tokens.append(atom_key(value))
+    return tuple(tokens)
+
+
+def atom_key(value):
+    # hash_key of a value that is neither a pair nor a list
+    if type(value) == String:
+        return (String, value.get_string())
+    elif type(value) == Vector:
+        array = value.get_array()
+        return (Vector, array.dtype.str, array.tobytes())
+    return (type(value), value)
+
+
+class Memo():
+    """
+    function of a memoized procedure. Results are cached by the hash_key of
+    the arguments, and once max_size are cached the least recently used is
+    evicted.
+    """
+
+    def __init__(self, procedure, max_size):
+        super().__init__()
+        self.procedure = procedure
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, *args):
+        key = tuple(hash_key(arg) for arg in args)
+        cache = self.cache
+        if key in cache:
+            self.hits += 1
+            cache.move_to_end(key)
+            return cache[key]
+        self.misses += 1
+        value = apply_procedure(self.procedure, list(args))
+        cache[key] = value
+        if len(cache) > self.max_size:
+            cache.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.cache.clear()
+
+
+MEMO_SIZE = 1024
+
+
+def memoize(procedure, *options):
+    assert type(procedure) in [Lambda, Primitive]
+    max_size = parse_options(options, {MAX_SIZE: MEMO_SIZE})[MAX_SIZE]
+    assert type(max_size) == int and max_size > 0
+    return Primitive(MEMOIZE, Memo(procedure, max_size))
+
+
+def get_memo(procedure):
+    if type(procedure) != Primitive or type(procedure.get_function()) != Memo:
+        raise RuntimeError(f"Not a memoized procedure: {expr_to_str(procedure)}.")
+    return procedure.get_function()
+
+
+def memo_clear(procedure):
+    get_memo(procedure).clear()
+    return 0
+
+
+def memo_stats(procedure):
+    memo = get_memo(procedure)
+    return make_list([memo.hits, memo.misses, len(memo.cache)])
+
+
+class Hash():
+    """
+    mutable hash table made by make-hash. Entries are kept by the hash_key
+    of their key, so keys are compared by structure, with the key itself
+    for hash-keys, in insertion order.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.table = {}
+        # global context of the evaluation that made it, see check_write
+        self.owner = EVAL_GLOBALS.get()
+
+    def get_entry(self, key):
+        return self.table.get(hash_key(key))
+
+    def set(self, key, value):
+        if self.owner is not EVAL_GLOBALS.get():
+            check_write(self.owner, "hash table")
+        self.table[hash_key(key)] = (key, value)
+
+    def remove(self, key):
+        if self.owner is not EVAL_GLOBALS.get():
+            check_write(self.owner, "hash table")
+        self.table.pop(hash_key(key), None)
+
+    def __reduce__(self):
+        # a copy in another process belongs to the evaluation it is read in
+        return (Hash, (), {"table": self.table})
+
+    def get_entries(self):
+        return list(self.table.values())
+
+    def __len__(self):
+        return len(self.table)
+
+
+# bits of the hash a trie level branches on
+HASH_BITS = 5
+HASH_MASK = (1 << HASH_BITS) - 1
+HASH_RANGE = (1 << 64) - 1
+
+
+class TrieNode():
+    """
+    node of the hash array mapped trie of an ImmutableHash: children, one
+    for each bit set in bitmap, are nodes or buckets, tuples of the
+    (hash, key id, key, value) entries whose keys share one full hash
+    """
+
+    def __init__(self, bitmap, children):
+        super().__init__()
+        self.bitmap = bitmap
+        self.children = children
+
+    def child_index(self, bit):
+        return bin(self.bitmap & (bit - 1)).count("1")
+
+
+EMPTY_TRIE = TrieNode(0, ())
+
+
+def trie_get(node, h, key_id):
+    shift = 0
+    while True:
+        bit = 1 << ((h >> shift) & HASH_MASK)
+        if not node.bitmap & bit:
+            return None
+        child = node.children[node.child_index(bit)]
+        if type(child) == TrieNode:
+            node = child
+            shift += HASH_BITS
+            continue
+        for entry in child:
+            if entry[1] == key_id:
+                return entry
+        return None
+
+
+def trie_set(node, entry, shift):
+    """
+    returns the trie with entry added, copying only the nodes on its path,
+    and whether its key is new
+    """
+    h = entry[0]
+    bit = 1 << ((h >> shift) & HASH_MASK)
+    index = node.child_index(bit)
+    children = node.children
+    if not node.bitmap & bit:
+        children = children[:index] + ((entry,),) + children[index:]
+        return TrieNode(node.bitmap | bit, children), True
+    child = children[index]
+    if type(child) == TrieNode:
+        child, is_new = trie_set(child, entry, shift + HASH_BITS)
+    elif child[0][0] == h:
+        others = tuple(e for e in child if e[1] != entry[1])
+        is_new = len(others) == len(child)
+        child = others + (entry,)
+    else:
+        # a bucket of another hash is pushed one level down
+        below = 1 << ((child[0][0] >> (shift + HASH_BITS)) & HASH_MASK)
+        child, is_new = trie_set(TrieNode(below, (child,)), entry, shift + HASH_BITS)
+    return TrieNode(node.bitmap, children[:index] + (child,) + children[index + 1:]), is_new
+
+
+def trie_entries(node):
+    entries = []
+    stack = [node]
+    while stack != []:
+        node = stack.pop()
+        for child in node.children:
+            if type(child) == TrieNode:
+                stack.append(child)
+            else:
+                entries += child
+    return entries
+
+
+class ImmutableHash():
+    """
+    immutable hash table made by hash and hash-set. hash-set returns a new
+    table sharing all of the trie but the path to the key, so it takes
+    time and space logarithmic in the size of the table.
+    """
+
+    def __init__(self, root, count):
+        super().__init__()
+        self.root = root
+        self.count = count
+
+    def get_entry(self, key):
+        key_id = hash_key(key)
+        entry = trie_get(self.root, hash(key_id) & HASH_RANGE, key_id)
+        if entry is None:
+            return None
+        return (entry[2], entry[3])
+
+    def set(self, key, value):
+        key_id = hash_key(key)
+        entry = (hash(key_id) & HASH_RANGE, key_id, key, value)
+        root, is_new = trie_set(self.root, entry, 0)
+        return ImmutableHash(root, self.count + 1 if is_new else self.count)
+
+    def get_entries(self):
+        return [(key, value) for (_, _, key, value) in trie_entries(self.root)]
+
+    def __len__(self):
+        return self.count
+
+    def __reduce__(self):
+        # string hashes differ between processes, so the trie is rebuilt
+        return (make_immutable_hash, (self.get_entries(),))
+
+
+def make_immutable_hash(entries):
+    table = ImmutableHash(EMPTY_TRIE, 0)
+    for key, value in entries:
+        table = table.set(key, value)
+    return table
+
+
+def hash_table(*args):
+    """
+    (hash key value ...) is an immutable hash table of the pairs
+    """
+    if len(args) % 2 != 0:
+        raise RuntimeError(f"Expected a value for each key: {expr_to_str(make_list(list(args)))}.")
+    return make_immutable_hash(zip(args[::2], args[1::2]))
+
+
+def make_hash(*assocs):
+    """
+    (make-hash [pairs]) is a mutable hash table, holding the pairs
+    (key . value) of the list pairs if it is given
+    """
+    assert len(assocs) <= 1
+    table = Hash()
+    for pair in list_values(assocs[0]) if assocs else []:
+        assert type(pair) == Cons
+        table.set(pair.get_left(), pair.get_right())
+    return table
+
+
+HASH_KINDS = {Hash: "a mutable hash table", ImmutableHash: "an immutable hash table"}
+
+
+def hash_of(table, kinds):
+    if type(table) not in kinds:
+        name = HASH_KINDS[kinds[0]] if len(kinds) == 1 else "a hash table"
+        raise RuntimeError(f"Expected {name}: {expr_to_str(table)}.")
+    return table
+
+
+def hash_ref(table, key, *default):
+    """
+    (hash-ref table key [default]) is the value of key, or default when
+    there is none
+    """
+    assert len(default) <= 1
+    entry = hash_of(table, [Hash, ImmutableHash]).get_entry(key)
+    if entry is not None:
+        return entry[1]
+    elif default != ():
+        return default[0]
+    raise RuntimeError(f"No value for key: {expr_to_str(key)}.")
+
+
+def hash_set_bang(table, key, value):
+    hash_of(table, [Hash]).set(key, value)
+    return 0
+
+
+def hash_remove_bang(table, key):
+    hash_of(table, [Hash]).remove(key)
+    return 0
+
+
+def hash_keys(table):
+    return make_list([key for (key, _) in hash_of(table, [Hash, ImmutableHash]).get_entries()])
+
+
+def hash_to_str(table):
+    pairs = [f"({expr_to_str(key)} . {expr_to_str(value)})" for (key, value) in table.get_entries()]
+    return f'#hash({" ".join(pairs)})'
+
+
+# builtins pmap can run in other processes, they neither print nor keep state
+PURE_BUILTINS = {
+    ADD, SUB, MUL, DIV, EXP, CONCAT, EQ, NEQ, LT, GT, LTE, GTE, NOT, AND, OR,
+    LIST, CONS, CAR, CDR, APPEND, MAP, APPLY, IS_PROMISE, MAKE_VECTOR,
+    LIST_TO_VECTOR, VECTOR_TO_LIST, VECTOR_LENGTH, VECTOR_REF, VECTOR_MAP,
+    VECTOR_ADD, VECTOR_MUL, VECTOR_SUM, VECTOR_DOT, VECTOR_FOLD, HASH,
+    MAKE_HASH, HASH_SET, HASH_REF, HASH_KEYS, HASH_COUNT,
+}
+
+PMAP_WORKERS = os.cpu_count() or 1
+
+# executor of the running pmap pool, with the global context its workers
+# were loaded from and the values its globals had then
+PMAP_POOL = None
+
+# global frame that frames sent between processes refer to, see Frame
+SHIPPED_FRAME = None
+
+
+def shipped_frame():
+    return SHIPPED_FRAME
+
+
+def ship_globals(global_ctx):
+    """
+    pickled top level definitions for pmap workers. Definitions that can
+    not be pickled, like memoized procedures, are left out: is_pure never
+    lets a shipped procedure reach them.
+    """
+    shipped = {}
+    for name, value in global_ctx.items():
+        try:
+            shipped[name] = pickle.dumps(value)
+        except (pickle.PicklingError, TypeError, AttributeError, RecursionError):
+            continue
+    return shipped
+
+
+def load_globals(shipped):
+    """
+    starts a pmap worker with the caller's top level definitions, their
+    closures refer to the worker's own global frame
+    """
+    global SHIPPED_FRAME
+    SHIPPED_FRAME = global_frame({})
+    for name, payload in shipped.items():
+        SHIPPED_FRAME.globals[name] = pickle.loads(payload)
+
+
+def pmap_chunk(function, rows):
+    # workers run lambdas as compiled closures, whichever engine made them
+    function.get_compiled_body()
+    return [apply_procedure(function, list(row)) for row in rows]
+
+
+def pure_code(expr, global_ctx, values, names):
+    """
+    False if the resolved expression can assign, define a global or print,
+    else adds the globals it names to names and their values to values, and
+    returns True
+    """
+    stack = [expr]
+    while stack != []:
+        expr = stack.pop()
+        if type(expr) in [str, GlobalRef]:
+            name = expr if type(expr) == str else expr.get_name()
+            if name == NIL:
+                continue
+            elif name in global_ctx:
+                names.add(name)
+                values.append(global_ctx[name])
+            elif name in BUILTINS:
+                values.append(BUILTINS[name])
+            else:
+                return False
+            continue
+        elif type(expr) != list or len(expr) == 0:
+            continue
+        first = expr[0]
+        if first in [SET, PRINTLN]:
+            return False
+        elif first == QUOTE:
+            continue
+        elif first == QUASIQUOTE:
+            stack += template_code(expr[1])
+        elif first == DEFINE:
+            target = expr[1][0] if type(expr[1]) == list else expr[1]
+            if type(target) == str:
+                return False
+            stack += expr[2:]
+        elif first == LAMBDA:
+            stack += expr[2:]
+        elif first in [LET, LETSTAR, FOR, FORLIST]:
+            stack += [e for (_, e) in expr[1]] + expr[2:]
+        elif first == MATCH:
+            stack.append(expr[1])
+            for clause in expr[2].get_clauses():
+                stack += clause[1:]
+        elif first == COND:
+            stack += [e for clause in expr[1:] for e in clause if e != ELSE]
+        elif type(first) == str and first in SPECIAL_FORMS:
+            stack += expr[1:]
+        else:
+            stack += expr
+    return True
+
+
+def template_code(node):
+    # the unquoted expressions of a compiled quasiquote template
+    if node[0] in [HOLE, SPLICE]:
+        return [node[1]]
+    elif node[0] == BUILD:
+        return [e for item in node[1] for e in template_code(item)]
+    return []
+
+
+def is_pure(function, rows, global_ctx, names):
+    """
+    whether pmap can apply function to rows in other processes: every
+    procedure reachable from them, through closures, the globals of
+    global_ctx and the
+    arguments, is a lambda whose code is pure, see pure_code, or a builtin
+    in PURE_BUILTINS. Mutable values, like hash tables, are not, since the
+    warm workers would keep reading the copies they were shipped. The
+    globals reached are added to names.
+    """
+    seen = set()
+    values = [function] + [value for row in rows for value in row]
+    while values != []:
+        value = values.pop()
+        if type(value) == Cons:
+            values += [value.left, value.right]
+        elif type(value) == ImmutableHash:
+            values += [e for entry in value.get_entries() for e in entry]
+        elif type(value) == Primitive:
+            if BUILTINS.get(value.get_name()) is not value or \
+                    value.get_name() not in PURE_BUILTINS:
+                return False
+        elif type(value) == Lambda:
+            if id(value) in seen:
+                continue
+            seen.add(id(value))
+            frame = value.get_env()
+            while frame.parent is not None:
+                values += frame.slots
+                frame = frame.parent
+            for body in value.get_bodies():
+                if not pure_code(body, global_ctx, values, names):
+                    return False
+        elif type(value) in [Hash, Delay, Memo, Future, Task, Channel]:
+            return False
+    return True
+
+
+def pmap_pool(global_ctx, names):
+    """
+    executor whose workers hold the definitions of global_ctx, kept warm
+    between calls until one of the globals in names, those the mapped
+    procedure reaches, is defined or set! to another value than the
+    workers were loaded with
+    """
+    global PMAP_POOL
+    if PMAP_POOL is not None:
+        executor, pool_ctx, loaded = PMAP_POOL
+        if pool_ctx is global_ctx and \
+                all(name in loaded and loaded[name] is global_ctx[name] for name in names):
+            return executor
+        executor.shutdown(wait=False)
+    loaded = dict(global_ctx.items())
+    executor = ProcessPoolExecutor(PMAP_WORKERS, initializer=load_globals,
+                                   initargs=(ship_globals(loaded),))
+    PMAP_POOL = (executor, global_ctx, loaded)
+    return executor
+
+
+def pmap(function, *args):
+    """
+    (pmap f lists ... [#:chunk-size n]) is (map f lists ...) run on a pool of
+    worker processes, n rows at a time, when f is a pure lambda, see
+    is_pure, and serially otherwise. Builtins are too cheap to send.
+    """
+    i = 0
+    while i < len(args) and type(args[i]) != Keyword:
+        i += 1
+    lists, options = args[:i], args[i:]
+    chunk_size = parse_options(options, {CHUNK_SIZE: None})[CHUNK_SIZE]
+    assert chunk_size is None or (type(chunk_size) == int and chunk_size > 0)
+    assert len(lists) > 0
+    if type(function) not in [Lambda, Primitive]:
+        raise RuntimeError(f"Expected a procedure to pmap: {expr_to_str(function)}.")
+    value_lists = [list_values(lst) for lst in lists]
+    for values in value_lists:
+        assert len(values) == len(value_lists[0])
+    rows = list(zip(*value_lists))
+    if type(function) != Lambda or rows == []:
+        return map_procedure(function, list(lists))
+    # the globals of the running evaluation, see in_globals
+    global_ctx = EVAL_GLOBALS.get()
+    if global_ctx is None:
+        global_ctx = function.get_env().globals
+    names = set()
+    if not is_pure(function, rows, global_ctx, names):
+        return map_procedure(function, list(lists))
+    global SHIPPED_FRAME
+    if chunk_size is None:
+        chunk_size = -(-len(rows) // (PMAP_WORKERS * 4))
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    # results holding closures come back pointing at the caller's globals
+    SHIPPED_FRAME = global_frame(global_ctx)
+    executor = pmap_pool(global_ctx, names)
+    results = executor.map(pmap_chunk, [function] * len(chunks), chunks)
+    return make_list([value for chunk in results for value in chunk])
+
+
+class LayeredGlobals(dict):
+    """
+    global context over a parent one: lookups fall through to the parent,
+    while define and set! of a global only write this layer. depth counts
+    the layers down to the plain dict at the bottom. bases are the contexts
+    under this one, flattened ones included, whose variables and hash
+    tables it may not write, see check_write.
+    """
+
+    def __init__(self, parent, bases=(), base_writes=None):
+        super().__init__()
+        self.parent = parent
+        self.depth = parent.depth + 1 if type(parent) == LayeredGlobals else 1
+        self.bases = (parent,) + bases
+        if type(parent) == LayeredGlobals:
+            self.bases += parent.bases
+        self.base_writes = base_writes
+
+    def __missing__(self, name):
+        layer = self.parent
+        while type(layer) == LayeredGlobals:
+            if dict.__contains__(layer, name):
+                return dict.__getitem__(layer, name)
+            layer = layer.parent
+        return layer[name]
+
+    def __contains__(self, name):
+        layer = self
+        while type(layer) == LayeredGlobals:
+            if dict.__contains__(layer, name):
+                return True
+            layer = layer.parent
+        return name in layer
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def items(self):
+        layers = []
+        layer = self
+        while type(layer) == LayeredGlobals:
+            layers.append(layer)
+            layer = layer.parent
+        merged = dict(layer)
+        # inner layers shadow outer ones
+        for layer in reversed(layers):
+            merged.update(dict.items(layer))
+        return merged.items()
+
+
+# forks of forks deeper than this are flattened, see fork_globals
+MAX_FORK_DEPTH = 8
+
+
+def fork_globals(ctx, base_writes=None):
+    """
+    global context forked from ctx in constant time, whatever its size:
+    reads fall through to ctx, while top level define and set! write the
+    fork only, so that one base context can be shared by any number of
+    forks as long as it is not written itself. Procedures of ctx run in the
+    fork read and write the fork too, see in_globals. The local variables
+    and hash tables ctx made are shared rather than copied, so the fork may
+    not write them: set! of a variable a closure of ctx captured, or
+    hash-set! of a table of ctx, is an error, unless base_writes is a list,
+    which each such write is then appended to. A fork of a context
+    MAX_FORK_DEPTH forks deep is made over a flat copy of it instead, so
+    that lookups never walk more than MAX_FORK_DEPTH layers.
+    """
+    bases = ()
+    if type(ctx) == LayeredGlobals and ctx.depth >= MAX_FORK_DEPTH:
+        bases = (ctx,) + ctx.bases
+        ctx = dict(ctx.items())
+    return LayeredGlobals(ctx, bases, base_writes)
+
+
+def check_write(owner, kind):
+    """
+    raises unless the running evaluation may write a value of kind, made
+    by the evaluation with the global context owner, see fork_globals
+    """
+    running = EVAL_GLOBALS.get()
+    if type(running) != LayeredGlobals or not any(owner is base for base in running.bases):
+        return
+    elif running.base_writes is None:
+        raise RuntimeError(f"Can not write, from a fork or future, a {kind} made before it.")
+    running.base_writes.append(kind)
+
+
+def child_frame(ctx):
+    """
+    frame a future runs in: a copy of the variables of ctx, at the same
+    depths, and a layer of its own for the globals it defines or set!s, so
+    that futures never race with their caller on either
+    """
+    base_writes = None
+    if type(ctx.globals) == LayeredGlobals:
+        base_writes = ctx.globals.base_writes
+    global_ctx = LayeredGlobals(ctx.globals, (), base_writes)
+    frames = []
+    while ctx is not None:
+        frames.append(ctx)
+        ctx = ctx.parent
+    frame = None
+    for ctx in reversed(frames):
+        frame = Frame(list(ctx.slots), frame, global_ctx)
+    return frame
+
+
+# threads futures run on, made on the first future
+FUTURE_WORKERS = 8
+FUTURE_POOL = None
+
+
+def future_pool():
+    global FUTURE_POOL
+    if FUTURE_POOL is None:
+        FUTURE_POOL = ThreadPoolExecutor(FUTURE_WORKERS)
+    return FUTURE_POOL
+
+
+def set_future_workers(n):
+    """
+    (set-future-workers! n) runs later futures on n threads, running ones
+    finish on the old pool
+    """
+    assert type(n) == int and n > 0
+    global FUTURE_WORKERS, FUTURE_POOL
+    if FUTURE_POOL is not None:
+        FUTURE_POOL.shutdown(wait=False)
+        FUTURE_POOL = None
+    FUTURE_WORKERS = n
+    return n
+
+
+class Future():
+    """
+    value of an expression evaluated on the future pool. A future still
+    queued when touched is taken off the pool and evaluated by the
+    toucher, so that futures touching futures never wait on a full pool.
+    """
+
+    def __init__(self, thunk):
+        super().__init__()
+        self.thunk = thunk
+        self.lock = threading.Lock()
+        self.result = future_pool().submit(thunk)
+
+    def get_is_done(self):
+        return self.result.done()
+
+    def touch(self):
+        with self.lock:
+            if self.result.cancel():
+                result = concurrent.futures.Future()
+                try:
+                    result.set_result(self.thunk())
+                except Exception as e:
+                    result.set_exception(e)
+                self.result = result
+        return self.result.result()
+
+
+def future_of(global_ctx, function, *args):
+    """
+    future of function(*args) evaluated with the global context
+    global_ctx, and charged to the budget of the evaluation starting it,
+    which the thread it runs on would not otherwise see
+    """
+    budget = BUDGET.get()
+    return Future(lambda: in_budget(budget, in_globals, global_ctx, function, *args))
+
+
+def touch(future):
+    if type(future) == Task:
+        # a running task is only waited for in eval_async
+        if not future.get_is_done():
+            raise RuntimeError("Touch of a running task outside of eval_async.")
+        return future.task.result()
+    elif type(future) != Future:
+        raise RuntimeError(f"Expected a future to touch: {expr_to_str(future)}.")
+    return future.touch()
+
+
+def future_all(futures):
+    # touches each future of the list, in order
+    return make_list([touch(future) for future in list_values(futures)])
+
+
+class Task():
+    """
+    thunk running as an asyncio task, made by spawn in eval_async
+    """
+
+    def __init__(self, task):
+        super().__init__()
+        self.task = task
+
+    def get_is_done(self):
+        return self.task.done()
+
+
+class Channel():
+    """
+    unbounded queue of values between tasks. channel-put! never waits, and
+    channel-get of an empty channel waits for a put, in eval_async
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.values = deque()
+        # asyncio futures of the tasks waiting in channel-get, oldest first
+        self.getters = deque()
+
+    def get_size(self):
+        return len(self.values)
+
+    def put(self, value):
+        while self.getters:
+            getter = self.getters.popleft()
+            # a cancelled task no longer waits
+            if not getter.done():
+                getter.set_result(value)
+                return
+        self.values.append(value)
+
+
+def channel_of(channel):
+    if type(channel) != Channel:
+        raise RuntimeError(f"Expected a channel: {expr_to_str(channel)}.")
+    return channel
+
+
+def channel_put(channel, value):
+    channel_of(channel).put(value)
+    return 0
+
+
+def channel_get(channel):
+    channel = channel_of(channel)
+    if channel.get_size() == 0:
+        raise RuntimeError("Channel-get of an empty channel outside of eval_async.")
+    return channel.values.popleft()
+
+
+def sleep(milliseconds):
+    assert type(milliseconds) == int and milliseconds >= 0
+    time.sleep(milliseconds / 1000)
+    return 0
+
+
+def spawn(thunk):
+    raise RuntimeError(f"Spawn outside of eval_async: {expr_to_str(thunk)}.")
+
+
+def print_values(*vals):
+    print(" ".join(map(expr_to_str, vals)))
+    return 0
+
+
+def cons_left(c):
+    assert type(c) == Cons
+    return c.get_left()
+
+
+def cons_right(c):
+    assert type(c) == Cons
+    return c.get_right()
+
+
+def primitives(functions):
+    return {name: Primitive(name, function) for name, function in functions.items()}
+
+
+# values of special form names used as variables, e.g. (map * xs ys)
+BUILTINS = primitives({
+    ADD: lambda *vals: reduce(lambda val, acc: val + acc, vals, 0),
+    SUB: lambda first, *vals: reduce(lambda val, acc: val - acc, vals, first),
+    MUL: lambda *vals: reduce(lambda val, acc: val * acc, vals, 1),
+    DIV: lambda first, second: int(first/second),
+    EXP: lambda first, second: first ** second,
+    CONCAT: lambda first, second: first + second,
+    EQ: lambda first, second: first == second,
+    NEQ: lambda first, second: first != second,
+    LT: lambda first, second: first < second,
+    GT: lambda first, second: first > second,
+    LTE: lambda first, second: first <= second,
+    GTE: lambda first, second: first >= second,
+    NOT: lambda b: not b,
+    AND: lambda *vals: reduce(lambda v, acc: v and acc, vals, True),
+    OR: lambda *vals: reduce(lambda v, acc: v or acc, vals, False),
+    LIST: lambda *vals: make_list(vals),
+    CONS: Cons,
+    CAR: cons_left,
+    CDR: cons_right,
+    APPEND: append_lists,
+    PRINTLN: print_values,
+    FORCE: force_delay,
+    MAKE_PROMISE: make_promise,
+    IS_PROMISE: lambda value: type(value) == Delay,
+    STREAM_MAP: stream_map,
+    STREAM_FILTER: stream_filter,
+    STREAM_TAKE: stream_take,
+    STREAM_TO_LIST: stream_to_list,
+    INTEGERS_FROM: integers_from,
+    MAKE_VECTOR: make_vector,
+    LIST_TO_VECTOR: lambda lst: Vector(array_of(list_values(lst))),
+    VECTOR_TO_LIST: lambda v: make_list(vector_array(v).tolist()),
+    VECTOR_LENGTH: lambda v: len(vector_array(v)),
+    VECTOR_REF: vector_ref,
+    VECTOR_MAP: vector_map,
+    VECTOR_ADD: lambda *operands: vector_arithmetic(numpy.add, operands),
+    VECTOR_MUL: lambda *operands: vector_arithmetic(numpy.multiply, operands),
+    VECTOR_SUM: lambda v: vector_array(v).sum().item(),
+    VECTOR_DOT: vector_dot,
+    VECTOR_FOLD: vector_fold,
+    MEMOIZE: memoize,
+    MEMO_CLEAR: memo_clear,
+    MEMO_STATS: memo_stats,
+    PMAP: pmap,
+    HASH: hash_table,
+    MAKE_HASH: make_hash,
+    HASH_SET: lambda table, key, value: hash_of(table, [ImmutableHash]).set(key, value),
+    HASH_SET_BANG: hash_set_bang,
+    HASH_REF: hash_ref,
+    HASH_REMOVE_BANG: hash_remove_bang,
+    HASH_KEYS: hash_keys,
+    HASH_COUNT: lambda table: len(hash_of(table, [Hash, ImmutableHash])),
+    TOUCH: touch,
+    FUTURE_ALL: future_all,
+    SET_FUTURE_WORKERS: set_future_workers,
+    SPAWN: spawn,
+    SLEEP: sleep,
+    MAKE_CHANNEL: Channel,
+    CHANNEL_PUT: channel_put,
+    CHANNEL_GET: channel_get,
+    MAP: lambda function, *lists: map_procedure(function, list(lists)),
+    APPLY: lambda function, *args: apply_procedure(function, list(args[:-1]) + list_values(args[-1])),
+})
+
+
+class Scope():
+    """
+    resolve time mirror of a Frame, maps the names bound by one binding
+    form to the slots they will have in the frame
+    """
+
+    def __init__(self, names, parent):
+        super().__init__()
+        self.slots = {}
+        self.size = 0
+        self.parent = parent
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        # a repeated name refers to its last slot
+        self.slots[name] = self.size
+        self.size += 1
+        return self.size - 1
+
+    def define(self, name):
+        if name in self.slots:
+            return self.slots[name]
+        return self.add(name)
+
+
+def resolve(expr):
+    """
+    resolves every variable in a parsed program to a LocalRef (depth, slot)
+    address into the frames made by lambda, let, for and match, so that
+    lookups never hash strings. Variables bound nowhere stay symbols and
+    are looked up in the global context, as are top level define and set!.
+    """
+    return resolve_node(expr, None)
+
+
+def resolve_node(expr, scope):
+    if type(expr) == str:
+        if expr == NIL:
+            return expr
+        return resolve_symbol(expr, scope)
+    elif type(expr) != list or len(expr) == 0:
+        return expr
+    first = expr[0]
+    if type(first) == str and first in RESOLVERS:
+        return RESOLVERS[first](expr, scope)
+    elif type(first) == str and first in SPECIAL_FORMS:
+        return [first] + resolve_all(expr[1:], scope)
+    operator = resolve_node(first, scope)
+    if type(operator) == str and operator != NIL:
+        operator = GlobalRef(operator)
+    return [operator] + resolve_all(expr[1:], scope)
+
+
+def resolve_all(exprs, scope):
+    return [resolve_node(e, scope) for e in exprs]
+
+
+def resolve_symbol(name, scope):
+    depth = 0
+    while scope is not None:
+        if name in scope.slots:
+            return LocalRef(name, depth, scope.slots[name])
+        scope = scope.parent
+        depth += 1
+    return name
+
+
+def resolve_target(name, scope):
+    # define binds in the innermost frame, or globally at top level
+    if scope is None:
+        return name
+    return LocalRef(name, 0, scope.define(name))
+
+
+def scan_defines(bodies):
+    names = []
+    for body in bodies:
+        if type(body) != list or len(body) < 2:
+            continue
+        if body[0] in [DEFINE, DEFINE_MEMO]:
+            target = body[1]
+            if type(target) == list and len(target) >= 1:
+                target = target[0]
+            if type(target) == str:
+                names.append(target)
+        elif body[0] == BEGIN:
+            names += scan_defines(body[1:])
+    return names
+
+
+def resolve_bodies(bodies, scope):
+    # internal defines get slots up front, so that they can be recursive
+    for name in scan_defines(bodies):
+        scope.define(name)
+    return resolve_all(bodies, scope)
+
+
+def resolve_quote(expr, scope):
+    # quoted data is converted to values once, here
+    return [QUOTE] + [datum(e) for e in expr[1:]]
+
+
+def resolve_quasi(expr, scope):
+    # only the unquoted parts of a quasiquote template are code
+    if type(expr) != list or len(expr) == 0:
+        return expr
+    first = expr[0]
+    if first in [UNQUOTE, UNQUOTE_SPLICING] and len(expr) == 2:
+        return [first, resolve_node(expr[1], scope)]
+    elif first == QUASIQUOTE:
+        # nested quasiquote is returned as is
+        return expr
+    return [resolve_quasi(e, scope) for e in expr]
+
+
+def resolve_quasiquote(expr, scope):
+    # the template is compiled once, here, see quasi_template
+    if len(expr) != 2:
+        return [QUASIQUOTE] + [resolve_quasi(e, scope) for e in expr[1:]]
+    return [QUASIQUOTE, quasi_template(resolve_quasi(expr[1], scope))]
+
+
+def resolve_lambda(expr, scope):
+    params, _ = parse_params(expr[1])
+    return [LAMBDA, expr[1]] + resolve_bodies(expr[2:], Scope(params, scope))
+
+
+def resolve_define(expr, scope):
+    names = expr[1]
+    if type(names) == list and len(names) >= 1:
+        target = resolve_target(names[0], scope)
+        params, _ = parse_params(names[1:])
+        bodies = resolve_bodies(expr[2:], Scope(params, scope))
+        return [DEFINE, [target] + names[1:]] + bodies
+    target = resolve_target(names, scope)
+    return [DEFINE, target] + resolve_all(expr[2:], scope)
+
+
+def resolve_define_macro(expr, scope):
+    # frontend expands macros away before any engine sees the program
+    raise RuntimeError(f"Macro definition was never expanded: {expr}.")
+
+
+def resolve_set(expr, scope):
+    return [SET, resolve_symbol(expr[1], scope)] + resolve_all(expr[2:], scope)
+
+
+def resolve_let(expr, scope):
+    let_scope = Scope([], scope)
+    bindings = []
+    for (name, e) in expr[1]:
+        # a repeated name keeps its first binding, as it always has
+        if name not in let_scope.slots:
+            bindings.append([name, resolve_node(e, scope)])
+            let_scope.add(name)
+    return [LET, bindings] + resolve_bodies(expr[2:], let_scope)
+
+
+def resolve_letstar(expr, scope):
+    let_scope = Scope([], scope)
+    bindings = []
+    for (name, e) in expr[1]:
+        # each binding sees the ones before it
+        bindings.append([name, resolve_node(e, let_scope)])
+        let_scope.add(name)
+    return [LETSTAR, bindings] + resolve_bodies(expr[2:], let_scope)
+
+
+def resolve_for(expr, scope):
+    bindings = [[var, resolve_node(lst, scope)] for (var, lst) in expr[1]]
+    for_scope = Scope([var for (var, _) in expr[1]], scope)
+    return [expr[0], bindings] + resolve_bodies(expr[2:], for_scope)
+
+
+def resolve_pattern(pattern, scope):
+    if type(pattern) == str:
+        if pattern in [UNDERSCORE, NIL]:
+            return pattern
+        return LocalRef(pattern, 0, scope.define(pattern))
+    elif type(pattern) != list or len(pattern) == 0:
+        return pattern
+    elif pattern[0] == QUOTE:
+        return resolve_quote(pattern, scope)
+    return [pattern[0]] + [resolve_pattern(p, scope) for p in pattern[1:]]
+
+
+def resolve_match(expr, scope):
+    clauses = []
+    for clause in expr[2:]:
+        clause_scope = Scope([], scope)
+        pattern = resolve_pattern(clause[0], clause_scope)
+        clauses.append([pattern] + resolve_bodies(clause[1:], clause_scope))
+    return [MATCH, resolve_node(expr[1], scope), MatchForm(clauses)]
+
+
+def resolve_cond(expr, scope):
+    clauses = []
+    for clause in expr[1:]:
+        clauses.append([e if e == ELSE else resolve_node(e, scope)
+                        for e in clause])
+    return [COND] + clauses
+
+
+RESOLVERS = {
+    QUOTE: resolve_quote,
+    QUASIQUOTE: resolve_quasiquote,
+    LAMBDA: resolve_lambda,
+    DEFINE: resolve_define,
+    DEFINE_MACRO: resolve_define_macro,
+    SET: resolve_set,
+    LET: resolve_let,
+    LETSTAR: resolve_letstar,
+    FOR: resolve_for,
+    FORLIST: resolve_for,
+    MATCH: resolve_match,
+    COND: resolve_cond,
+}
+
+
+def shadow(names, macros):
+    """
+    macro scope for a binding form, where names are variables, not macros
+    """
+    inner = dict(macros)
+    for name in names:
+        inner.pop(name, None)
+    return inner
+
+
+def rename(expr, names):
+    # renames variables consistently, leaving quoted data alone
+    if type(expr) == str:
+        return names.get(expr, expr)
+    elif type(expr) != list or len(expr) == 0:
+        return expr
+    first = expr[0]
+    if first == QUOTE:
+        return expr
+    elif first == QUASIQUOTE:
+        return [QUASIQUOTE] + [rename_quasi(e, names) for e in expr[1:]]
+    elif type(first) == str and first in SPECIAL_FORMS:
+        return [first] + [rename(e, names) for e in expr[1:]]
+    return [rename(e, names) for e in expr]
+
+
+def rename_quasi(expr, names):
+    if type(expr) != list or len(expr) == 0:
+        return expr
+    first = expr[0]
+    if first in [UNQUOTE, UNQUOTE_SPLICING] and len(expr) == 2:
+        return [first, rename(expr[1], names)]
+    elif first == QUASIQUOTE:
+        return expr
+    return [rename_quasi(e, names) for e in expr]
+
+
+def expand(expr, macros):
+    """
+    macro expansion phase, run once over a parsed program. Each define-macro
+    becomes a define of its template, a lambda with freshly named
+    parameters, under a fresh name, followed by its quoted name, and each
+    use of a macro becomes an application of that fresh name, so that no
+    engine ever sees a Macro. macros maps the macro names in scope to their
+    Macro.
+    """
+    if type(expr) == str:
+        if type(macros.get(expr)) == Macro:
+            raise RuntimeError(
+                f"Macro can never be an evaluated expression: {expr}.")
+        return expr
+    elif type(expr) != list or len(expr) == 0:
+        return expr
+    first = expr[0]
+    if type(first) == str and first in EXPANDERS:
+        return EXPANDERS[first](expr, macros)
+    elif type(first) == str and first in SPECIAL_FORMS:
+        return [first] + expand_all(expr[1:], macros)
+    elif type(first) == str and first in macros:
+        return expand_use(expr, macros)
+    return expand_all(expr, macros)
+
+
+def expand_all(exprs, macros):
+    return [expand(e, macros) for e in exprs]
+
+
+def expand_bodies(bodies, macros):
+    # internal defines shadow macros throughout the body
+    inner = shadow(scan_defines(bodies), macros)
+    return expand_all(bodies, inner)
+
+
+def expand_use(expr, macros):
+    macro = macros[expr[0]]
+    if macro is None:
+        raise RuntimeError(
+            f"Macro can not be used in its own definition: {expr}.")
+    return [macro.get_name()] + expand_all(expr[1:], macros)
+
+
+def expand_define_macro(expr, macros):
+    assert len(expr) >= 3
+    binding = expr[1]
+    assert type(binding) == list and len(binding) >= 2
+    name = binding[0]
+    params = binding[1:]
+    # fresh parameter names, so expansions can not capture call site names
+    names = {p: gensym() for p in params if p not in SPECIAL_FORMS and p != VARIADIC}
+    # uses of the macro inside its own bodies can never finish expanding
+    inner = shadow(params, macros)
+    inner[name] = None
+    bodies = expand_bodies(expr[2:], inner)
+    macro = Macro(gensym(), [names.get(p, p) for p in params],
+                  [rename(body, names) for body in bodies])
+    macros[name] = macro
+    return [BEGIN, [DEFINE, macro.get_name(), macro.get_template()], [QUOTE, name]]
+
+
+def expand_quasi(expr, macros):
+    if type(expr) != list or len(expr) == 0:
+        return expr
+    first = expr[0]
+    if first in [UNQUOTE, UNQUOTE_SPLICING] and len(expr) == 2:
+        return [first, expand(expr[1], macros)]
+    elif first == QUASIQUOTE:
+        return expr
+    return [expand_quasi(e, macros) for e in expr]
+
+
+def expand_quasiquote(expr, macros):
+    return [QUASIQUOTE] + [expand_quasi(e, macros) for e in expr[1:]]
+
+
+def expand_lambda(expr, macros):
+    assert len(expr) >= 3
+    params, _ = parse_params(expr[1])
+    return [LAMBDA, expr[1]] + expand_bodies(expr[2:], shadow(params, macros))
+
+
+def expand_define(expr, macros):
+    assert len(expr) >= 3
+    names = expr[1]
+    if type(names) == list and len(names) >= 1:
+        macros.pop(names[0], None)
+        params, _ = parse_params(names[1:])
+        bodies = expand_bodies(expr[2:], shadow(params, macros))
+        return [DEFINE, names] + bodies
+    values = expand_all(expr[2:], macros)
+    macros.pop(names, None)
+    return [DEFINE, names] + values
+
+
+def expand_define_memo(expr, macros):
+    """
+    (define-memo (f args ...) [#:max-size n] bodies ...) defines f as the
+    memoized lambda, so that its recursive calls go through the cache
+    """
+    assert len(expr) >= 3
+    names = expr[1]
+    assert type(names) == list and len(names) >= 1
+    options = []
+    rest = expr[2:]
+    while len(rest) > 2 and type(rest[0]) == Keyword:
+        options += rest[:2]
+        rest = rest[2:]
+    procedure = [LAMBDA, names[1:]] + rest
+    return expand([DEFINE, names[0], [MEMOIZE, procedure] + options], macros)
+
+
+def expand_let(expr, macros):
+    assert len(expr) >= 3
+    bindings = [[name, expand(e, macros)] for (name, e) in expr[1]]
+    names = [name for (name, _) in expr[1]]
+    return [LET, bindings] + expand_bodies(expr[2:], shadow(names, macros))
+
+
+def expand_letstar(expr, macros):
+    assert len(expr) >= 3
+    inner = macros
+    bindings = []
+    for (name, e) in expr[1]:
+        bindings.append([name, expand(e, inner)])
+        inner = shadow([name], inner)
+    return [LETSTAR, bindings] + expand_bodies(expr[2:], inner)
+
+
+def expand_for(expr, macros):
+    assert len(expr) >= 3
+    bindings = [[var, expand(lst, macros)] for (var, lst) in expr[1]]
+    names = [var for (var, _) in expr[1]]
+    return [expr[0], bindings] + expand_bodies(expr[2:], shadow(names, macros))
+
+
+def pattern_variables(pattern):
+    if type(pattern) == str:
+        return [] if pattern in [UNDERSCORE, NIL] else [pattern]
+    elif type(pattern) != list or len(pattern) == 0 or pattern[0] == QUOTE:
+        return []
+    return [name for p in pattern[1:] for name in pattern_variables(p)]
+
+
+def expand_match(expr, macros):
+    assert len(expr) >= 3
+    clauses = []
+    for clause in expr[2:]:
+        inner = shadow(pattern_variables(clause[0]), macros)
+        clauses.append([clause[0]] + expand_bodies(clause[1:], inner))
+    return [MATCH, expand(expr[1], macros)] + clauses
+
+
+def expand_cond(expr, macros):
+    clauses = []
+    for clause in expr[1:]:
+        clauses.append([e if e == ELSE else expand(e, macros)
+                        for e in clause])
+    return [COND] + clauses
+
+
+EXPANDERS = {
+    QUOTE: lambda expr, macros: expr,
+    QUASIQUOTE: expand_quasiquote,
+    DEFINE_MACRO: expand_define_macro,
+    LAMBDA: expand_lambda,
+    DEFINE: expand_define,
+    DEFINE_MEMO: expand_define_memo,
+    LET: expand_let,
+    LETSTAR: expand_letstar,
+    FOR: expand_for,
+    FORLIST: expand_for,
+    MATCH: expand_match,
+    COND: expand_cond,
+}
+
+
+def eval_program(expr, ctx, budget=None):
+    """
+    resolves a parsed program and evaluates it with the global context ctx,
+    a dict of top level definitions that persists between programs, within
+    budget if it is given, see Budget
+    """
+    return in_globals(ctx, eval_expr, resolve(expr), global_frame(ctx), False, budget)
+
+
+def compile_expr(expr):
+    """
+    compiles a parsed program once into a tree of python closures,
+    one per node, each of which takes the frame and returns the value.
+    Special forms are recognized here at compile time, so running the
+    closures never goes back through the dispatch chain in eval_expr.
+
+    compile_expr(expr)(ctx, budget) gives the same value as
+    eval_program(expr, ctx, budget), charging the budget a step for each
+    procedure call rather than for each node
+    """
+    run = compile_node(resolve(expr), False)
+
+    def run_program(ctx, budget=None):
+        if budget is not None:
+            budget.start()
+        return in_budget(budget, in_globals, ctx, run, global_frame(ctx))
+    return run_program
+
+
+def run_compiled(run, ctx):
+    """
+    runs a closure compiled in tail position, looping on the tail calls
+    it returns
+    """
+    value = run(ctx)
+    while type(value) == TailCall:
+        value = value.expr(value.ctx)
+    return value
+
+
+def compile_node(expr, in_quasi, tail=False):
+    """
+    when tail is true, applications in tail position of expr return a
+    TailCall of the lambda body and its frame instead of running it
+    """
+    if type(expr) == int:
+        return lambda ctx: expr
+    elif type(expr) == bool:
+        return lambda ctx: expr
+    elif type(expr) == LocalRef:
+        return compile_local(expr)
+    elif type(expr) == GlobalRef:
+        return lambda ctx: lookup_ref(expr, ctx)
+    elif expr == NIL:
+        return lambda ctx: []
+    elif type(expr) == str:
+        return compile_symbol(expr, in_quasi)
+    elif type(expr) in [String, Keyword]:
+        return lambda ctx: expr
+
+    assert type(expr) == list
+    assert len(expr) >= 1
+    if in_quasi:
+        return compile_in_quasi(expr)
+    first = expr[0]
+    if type(first) == str and first in TAIL_COMPILERS:
+        return TAIL_COMPILERS[first](expr, tail)
+    elif type(first) == str and first in COMPILERS:
+        return COMPILERS[first](expr)
+    return compile_app(expr, tail)
+
+
+def compile_body(bodies, tail):
+    return compile_node([BEGIN] + bodies, False, tail)
+
+
+def compile_local(ref):
+    depth = ref.get_depth()
+    slot = ref.get_slot()
+    if depth == 0:
+        return lambda ctx: ctx.slots[slot]
+    elif depth == 1:
+        return lambda ctx: ctx.parent.slots[slot]
+    return lambda ctx: ctx.lookup(depth, slot)
+
+
+def compile_symbol(name, in_quasi):
+    if in_quasi:
+        # symbol under quasi is itself
+        return lambda ctx: name
+    return lambda ctx: lookup_global(name, ctx)
+
+
+def compile_in_quasi(expr):
+    first = expr[0]
+    if first == UNQUOTE:
+        assert len(expr) == 2
+        return compile_node(expr[1], False)
+    elif first == QUASIQUOTE:
+        assert len(expr) == 2
+        # quasiquote nested within quasiquote is returned as is
+        value = datum(expr)
+        return lambda ctx: value
+    elif first == UNQUOTE_SPLICING:
+        assert len(expr) == 2
+        inner = expr[1]
+        if type(inner) == list and len(inner) >= 1 and inner[0] == LIST:
+            run_list = compile_list(inner)
+            return lambda ctx: (run_list(ctx), True)
+
+        def run_bad_splice(ctx):
+            raise RuntimeError(
+                f"Inner Form in Unquote-Splicing must be a list form: {expr}.")
+        return run_bad_splice
+
+    elements = [compile_node(e, True) for e in expr]
+
+    def run_quasi_list(ctx):
+        lst = []
+        for element in elements:
+            v = element(ctx)
+            if type(v) == tuple:
+                # spliced values
+                lst += list_values(v[0])
+            else:
+                lst.append(v)
+        return make_list(lst)
+    return run_quasi_list
+
+
+def compile_operands(exprs):
+    return [compile_node(e, False) for e in exprs]
+
+
+def compile_add(expr):
+    assert len(expr) >= 3
+    operands = compile_operands(expr[1:])
+    if len(operands) == 2:
+        left, right = operands
+        return lambda ctx: left(ctx) + right(ctx)
+
+    def run_add(ctx):
+        total = 0
+        for operand in operands:
+            total += operand(ctx)
+        return total
+    return run_add
+
+
+def compile_sub(expr):
+    assert len(expr) >= 3
+    operands = compile_operands(expr[1:])
+    if len(operands) == 2:
+        left, right = operands
+        return lambda ctx: left(ctx) - right(ctx)
+    first, rest = operands[0], operands[1:]
+
+    def run_sub(ctx):
+        total = first(ctx)
+        for operand in rest:
+            total -= operand(ctx)
+        return total
+    return run_sub
+
+
+def compile_mul(expr):
+    assert len(expr) >= 3
+    operands = compile_operands(expr[1:])
+
+    def run_mul(ctx):
+        total = 1
+        for operand in operands:
+            total *= operand(ctx)
+        return total
+    return run_mul
+
+
+def compile_div(expr):
+    assert len(expr) == 3
+    left, right = compile_operands(expr[1:])
+    return lambda ctx: int(left(ctx) / right(ctx))
+
+
+def compile_exp(expr):
+    assert len(expr) == 3
+    left, right = compile_operands(expr[1:])
+    return lambda ctx: left(ctx) ** right(ctx)
+
+
+def compile_concat(expr):
+    assert len(expr) == 3
+    left, right = compile_operands(expr[1:])
+
+    def run_concat(ctx):
+        first = left(ctx)
+        assert type(first) == String
+        second = right(ctx)
+        assert type(second) == String
+        return first + second
+    return run_concat
+
+
+def compile_lt(expr):
+    assert len(expr) == 3
+    left, right = compile_operands(expr[1:])
+    return lambda ctx: left(ctx) < right(ctx)
+
+
+def compile_gt(expr):
+    assert len(expr) == 3
+    left, right = compile_operands(expr[1:])
+    return lambda ctx: left(ctx) > right(ctx)
+
+
+def compile_lte(expr):
+    assert len(expr) == 3
+    left, right = compile_operands(expr[1:])
+    return lambda ctx: left(ctx) <= right(ctx)
+
+
+def compile_gte(expr):
+    assert len(expr) == 3
+    left, right = compile_operands(expr[1:])
+    return lambda ctx: left(ctx) >= right(ctx)
+
+
+def compile_neq(expr):
+    assert len(expr) == 3
+    left, right = compile_operands(expr[1:])
+    return lambda ctx: left(ctx) != right(ctx)
+
+
+def compile_eq(expr):
+    assert len(expr) == 3
+    left, right = compile_operands(expr[1:])
+    return lambda ctx: left(ctx) == right(ctx)
+
+
+def compile_quote(expr):
+    assert len(expr) == 2
+    datum = expr[1]
+    return lambda ctx: datum
+
+
+def compile_println(expr):
+    assert len(expr) >= 2
+    operands = compile_operands(expr[1:])
+
+    def run_println(ctx):
+        vals = [operand(ctx) for operand in operands]
+        print(" ".join(map(expr_to_str, vals)))
+        return 0
+    return run_println
+
+
+def compile_set(expr):
+    assert len(expr) == 3
+    var = expr[1]
+    value = compile_node(expr[2], False)
+
+    def run_set_local(ctx):
+        ctx.assign(var.get_depth(), var.get_slot(), value(ctx))
+        return 0
+
+    def run_set_global(ctx):
+        set_global(ctx.globals, var, value(ctx))
+        return 0
+
+    if type(var) == LocalRef:
+        return run_set_local
+    assert type(var) == str
+    return run_set_global
+
+
+def compile_unquote(expr):
+    def run_unquote(ctx):
+        raise RuntimeError(f"Unquote not located within quasiquote: {expr}.")
+    return run_unquote
+
+
+def compile_unquotesplicing(expr):
+    def run_unquotesplicing(ctx):
+        raise RuntimeError(
+            f"Unquote-Splicing must be located within quasiquote: {expr}.")
+    return run_unquotesplicing
+
+
+def compile_quasiquote(expr):
+    assert len(expr) == 2
+    template = map_holes(expr[1], lambda e: compile_node(e, False))
+    if template[0] == QUOTED:
+        value = template[1]
+        return lambda ctx: value
+    return lambda ctx: fill_template(template, lambda hole: hole(ctx))
+
+
+def compile_list(expr):
+    assert len(expr) >= 1
+    operands = compile_operands(expr[1:])
+    return lambda ctx: make_list([operand(ctx) for operand in operands])
+
+
+def compile_if(expr, tail):
+    assert len(expr) >= 4
+    test = compile_node(expr[1], False)
+    then = compile_node(expr[2], False, tail)
+    otherwise = compile_node(expr[3], False, tail)
+
+    def run_if(ctx):
+        # require to be explicitly true
+        if test(ctx) == True:
+            return then(ctx)
+        return otherwise(ctx)
+    return run_if
+
+
+def compile_let(expr, tail, update_let):
     assert len(expr) >= 3
-    assert expr[0] == MAP
-    if in_quasi:
-        return handle_quasi(expr, ctx, in_quasi)
-    function = expr[1]
-    lists = []
-    for lst in expr[2:]:
-        val = eval_expr(lst, ctx, in_quasi)
-        assert type(val) == list
-        lists.append(val)
-    # last arg must be a list
-    assert len(lists) > 0
-    l = len(lists[0])
-    for lst in lists:
-        assert len(lst) == l
-    tupled_lists = list(zip(*lists))
-    to_eval_lists = []
-    for tup in tupled_lists:
-        to_eval_lists.append([function] + list(tup))
-    final_list = list(map(lambda lst: eval_expr(
-        lst, ctx, in_quasi), to_eval_lists))
-    return final_list
+    values = []
+    for binding in expr[1]:
+        assert type(binding) == list
+        assert len(binding) == 2
+        values.append(compile_node(binding[1], False))
+    body = compile_body(expr[2:], tail)
 
+    def run_let(ctx):
+        return body(Frame([value(ctx) for value in values], ctx))
 
-def eval_define_macro(expr, ctx, in_quasi):
-    assert type(expr) == list
+    def run_letstar(ctx):
+        let_ctx = Frame([None] * len(values), ctx)
+        for slot, value in enumerate(values):
+            let_ctx.slots[slot] = value(let_ctx)
+        return body(let_ctx)
+
+    if update_let:
+        return run_letstar
+    return run_let
+
+
+def compile_and(expr):
+    assert len(expr) >= 2
+    operands = compile_operands(expr[1:])
+
+    def run_and(ctx):
+        result = True
+        for operand in operands:
+            b = operand(ctx)
+            assert type(b) == bool
+            result = result and b
+        return result
+    return run_and
+
+
+def compile_or(expr):
+    assert len(expr) >= 2
+    operands = compile_operands(expr[1:])
+
+    def run_or(ctx):
+        result = False
+        for operand in operands:
+            b = operand(ctx)
+            assert type(b) == bool
+            result = result or b
+        return result
+    return run_or
+
+
+def compile_not(expr):
+    assert len(expr) == 2
+    operand = compile_node(expr[1], False)
+
+    def run_not(ctx):
+        b = operand(ctx)
+        assert type(b) == bool
+        return not b
+    return run_not
+
+
+def compile_begin(expr, tail):
+    assert len(expr) >= 2
+    operands = compile_operands(expr[1:-1])
+    operands.append(compile_node(expr[-1], False, tail))
+    if len(operands) == 1:
+        return operands[0]
+    init, last = operands[:-1], operands[-1]
+
+    def run_begin(ctx):
+        for operand in init:
+            operand(ctx)
+        return last(ctx)
+    return run_begin
+
+
+def compile_define(expr):
     assert len(expr) >= 3
-    assert expr[0] == DEFINE_MACRO
-    if in_quasi:
-        return handle_quasi(expr, ctx, in_quasi)
-    binding = expr[1]
+    names = expr[1]
+    if type(names) == list and len(names) >= 1:
+        # is a functional define
+        function_name = names[0]
+        params, is_variadic = parse_params(names[1:])
+        bodies = expr[2:]
+        body = compile_body(bodies, True)
+
+        def run_function_define(ctx):
+            _lambda = Lambda(params, bodies, is_variadic, ctx, body)
+            return define_name(function_name, _lambda, ctx)
+        return run_function_define
+    # variable define
+    assert expr[3:] == []
+    value = compile_node(expr[2], False)
+    return lambda ctx: define_name(names, value(ctx), ctx)
+
+
+def compile_lambda(expr):
+    assert len(expr) >= 3
+    params, is_variadic = parse_params(expr[1])
     bodies = expr[2:]
-    assert len(binding) >= 2
-    name = binding[0]
-    params = binding[1:]
-    macro = Macro(params, bodies)
-    ctx[name] = macro
-    return name
+    body = compile_body(bodies, True)
+    return lambda ctx: Lambda(params, bodies, is_variadic, ctx, body)
 
 
-def eval_delay(expr, ctx, in_quasi):
-    assert type(expr) == list
-    assert len(expr) == 2
-    assert expr[0] == DELAY
-    if in_quasi:
-        return handle_quasi(expr, ctx, in_quasi)
-    return Delay(expr[1])
+def compile_app(expr, tail):
+    operator = compile_node(expr[0], False)
+    operands = compile_operands(expr[1:])
 
+    def run_app(ctx):
+        _lambda = operator(ctx)
+        args = [operand(ctx) for operand in operands]
+        if type(_lambda) == Lambda:
+            charge_budget()
+            return run_compiled(_lambda.get_compiled_body(), bind_args(_lambda, args))
+        return apply_procedure(_lambda, args)
 
-def eval_consstream(expr, ctx, in_quasi):
-    assert type(expr) == list
+    def run_tail_app(ctx):
+        _lambda = operator(ctx)
+        args = [operand(ctx) for operand in operands]
+        if type(_lambda) == Lambda:
+            charge_budget()
+            return TailCall(_lambda.get_compiled_body(), bind_args(_lambda, args))
+        return apply_procedure(_lambda, args)
+
+    if tail:
+        return run_tail_app
+    return run_app
+
+
+def compile_cons(expr):
     assert len(expr) == 3
-    assert expr[0] == CONS_STREAM
-    if in_quasi:
-        return handle_quasi(expr, ctx, in_quasi)
-    new_expr = [CONS, expr[1], [DELAY, expr[2]]]
-    return eval_expr(new_expr, ctx, in_quasi)
+    left, right = compile_operands(expr[1:])
+    return lambda ctx: Cons(left(ctx), right(ctx))
 
 
-def eval_cdrstream(expr, ctx, in_quasi):
-    assert type(expr) == list
+def compile_car(expr):
     assert len(expr) == 2
-    assert expr[0] == CDR_STREAM
-    if in_quasi:
-        return handle_quasi(expr, ctx, in_quasi)
-    new_expr = [FORCE, [CDR, expr[1]]]
-    return eval_expr(new_expr, ctx, in_quasi)
+    operand = compile_node(expr[1], False)
 
+    def run_car(ctx):
+        c = operand(ctx)
+        assert type(c) == Cons
+        return c.get_left()
+    return run_car
 
-def eval_force(expr, ctx, in_quasi):
-    assert type(expr) == list
+
+def compile_cdr(expr):
     assert len(expr) == 2
-    assert expr[0] == FORCE
-    if in_quasi:
-        return handle_quasi(expr, ctx, in_quasi)
-    delay_expr = eval_expr(expr[1], ctx, in_quasi)
-    assert type(delay_expr) == Delay
-    return eval_expr(delay_expr.get_expr(), ctx, in_quasi)
+    operand = compile_node(expr[1], False)
 
+    def run_cdr(ctx):
+        c = operand(ctx)
+        assert type(c) == Cons
+        return c.get_right()
+    return run_cdr
 
-def eval_macro(expr, ctx, in_quasi):
-    assert type(expr) == list
-    assert len(expr) >= 2
-    assert expr[0] in ctx and type(ctx[expr[0]]) == Macro
-    if in_quasi:
-        return handle_quasi(expr, ctx, in_quasi)
-    # at each use, we need to replicate the macro to get new fresh symbols
-    macro_name = expr[0]
-    macro = ctx[macro_name]
-    macro.replicate()
-    ctx[macro_name] = macro
-    # finished replication of macro
-    new_expr = deepcopy(expr)
-    macro = ctx[macro_name]
-    macro_expr = [LAMBDA, macro.get_args(), [BEGIN] + macro.get_bodies()]
-    new_expr = [macro_expr, *new_expr[1:]]
-    return eval_expr(new_expr, ctx, in_quasi)
 
+def compile_apply(expr):
+    assert len(expr) >= 3
+    function = compile_node(expr[1], False)
+    operands = compile_operands(expr[2:])
 
-def eval_cond(expr, ctx, in_quasi):
-    assert type(expr) == list
+    def run_apply(ctx):
+        procedure = function(ctx)
+        args = [operand(ctx) for operand in operands]
+        # last arg must be a list
+        return apply_procedure(procedure, args[:-1] + list_values(args[-1]))
+    return run_apply
+
+
+def compile_map(expr):
+    assert len(expr) >= 3
+    function = compile_node(expr[1], False)
+    operands = compile_operands(expr[2:])
+
+    def run_map(ctx):
+        procedure = function(ctx)
+        lists = [operand(ctx) for operand in operands]
+        return map_procedure(procedure, lists)
+    return run_map
+
+
+def compile_cond(expr, tail):
     assert len(expr) >= 2
-    assert expr[0] == COND
-    if in_quasi:
-        return handle_quasi(expr, ctx, in_quasi)
-    clauses = expr[1:]
-    for i, clause in enumerate(clauses):
+    clauses = []
+    for clause in expr[1:]:
         assert type(clause) == list
         assert len(clause) == 2
         test, e = clause
-        if test == ELSE and i != len(clauses) - 1:
-            raise RuntimeError(f"Else must be last condition in cond: {expr}.")
-        if test == ELSE:
-            return eval_expr(e, ctx, in_quasi)
-        b = eval_expr(test, ctx, in_quasi)
-        assert type(b) == bool
-        # if true on condition, evaluate other side
-        if b:
-            return eval_expr(e, ctx, in_quasi)
-    # undefined return on no matching conditions
-    return 0
-
-
-def eval_for(expr, ctx, in_quasi, is_forlist):
-    assert type(expr) == list
+        is_else = test == ELSE
+        run_test = None if is_else else compile_node(test, False)
+        clauses.append((is_else, run_test, compile_node(e, False, tail)))
+    last = len(clauses) - 1
+
+    def run_cond(ctx):
+        for i, (is_else, run_test, run_clause) in enumerate(clauses):
+            if is_else and i != last:
+                raise RuntimeError(
+                    f"Else must be last condition in cond: {expr}.")
+            if is_else:
+                return run_clause(ctx)
+            b = run_test(ctx)
+            assert type(b) == bool
+            # if true on condition, evaluate other side
+            if b:
+                return run_clause(ctx)
+        # undefined return on no matching conditions
+        return 0
+    return run_cond
+
+
+def compile_for(expr, is_forlist):
     assert len(expr) >= 3
-    assert (expr[0] == FOR and not is_forlist) or (
-        expr[0] == FORLIST and is_forlist)
-    if in_quasi:
-        return handle_quasi(expr, ctx, in_quasi)
-    bindings = expr[1]
-    bodies = expr[2:]
-    new_bodies = [BEGIN] + bodies
-    variables = []
     lists = []
-    for binding in bindings:
+    for binding in expr[1]:
         assert type(binding) == list
         assert len(binding) == 2
         var, lst = binding
         assert type(var) == str
-        variables.append(var)
-        value_lst = eval_expr(lst, ctx, in_quasi)
-        lists.append(value_lst)
-    final_list = []
-    for values in zip(*lists):
-        val_list = list(values)
-        for var, val in zip(variables, values):
-            ctx[var] = val
-        final_val = eval_expr(new_bodies, ctx, in_quasi)
-        final_list.append(final_val)
-    if is_forlist:
-        return final_list
-    # for does not return list
-    return 0
+        lists.append(compile_node(lst, False))
+    body = compile_body(expr[2:], False)
+
+    def run_for(ctx):
+        value_lists = [list_values(lst(ctx)) for lst in lists]
+        final_list = []
+        for values in zip(*value_lists):
+            # fresh frame for each iteration, one slot per variable
+            final_list.append(body(Frame(list(values), ctx)))
+        if is_forlist:
+            return make_list(final_list)
+        # for does not return list
+        return 0
+    return run_for
+
+
+def compile_delay(expr):
+    assert len(expr) == 2
+    delayed = expr[1]
+    is_lazy = expr[0] == DELAY_FORCE
+    return lambda ctx: Delay(delayed, ctx, is_lazy)
 
 
-def eval_append(expr, ctx, in_quasi):
-    assert type(expr) == list
+def compile_force(expr):
+    assert len(expr) == 2
+    operand = compile_node(expr[1], False)
+    return lambda ctx: force_delay(operand(ctx))
+
+
+def compile_future(expr):
+    assert len(expr) == 2
+    body = compile_node(expr[1], False)
+
+    def run_future(ctx):
+        child = child_frame(ctx)
+        return future_of(child.globals, body, child)
+    return run_future
+
+
+def compile_consstream(expr):
+    assert len(expr) == 3
+    left = compile_node(expr[1], False)
+    delayed = expr[2]
+    return lambda ctx: Cons(left(ctx), Delay(delayed, ctx))
+
+
+def compile_cdrstream(expr):
+    assert len(expr) == 2
+    return compile_force([FORCE, [CDR, expr[1]]])
+
+
+def compile_append(expr):
     assert len(expr) >= 3
-    assert expr[0] == APPEND
-    if in_quasi:
-        return handle_quasi(expr, ctx, in_quasi)
-    lists = expr[1:]
-    evaluated_lists = []
-    for lst in lists:
-        evaluated_lists.append(eval_expr(lst, ctx, in_quasi))
-    final_lst = []
-    for lst in evaluated_lists:
-        assert type(lst) == list
-        for v in lst:
-            final_lst.append(v)
-    return final_lst
+    operands = compile_operands(expr[1:])
+
+    def run_append(ctx):
+        return append_lists(*[operand(ctx) for operand in operands])
+    return run_append
+
+
+def compile_match(expr, tail):
+    assert len(expr) == 3
+    value = compile_node(expr[1], False)
+    tree = expr[2].get_tree()
+    bodies = [compile_body(clause[1:], tail) for clause in expr[2].get_clauses()]
+
+    def run_match(ctx):
+        matched = run_match_tree(tree, value(ctx), ctx)
+        if matched is None:
+            # no match , return any value, say 0
+            return 0
+        clause, clause_ctx = matched
+        return bodies[clause](clause_ctx)
+    return run_match
+
+
+COMPILERS = {
+    ADD: compile_add,
+    SUB: compile_sub,
+    MUL: compile_mul,
+    DIV: compile_div,
+    EXP: compile_exp,
+    CONCAT: compile_concat,
+    QUOTE: compile_quote,
+    PRINTLN: compile_println,
+    SET: compile_set,
+    EQ: compile_eq,
+    QUASIQUOTE: compile_quasiquote,
+    UNQUOTE: compile_unquote,
+    LIST: compile_list,
+    UNQUOTE_SPLICING: compile_unquotesplicing,
+    AND: compile_and,
+    OR: compile_or,
+    NEQ: compile_neq,
+    LT: compile_lt,
+    LTE: compile_lte,
+    GT: compile_gt,
+    GTE: compile_gte,
+    NOT: compile_not,
+    DEFINE: compile_define,
+    LAMBDA: compile_lambda,
+    CAR: compile_car,
+    CDR: compile_cdr,
+    CONS: compile_cons,
+    APPLY: compile_apply,
+    MAP: compile_map,
+    FOR: lambda expr: compile_for(expr, False),
+    FORLIST: lambda expr: compile_for(expr, True),
+    DELAY: compile_delay,
+    DELAY_FORCE: compile_delay,
+    FORCE: compile_force,
+    CONS_STREAM: compile_consstream,
+    CDR_STREAM: compile_cdrstream,
+    APPEND: compile_append,
+    FUTURE: compile_future,
+}
+
+
+# forms that pass tail position on to their subforms
+TAIL_COMPILERS = {
+    IF: compile_if,
+    LET: lambda expr, tail: compile_let(expr, tail, False),
+    LETSTAR: lambda expr, tail: compile_let(expr, tail, True),
+    BEGIN: compile_begin,
+    COND: compile_cond,
+    MATCH: compile_match,
+}
 
 
-def match_pattern(value, pattern, ctx, in_quasi, add_bindings):
+def run_machine(expr, ctx, budget=None):
     """
-    returns True when pattern matches else False,
-    When add_bindings is true, does side effects like updating context when 
-    pattern matches but does not evaluate body. Otherwise, when add_bindings
-    is false, no side effects on context.
-    Never has side effects on in_quasi
+    evaluates a parsed program on the CEK machine with the global context
+    ctx, giving the same value as eval_program(expr, ctx, budget). The
+    budget is charged a step for each machine step.
+    """
+    if budget is not None:
+        budget.start()
+    machine = Machine(resolve(expr), global_frame(ctx))
+    return in_budget(budget, in_globals, ctx, machine.run)
+
 
-    Recursive descends through pattern and value to create strongest matching.
+class Continuation():
+    """
+    heap allocated continuation frame of the CEK machine, saying what to
+    do with the value of the current control expression before handing
+    the result on to parent
     """
-    if type(pattern) != list:
-        if pattern == UNDERSCORE:
-            # match all, no bindings updated
-            return True
-        if pattern == NIL:
-            return value == []
-        # pattern is a string --> understood to be a variable
-        if type(pattern) == str:
-            # update binding
-            if add_bindings:
-                ctx[pattern] = value
-            return True
-        # pattern must be a literal
-        return pattern == value
-
-    assert type(pattern) == list
-    assert len(pattern) >= 2
 
-    head = pattern[0]
-    if head == QUOTE:
-        assert len(pattern) == 2
-        datum = pattern[0]
-        return datum == value
-    elif head == LIST:
-        assert len(pattern) >= 2
-        binders = pattern[1:]
-        if type(value) == list:
-            if len(value) != len(binders):
-                return False
-            for var, val in zip(binders, value):
-                result = match_pattern(val, var, ctx, in_quasi, add_bindings)
-                if not result:
-                    return False
-            return True
-        return False
-    elif head == CONS:
-        assert len(pattern) >= 3
-        left = pattern[1]
-        right = pattern[2]
-        if type(value) == Cons:
-            lval = value.get_left()
-            lresult = match_pattern(lval, left, ctx, in_quasi, add_bindings)
-            if not lresult:
-                return False
+    def __init__(self, kind, expr, env, parent):
+        super().__init__()
+        self.kind = kind
+        self.expr = expr
+        self.env = env
+        self.parent = parent
+        # position within expr and values collected so far
+        self.index = 0
+        self.values = []
+        self.data = None
+
+
+K_IF = "if"
+K_BEGIN = "begin"
+K_OPERANDS = "operands"
+K_LETSTAR = "let*"
+K_DEFINE = "define"
+K_SET = "set!"
+K_COND = "cond"
+K_MATCH = "match"
+K_FOR = "for"
+K_MAP = "map"
+K_CONS_STREAM = "cons-stream"
+K_FORCE = "force"
+K_QUASI = "quasi"
+
+# strict forms whose operands are all evaluated, then given to a builtin,
+# with the (least, most) form lengths and the operand type the tree walker
+# asserts for each, None when it asserts nothing
+MACHINE_PRIMITIVE_FORMS = {
+    ADD: (3, None, None),
+    SUB: (3, None, None),
+    MUL: (3, None, None),
+    DIV: (3, 3, None),
+    EXP: (3, 3, None),
+    CONCAT: (3, 3, String),
+    PRINTLN: (2, None, None),
+    EQ: (3, 3, None),
+    LIST: (1, None, None),
+    AND: (2, None, bool),
+    OR: (2, None, bool),
+    NEQ: (3, 3, None),
+    LT: (3, 3, None),
+    LTE: (3, 3, None),
+    GT: (3, 3, None),
+    GTE: (3, 3, None),
+    NOT: (2, 2, bool),
+    CAR: (2, 2, Cons),
+    CDR: (2, 2, Cons),
+    CONS: (3, 3, None),
+    APPEND: (3, None, None),
+}
 
-            rval = value.get_right()
-            rresult = match_pattern(rval, right, ctx, in_quasi, add_bindings)
-            if not rresult:
-                return False
 
-            return True
-        return False
+class Machine():
+    """
+    CEK machine: control, environment and continuation registers, and a
+    step loop. Every pending computation is a Continuation on the heap
+    instead of a python stack frame, so recursion depth, tail or not, is
+    limited only by memory.
+    """
 
+    def __init__(self, control, env):
+        super().__init__()
+        self.control = control
+        self.env = env
+        self.kont = None
+        self.value = None
+        self.returning = False
+
+    def run(self):
+        budget = BUDGET.get()
+        while True:
+            if not self.returning:
+                if budget is not None:
+                    budget.charge()
+                self.step()
+            elif self.kont is None:
+                return self.value
+            else:
+                kont = self.kont
+                self.kont = kont.parent
+                self.resume(kont)
+
+    def give(self, value):
+        self.value = value
+        self.returning = True
+
+    def evaluate(self, control, env):
+        self.control = control
+        self.env = env
+        self.returning = False
+
+    def push(self, kind, expr, env):
+        kont = Continuation(kind, expr, env, self.kont)
+        self.kont = kont
+        return kont
+
+    def step(self):
+        expr = self.control
+        env = self.env
+        if type(expr) in [int, bool, String, Keyword]:
+            return self.give(expr)
+        elif type(expr) == LocalRef:
+            return self.give(env.lookup(expr.depth, expr.slot))
+        elif type(expr) == GlobalRef:
+            return self.give(lookup_ref(expr, env))
+        elif expr == NIL:
+            return self.give([])
+        elif type(expr) == str:
+            return self.give(lookup_global(expr, env))
+
+        assert type(expr) == list
+        assert len(expr) >= 1
+        first = expr[0]
+        if type(first) != str or first not in SPECIAL_FORMS:
+            return self.operands("app", expr, expr, env)
+        elif first in MACHINE_PRIMITIVE_FORMS:
+            least, most, _ = MACHINE_PRIMITIVE_FORMS[first]
+            assert len(expr) >= least
+            assert most is None or len(expr) <= most
+            return self.operands("primitive", expr, expr[1:], env)
+        elif first == QUOTE:
+            assert len(expr) == 2
+            return self.give(expr[1])
+        elif first == QUASIQUOTE:
+            assert len(expr) == 2
+            return self.quasi(expr[1], env)
+        elif first == UNQUOTE:
+            raise RuntimeError(
+                f"Unquote not located within quasiquote: {expr}.")
+        elif first == UNQUOTE_SPLICING:
+            raise RuntimeError(
+                f"Unquote-Splicing must be located within quasiquote: {expr}.")
+        elif first == IF:
+            assert len(expr) >= 4
+            self.push(K_IF, expr, env)
+            return self.evaluate(expr[1], env)
+        elif first == BEGIN:
+            assert len(expr) >= 2
+            return self.begin(expr, 1, env)
+        elif first == LET:
+            assert len(expr) >= 3
+            inits = [e for (_, e) in expr[1]]
+            return self.operands("let", expr, inits, env)
+        elif first == LETSTAR:
+            assert len(expr) >= 3
+            let_env = Frame([None] * len(expr[1]), env)
+            return self.letstar(self.push(K_LETSTAR, expr, let_env))
+        elif first == DEFINE:
+            assert len(expr) >= 3
+            names = expr[1]
+            if type(names) == list and len(names) >= 1:
+                params, is_variadic = parse_params(names[1:])
+                _lambda = Lambda(params, expr[2:], is_variadic, env)
+                return self.give(define_name(names[0], _lambda, env))
+            assert expr[3:] == []
+            self.push(K_DEFINE, expr, env)
+            return self.evaluate(expr[2], env)
+        elif first == LAMBDA:
+            assert len(expr) >= 3
+            params, is_variadic = parse_params(expr[1])
+            return self.give(Lambda(params, expr[2:], is_variadic, env))
+        elif first == SET:
+            assert len(expr) == 3
+            self.push(K_SET, expr, env)
+            return self.evaluate(expr[2], env)
+        elif first == COND:
+            assert len(expr) >= 2
+            return self.cond(expr, 1, env)
+        elif first in [FOR, FORLIST]:
+            assert len(expr) >= 3
+            lists = [lst for (_, lst) in expr[1]]
+            return self.operands("for", expr, lists, env)
+        elif first in [DELAY, DELAY_FORCE]:
+            assert len(expr) == 2
+            return self.give(Delay(expr[1], env, first == DELAY_FORCE))
+        elif first == FUTURE:
+            assert len(expr) == 2
+            child = child_frame(env)
+            return self.give(future_of(child.globals, Machine(expr[1], child).run))
+        elif first == CONS_STREAM:
+            assert len(expr) == 3
+            self.push(K_CONS_STREAM, expr, env)
+            return self.evaluate(expr[1], env)
+        elif first in [FORCE, CDR_STREAM, APPLY, MAP]:
+            return self.operands(first, expr, expr[1:], env)
+        elif first == MATCH:
+            assert len(expr) == 3
+            self.push(K_MATCH, expr, env)
+            return self.evaluate(expr[1], env)
+        raise RuntimeError(f"Expression could not be matched: {expr}.")
 
-def eval_match(expr, ctx, in_quasi):
-    assert type(expr) == list
-    assert len(expr) >= 3
-    assert expr[0] == MATCH
-    if in_quasi:
-        return handle_quasi(expr, ctx, in_quasi)
-    val_expr = expr[1]
-    clauses = expr[2:]
-    val = eval_expr(val_expr, ctx, in_quasi)
-    # can add more patterns as one desires
-    for clause in clauses:
+    def operands(self, action, expr, exprs, env):
+        """
+        evaluates exprs left to right, then finishes action on the values
+        """
+        if exprs == []:
+            return self.finish(action, expr, [], env)
+        kont = self.push(K_OPERANDS, expr, env)
+        kont.data = (action, exprs)
+        return self.evaluate(exprs[0], env)
+
+    def finish(self, action, expr, values, env):
+        if action == "primitive":
+            _, _, operand_type = MACHINE_PRIMITIVE_FORMS[expr[0]]
+            if operand_type is not None:
+                for value in values:
+                    assert type(value) == operand_type
+            return self.give(BUILTINS[expr[0]].get_function()(*values))
+        elif action == "app":
+            return self.apply(values[0], values[1:])
+        elif action == "let":
+            bodies = [BEGIN] + expr[2:]
+            return self.evaluate(bodies, Frame(values, env))
+        elif action == "for":
+            rows = list(zip(*map(list_values, values)))
+            if rows == []:
+                return self.give([] if expr[0] == FORLIST else 0)
+            kont = self.push(K_FOR, expr, env)
+            kont.data = rows
+            return self.evaluate([BEGIN] + expr[2:], Frame(list(rows[0]), env))
+        elif action == FORCE:
+            return self.force(values[0])
+        elif action == CDR_STREAM:
+            c = values[0]
+            assert type(c) == Cons
+            return self.force(c.get_right())
+        elif action == APPLY:
+            assert len(values) >= 2
+            # last arg must be a list
+            return self.apply(values[0], values[1:-1] + list_values(values[-1]))
+        elif action == MAP:
+            if type(values[1]) == Vector:
+                return self.give(vector_map(values[0], *values[1:]))
+            lists = [list_values(lst) for lst in values[1:]]
+            # last arg must be a list
+            assert len(lists) > 0
+            for lst in lists:
+                assert len(lst) == len(lists[0])
+            rows = list(zip(*lists))
+            if rows == []:
+                return self.give([])
+            kont = self.push(K_MAP, expr, env)
+            kont.data = (values[0], rows)
+            return self.apply(values[0], list(rows[0]))
+        raise RuntimeError(f"Unknown machine action {action}: {expr}.")
+
+    def apply(self, procedure, args):
+        if type(procedure) == Primitive:
+            return self.give(procedure.get_function()(*args))
+        assert type(procedure) == Lambda
+        frame = bind_args(procedure, args)
+        # no continuation is pushed, so calls in tail position are free
+        return self.evaluate(procedure.get_body(), frame)
+
+    def force(self, delay_expr):
+        assert type(delay_expr) == Delay
+        if delay_expr.get_is_forced():
+            return self.give(delay_expr.get_value())
+        elif delay_expr.get_thunk() is not None:
+            settle_promise(delay_expr, delay_expr.get_thunk()())
+            return self.force(delay_expr)
+        kont = self.push(K_FORCE, None, None)
+        kont.data = delay_expr
+        return self.evaluate(delay_expr.get_expr(), delay_expr.get_env())
+
+    def begin(self, expr, index, env):
+        if index < len(expr) - 1:
+            kont = self.push(K_BEGIN, expr, env)
+            kont.index = index
+        return self.evaluate(expr[index], env)
+
+    def letstar(self, kont):
+        expr = kont.expr
+        bindings = expr[1]
+        if kont.index < len(bindings):
+            return self.evaluate(bindings[kont.index][1], kont.env)
+        # finished bindings, body is in tail position
+        self.kont = kont.parent
+        return self.evaluate([BEGIN] + expr[2:], kont.env)
+
+    def cond(self, expr, index, env):
+        clauses = expr[1:]
+        if index > len(clauses):
+            # undefined return on no matching conditions
+            return self.give(0)
+        clause = expr[index]
         assert type(clause) == list
-        assert len(clause) >= 2
-        pattern = clause[0]
-        bodies = clause[1:]
-        final_bodies = [BEGIN] + bodies
-        # no side effect match
-        match = match_pattern(val, pattern, ctx, in_quasi, False)
-        if match:
-            # binding and have side effects for context
-            match_pattern(val, pattern, ctx, in_quasi, True)
-            return eval_expr(final_bodies, ctx, in_quasi)
-    # no match , return any value, say 0
+        assert len(clause) == 2
+        test, e = clause
+        if test == ELSE:
+            if index != len(clauses):
+                raise RuntimeError(
+                    f"Else must be last condition in cond: {expr}.")
+            return self.evaluate(e, env)
+        kont = self.push(K_COND, expr, env)
+        kont.index = index
+        return self.evaluate(test, env)
+
+    def quasi(self, node, env):
+        """
+        evaluates a compiled quasiquote template, see quasi_template, where
+        only the holes are code
+        """
+        kind = node[0]
+        if kind == QUOTED:
+            return self.give(node[1])
+        elif kind == HOLE:
+            return self.evaluate(node[1], env)
+        elif kind == BAD_SPLICE:
+            raise RuntimeError(
+                f"Inner Form in Unquote-Splicing must be a list form: {node[1]}.")
+        kont = self.push(K_QUASI, node, env)
+        return self.quasi_element(kont)
+
+    def quasi_element(self, kont):
+        item = kont.expr[1][kont.index]
+        kont.data = item[0] == SPLICE
+        if kont.data:
+            return self.evaluate(item[1], kont.env)
+        return self.quasi(item, kont.env)
+
+    def resume(self, kont):
+        """
+        hands the value just computed to the continuation frame kont
+        """
+        value = self.value
+        kind = kont.kind
+        expr = kont.expr
+        env = kont.env
+        if kind == K_OPERANDS:
+            kont.values.append(value)
+            kont.index += 1
+            action, exprs = kont.data
+            if kont.index < len(exprs):
+                self.kont = kont
+                return self.evaluate(exprs[kont.index], env)
+            return self.finish(action, expr, kont.values, env)
+        elif kind == K_IF:
+            # require to be explicitly true
+            if value == True:
+                return self.evaluate(expr[2], env)
+            return self.evaluate(expr[3], env)
+        elif kind == K_BEGIN:
+            return self.begin(expr, kont.index + 1, env)
+        elif kind == K_LETSTAR:
+            env.slots[kont.index] = value
+            kont.index += 1
+            self.kont = kont
+            return self.letstar(kont)
+        elif kind == K_DEFINE:
+            return self.give(define_name(expr[1], value, env))
+        elif kind == K_SET:
+            var = expr[1]
+            if type(var) == LocalRef:
+                env.assign(var.get_depth(), var.get_slot(), value)
+            else:
+                assert type(var) == str
+                set_global(env.globals, var, value)
+            return self.give(0)
+        elif kind == K_COND:
+            assert type(value) == bool
+            # if true on condition, evaluate other side
+            if value:
+                return self.evaluate(expr[kont.index][1], env)
+            return self.cond(expr, kont.index + 1, env)
+        elif kind == K_MATCH:
+            matched = run_match_tree(expr[2].get_tree(), value, env)
+            if matched is None:
+                # no match , return any value, say 0
+                return self.give(0)
+            clause, clause_env = matched
+            return self.evaluate(expr[2].get_bodies()[clause], clause_env)
+        elif kind == K_FOR:
+            kont.values.append(value)
+            kont.index += 1
+            rows = kont.data
+            if kont.index < len(rows):
+                self.kont = kont
+                row_env = Frame(list(rows[kont.index]), env)
+                return self.evaluate([BEGIN] + expr[2:], row_env)
+            # for does not return list
+            return self.give(make_list(kont.values) if expr[0] == FORLIST else 0)
+        elif kind == K_MAP:
+            kont.values.append(value)
+            kont.index += 1
+            procedure, rows = kont.data
+            if kont.index < len(rows):
+                self.kont = kont
+                return self.apply(procedure, list(rows[kont.index]))
+            return self.give(make_list(kont.values))
+        elif kind == K_CONS_STREAM:
+            return self.give(Cons(value, Delay(expr[2], env)))
+        elif kind == K_FORCE:
+            settle_promise(kont.data, value)
+            return self.force(kont.data)
+        elif kind == K_QUASI:
+            if kont.data:
+                kont.values += list_values(value)
+            else:
+                kont.values.append(value)
+            kont.index += 1
+            if kont.index < len(expr[1]):
+                self.kont = kont
+                return self.quasi_element(kont)
+            return self.give(cons_chain(kont.values, expr[2]))
+        raise RuntimeError(f"Unknown continuation {kind}: {expr}.")
+
+
+# machine steps between turns an AsyncMachine gives the event loop
+ASYNC_STEPS = 1000
+
+
+class AsyncMachine(Machine):
+    """
+    CEK machine run as a coroutine, see eval_async. Calls of the builtins
+    in ASYNC_PRIMITIVES suspend the machine on their coroutine, and it
+    gives the event loop a turn every ASYNC_STEPS steps, so that any number
+    of machines take turns on one thread. Procedures that builtins call
+    back, like the function of vector-map, run to the end without turns.
+    """
+
+    def __init__(self, control, env):
+        super().__init__(control, env)
+        # coroutine of a builtin the machine waits on
+        self.waiting = None
+
+    def apply(self, procedure, args):
+        if type(procedure) == Primitive and procedure.get_name() in ASYNC_PRIMITIVES:
+            self.waiting = ASYNC_PRIMITIVES[procedure.get_name()](*args)
+            return
+        return super().apply(procedure, args)
+
+    async def run_async(self):
+        while True:
+            # the loop of run, cut into slices
+            for _ in range(ASYNC_STEPS):
+                if self.waiting is not None:
+                    break
+                elif not self.returning:
+                    self.step()
+                elif self.kont is None:
+                    return self.value
+                else:
+                    kont = self.kont
+                    self.kont = kont.parent
+                    self.resume(kont)
+            if self.waiting is not None:
+                waiting = self.waiting
+                self.waiting = None
+                self.give(await waiting)
+            else:
+                await asyncio.sleep(0)
+
+
+async def run_thunk(thunk):
+    if type(thunk) == Primitive:
+        return thunk.get_function()()
+    return await AsyncMachine(thunk.get_body(), bind_args(thunk, [])).run_async()
+
+
+async def spawn_async(thunk):
+    if type(thunk) not in [Lambda, Primitive]:
+        raise RuntimeError(f"Expected a procedure to spawn: {expr_to_str(thunk)}.")
+    return Task(asyncio.get_running_loop().create_task(run_thunk(thunk)))
+
+
+async def sleep_async(milliseconds):
+    assert type(milliseconds) == int and milliseconds >= 0
+    await asyncio.sleep(milliseconds / 1000)
     return 0
 
 
-def handle_quasi(expr, ctx, in_quasi):
-    assert type(expr) == list
-    assert len(expr) > 1
-    remainder = []
-    for e in expr:
-        v = eval_expr(e, ctx, in_quasi)
-        if type(v) == tuple:
-            assert len(v) == 2
-            (lst, _) = v
-            assert type(lst) == list
-            for elt in lst:
-                remainder.append(elt)
-        else:
-            remainder.append(v)
-    return remainder
+async def channel_get_async(channel):
+    channel = channel_of(channel)
+    if channel.get_size() > 0:
+        return channel.values.popleft()
+    getter = asyncio.get_running_loop().create_future()
+    channel.getters.append(getter)
+    return await getter
+
+
+async def touch_async(future):
+    if type(future) == Task:
+        return await future.task
+    # futures run on threads, waited for off the event loop
+    return await asyncio.get_running_loop().run_in_executor(None, touch, future)
+
+
+# builtins that wait, by the coroutines an AsyncMachine awaits for them
+ASYNC_PRIMITIVES = {
+    SPAWN: spawn_async,
+    SLEEP: sleep_async,
+    CHANNEL_GET: channel_get_async,
+    TOUCH: touch_async,
+}
+
+
+async def eval_async(expr, ctx):
+    """
+    evaluates a parsed program on the CEK machine with the global context
+    ctx, like run_machine, as a coroutine that shares its event loop with
+    other coroutines: (sleep ms), (channel-get c) and touch of a task wait
+    without blocking the loop, (spawn thunk) runs thunk as a new task, and
+    long computations give the loop a turn every ASYNC_STEPS steps. Tasks
+    the program spawns keep running after it returns.
+    """
+    global asyncio
+    if asyncio is None:
+        asyncio = import_past_ast("asyncio")
+    # spawned tasks copy the context, and with it the globals, of this one
+    token = EVAL_GLOBALS.set(ctx)
+    try:
+        return await AsyncMachine(resolve(expr), global_frame(ctx)).run_async()
+    finally:
+        EVAL_GLOBALS.reset(token)
 
 
 def remove_comments(string):
@@ -1256,8 +4848,11 @@ def lex(string):
             new_tokens.append(int(token))
         elif token[0] == QUOTATION_MARK and token[-1] == QUOTATION_MARK:
             new_tokens.append(String(token[1:-1]))
+        elif token.startswith(KEYWORD_PREFIX) and len(token) > len(KEYWORD_PREFIX):
+            new_tokens.append(Keyword(token[len(KEYWORD_PREFIX):]))
         else:
-            new_tokens.append(token)
+            # equal symbols are one object, see EVALUATORS
+            new_tokens.append(sys.intern(token))
 
     return new_tokens
 
@@ -1335,7 +4930,7 @@ def parse(tokens):
             return token
         elif type(token) == bool:
             return token
-        elif type(token) == String:
+        elif type(token) in [String, Keyword]:
             return token
         elif type(token) == list:
             # preparsed already from recursion
@@ -1513,8 +5108,14 @@ def postparse(parsed):
     return parsed
 
 
-def frontend(string):
-    return postparse(parse(preparse(lex(string))))
+def frontend(string, macros=None):
+    """
+    parses a program and expands its macros. Macros defined at top level
+    are added to macros, if given, for later programs to use.
+    """
+    if macros is None:
+        macros = {}
+    return expand(postparse(parse(preparse(lex(string)))), macros)
 
 
 if __name__ == "__main__":
@@ -1570,6 +5171,14 @@ if __name__ == "__main__":
              r'(delay (/ 1 0))',
              r'(force (delay (/ 2 1)))',
              r'(begin (define p (delay (/ 1 1))) (force p))',
+             r'(begin (define n 0) (define p (delay (begin (set! n (+ n 1)) n))) (force p) (list (force p) n))',
+             r'(begin (define (loop k) (if (eq? k 0) (make-promise 7) (delay-force (loop (- k 1))))) (force (loop 5000)))',
+             r'(stream->list (stream-take 5 (stream-map (lambda (x) (* x x)) (integers-from 1))))',
+             r'(begin (define (ints k) (cons-stream k (ints (+ k 1)))) (stream->list (stream-take 3 (stream-filter (lambda (x) (gt? x 10)) (ints 0)))))',
+             r'(begin (define-memo (fib n) #:max-size 50 (if (lt? n 2) n (+ (fib (- n 1)) (fib (- n 2))))) (list (fib 60) (memo-stats fib)))',
+             r'(begin (define x 1) (define f (future (begin (define x 2) (* x 10)))) (list (touch f) x (future-all (list (future (+ x 1)) f))))',
+             r'(begin (define h (make-hash)) (hash-set! h (list 1 2) 3) (hash-set! h "k" 4) (hash-remove! h "k") (define i (hash-set (hash 1 2) 3 4)) (list h (hash-ref h (list 1 2)) (hash-ref h 5 0) (hash-count i) (hash-ref i 3)))',
+             r'(begin (define c (make-channel)) (channel-put! c 1) (channel-put! c (list 2 3)) (list (channel-get c) c (channel-get c) (sleep 0)))',
              r'(begin (define (decr count) (if (eq? count 0) (println "Done") (begin (println count) (decr (- count 1))) )) (decr 3))',
              r'(cons-stream 2 3)',
              r'(cdr-stream (cons-stream 2 3))',
@@ -1646,4 +5255,4 @@ if __name__ == "__main__":
         print("-" * 70)
         print(expr_to_str(frontend(string)))
         context = {}
-        print(expr_to_str(eval_expr(frontend(string), context, False)))
+        print(expr_to_str(eval_program(frontend(string), context)))
@@ -0,0 +1,363 @@
+"""
+Partial evaluation of parsed scheme programs, run after macro expansion
+
+fold_program folds calls of pure builtins whose arguments are literals,
+like (+ 1 2) or (car (cons 2 3)), prunes if and cond branches whose tests
+are literals, inlines let bindings of literals into their bodies, and
+turns immediately applied lambdas into lets, so that their literal
+arguments are inlined too. Anything the pass is unsure of is left for the
+engines, so that errors still happen at runtime.
+
+Run python3 fold.py "(program)" to see a program before and after folding.
+"""
+import sys
+
+from eval import *
+
+
+# values that can be copied to every use of a variable bound to them
+LITERALS = [int, bool, String, Keyword]
+
+# builtins folded on literals, with the argument types they are folded for
+# and the number of arguments their special forms accept
+FOLDABLE = {
+    ADD: ([int], 2, None),
+    SUB: ([int], 2, None),
+    MUL: ([int], 2, None),
+    DIV: ([int], 2, 2),
+    EXP: ([int], 2, 2),
+    EQ: ([int, bool], 2, 2),
+    NEQ: ([int, bool], 2, 2),
+    LT: ([int], 2, 2),
+    GT: ([int], 2, 2),
+    LTE: ([int], 2, 2),
+    GTE: ([int], 2, 2),
+    NOT: ([bool], 1, 1),
+    AND: ([bool], 1, None),
+    OR: ([bool], 1, None),
+}
+
+# larger powers are left to runtime, which may never reach them
+MAX_EXPONENT = 256
+
+# names a let binding is never inlined for
+RESERVED = SPECIAL_FORMS | {NIL, ELSE, UNDERSCORE, VARIADIC}
+
+
+def is_literal(expr):
+    return type(expr) in LITERALS or expr == NIL
+
+
+def count_nodes(expr):
+    if type(expr) != list:
+        return 1
+    return 1 + sum(count_nodes(e) for e in expr)
+
+
+def fold_program(expr):
+    """
+    returns the folded program and the number of nodes folded away
+    """
+    folded = fold(expr)
+    return folded, count_nodes(expr) - count_nodes(folded)
+
+
+def fold(expr):
+    if type(expr) != list or len(expr) == 0:
+        return expr
+    first = expr[0]
+    if type(first) == str and first in FOLDERS:
+        return FOLDERS[first](expr)
+    elif type(first) == str and first in SPECIAL_FORMS:
+        return fold_builtin([first] + fold_all(expr[1:]))
+    expr = fold_all(expr)
+    if type(expr[0]) == list and len(expr[0]) >= 3 and expr[0][0] == LAMBDA:
+        return fold_beta(expr)
+    return expr
+
+
+def fold_all(exprs):
+    return [fold(e) for e in exprs]
+
+
+def fold_builtin(expr):
+    first = expr[0]
+    if first not in FOLDABLE:
+        return expr
+    types, least, most = FOLDABLE[first]
+    args = expr[1:]
+    if len(args) < least or (most is not None and len(args) > most):
+        return expr
+    if any(type(arg) not in types for arg in args):
+        return expr
+    if first == DIV and args[1] == 0:
+        return expr
+    if first == EXP and not 0 <= args[1] <= MAX_EXPONENT:
+        return expr
+    try:
+        value = BUILTINS[first].get_function()(*args)
+    except ArithmeticError:
+        return expr
+    assert type(value) in [int, bool]
+    return value
+
+
+def fold_quote(expr):
+    return expr
+
+
+def fold_quasi(expr):
+    # only unquoted expressions are evaluated
+    if type(expr) != list or len(expr) == 0:
+        return expr
+    first = expr[0]
+    if first == UNQUOTE and len(expr) == 2:
+        return [first, fold(expr[1])]
+    elif first in [UNQUOTE_SPLICING, QUASIQUOTE]:
+        return expr
+    return [fold_quasi(e) for e in expr]
+
+
+def fold_quasiquote(expr):
+    return [QUASIQUOTE] + [fold_quasi(e) for e in expr[1:]]
+
+
+def fold_if(expr):
+    expr = [IF] + fold_all(expr[1:])
+    # the engines take the first branch only for a true test
+    if len(expr) == 4 and type(expr[1]) == bool:
+        return expr[2] if expr[1] else expr[3]
+    return expr
+
+
+def fold_cond(expr):
+    clauses = expr[1:]
+    tests = [clause[0] for clause in clauses if type(clause) == list and len(clause) == 2]
+    if len(tests) != len(clauses) or ELSE in tests[:-1]:
+        return [COND] + [fold_all(clause) for clause in clauses]
+    kept = []
+    for test, e in clauses:
+        if test != ELSE:
+            test = fold(test)
+        e = fold(e)
+        if type(test) == bool and not test:
+            continue
+        elif test == ELSE or (type(test) == bool and test):
+            kept.append([ELSE, e])
+            break
+        kept.append([test, e])
+    if kept == []:
+        # cond with no true clause evaluates to 0
+        return 0
+    elif kept[0][0] == ELSE:
+        return kept[0][1]
+    return [COND] + kept
+
+
+def fold_pair_access(expr):
+    expr = [expr[0]] + fold_all(expr[1:])
+    if len(expr) != 2:
+        return expr
+    pair = expr[1]
+    if type(pair) == list and len(pair) == 3 and pair[0] == CONS and \
+            is_literal(pair[1]) and is_literal(pair[2]):
+        return pair[1] if expr[0] == CAR else pair[2]
+    return expr
+
+
+def fold_lambda(expr):
+    return [LAMBDA, expr[1]] + fold_all(expr[2:])
+
+
+def fold_define(expr):
+    return [DEFINE, expr[1]] + fold_all(expr[2:])
+
+
+def fold_for(expr):
+    bindings = [[var, fold(lst)] for (var, lst) in expr[1]]
+    return [expr[0], bindings] + fold_all(expr[2:])
+
+
+def fold_match(expr):
+    clauses = [[clause[0]] + fold_all(clause[1:]) for clause in expr[2:]]
+    return [MATCH, fold(expr[1])] + clauses
+
+
+def fold_let(expr):
+    names = [name for (name, _) in expr[1]]
+    bindings = [[name, fold(e)] for (name, e) in expr[1]]
+    bodies = expr[2:]
+    if len(set(names)) != len(names):
+        return [LET, bindings] + fold_all(bodies)
+    kept = []
+    for name, e in bindings:
+        if is_literal(e) and can_inline(name, bodies):
+            bodies = [substitute(body, name, e) for body in bodies]
+        else:
+            kept.append([name, e])
+    return let_or_begin(LET, kept, fold_all(bodies))
+
+
+def fold_letstar(expr):
+    bindings = [list(binding) for binding in expr[1]]
+    bodies = expr[2:]
+    kept = []
+    for i, (name, e) in enumerate(bindings):
+        e = fold(e)
+        later = bindings[i + 1:]
+        if is_literal(e) and name not in [n for (n, _) in later] and \
+                can_inline(name, [later_e for (_, later_e) in later] + bodies):
+            for binding in later:
+                binding[1] = substitute(binding[1], name, e)
+            bodies = [substitute(body, name, e) for body in bodies]
+        else:
+            kept.append([name, e])
+    return let_or_begin(LETSTAR, kept, fold_all(bodies))
+
+
+def let_or_begin(form, bindings, bodies):
+    # a let without bindings still gives its internal defines a frame
+    if bindings != [] or has_define(bodies):
+        return [form, bindings] + bodies
+    elif len(bodies) == 1:
+        return bodies[0]
+    return [BEGIN] + bodies
+
+
+def fold_beta(expr):
+    """
+    ((lambda (params ...) bodies ...) args ...) evaluates the arguments and
+    then the bodies in a frame of the parameters, just like a let
+    """
+    function, args = expr[0], expr[1:]
+    params, is_variadic = parse_params(function[1])
+    if is_variadic or len(params) != len(args) or len(set(params)) != len(params):
+        return expr
+    return fold_let([LET, [[p, a] for (p, a) in zip(params, args)]] + function[2:])
+
+
+def has_define(exprs):
+    for expr in exprs:
+        if type(expr) != list or len(expr) == 0 or expr[0] == QUOTE:
+            continue
+        elif expr[0] == DEFINE or has_define(expr):
+            return True
+    return False
+
+
+def mentions(name, expr):
+    if type(expr) == list:
+        return any(mentions(name, e) for e in expr)
+    return expr == name
+
+
+def can_inline(name, exprs):
+    """
+    whether every use of name in exprs can be replaced by its value: name
+    is never assigned or defined, even in an inner scope, nor used inside a
+    quasiquote
+    """
+    if type(name) != str or name in RESERVED:
+        return False
+    for expr in exprs:
+        if type(expr) != list or len(expr) == 0 or expr[0] == QUOTE:
+            continue
+        first = expr[0]
+        if first == QUASIQUOTE and mentions(name, expr):
+            return False
+        elif first in [SET, DEFINE] and len(expr) >= 2:
+            target = expr[1]
+            if type(target) == list and len(target) >= 1:
+                target = target[0]
+            if target == name:
+                return False
+        if not can_inline(name, expr):
+            return False
+    return True
+
+
+def substitute(expr, name, value):
+    """
+    replaces the free uses of name in expr by value, see can_inline
+    """
+    if type(expr) == str:
+        return value if expr == name else expr
+    elif type(expr) != list or len(expr) == 0:
+        return expr
+    first = expr[0]
+    if first in [QUOTE, QUASIQUOTE]:
+        return expr
+    elif first == LAMBDA:
+        params, _ = parse_params(expr[1])
+        if name in params:
+            return expr
+        return [LAMBDA, expr[1]] + substitute_all(expr[2:], name, value)
+    elif first == DEFINE and type(expr[1]) == list:
+        if name in expr[1][1:] or [VARIADIC, name] in expr[1][1:]:
+            return expr
+        return [DEFINE, expr[1]] + substitute_all(expr[2:], name, value)
+    elif first == LET:
+        bindings = [[n, substitute(e, name, value)] for (n, e) in expr[1]]
+        if name in [n for (n, _) in expr[1]]:
+            return [LET, bindings] + expr[2:]
+        return [LET, bindings] + substitute_all(expr[2:], name, value)
+    elif first == LETSTAR:
+        bindings = []
+        is_shadowed = False
+        for n, e in expr[1]:
+            bindings.append([n, e if is_shadowed else substitute(e, name, value)])
+            is_shadowed = is_shadowed or n == name
+        if is_shadowed:
+            return [LETSTAR, bindings] + expr[2:]
+        return [LETSTAR, bindings] + substitute_all(expr[2:], name, value)
+    elif first in [FOR, FORLIST]:
+        bindings = [[v, substitute(lst, name, value)] for (v, lst) in expr[1]]
+        if name in [v for (v, _) in expr[1]]:
+            return [first, bindings] + expr[2:]
+        return [first, bindings] + substitute_all(expr[2:], name, value)
+    elif first == MATCH:
+        clauses = []
+        for clause in expr[2:]:
+            if name in pattern_variables(clause[0]):
+                clauses.append(clause)
+            else:
+                clauses.append([clause[0]] + substitute_all(clause[1:], name, value))
+        return [MATCH, substitute(expr[1], name, value)] + clauses
+    elif first == COND:
+        return [COND] + [[e if e == ELSE else substitute(e, name, value) for e in clause]
+                         for clause in expr[1:]]
+    elif type(first) == str and first in SPECIAL_FORMS:
+        return [first] + substitute_all(expr[1:], name, value)
+    return substitute_all(expr, name, value)
+
+
+def substitute_all(exprs, name, value):
+    return [substitute(e, name, value) for e in exprs]
+
+
+FOLDERS = {
+    QUOTE: fold_quote,
+    QUASIQUOTE: fold_quasiquote,
+    IF: fold_if,
+    COND: fold_cond,
+    CAR: fold_pair_access,
+    CDR: fold_pair_access,
+    LAMBDA: fold_lambda,
+    DEFINE: fold_define,
+    FOR: fold_for,
+    FORLIST: fold_for,
+    MATCH: fold_match,
+    LET: fold_let,
+    LETSTAR: fold_letstar,
+}
+
+
+if __name__ == "__main__":
+    programs = sys.argv[1:] or [
+        r'(let ((x 2) (y 3)) (if (lt? x y) (* x (+ y 1)) (car (cons 0 1))))']
+    for string in programs:
+        print("-" * 70)
+        expr, removed = fold_program(frontend(string))
+        print(expr_to_str(frontend(string)))
+        print(expr_to_str(expr))
+        print(f"{removed} nodes folded away")
@@ -0,0 +1,222 @@
+"""
+Profiles scheme programs on the tree walker
+
+profile_program(expr, ctx) evaluates a parsed program like eval_program,
+while counting the calls, time and allocations of each lambda, named by
+the define that bound it, and of each eval_* handler. Nothing is
+installed until then: the profiler swaps its counting versions in for
+the handlers, eval_expr and the __init__ of the allocated classes, and
+puts the originals back when the program ends, so that evaluation pays
+nothing when it is off.
+
+A handler's time ends when it returns, the expression it leaves in tail
+position is counted to the lambda it runs in. A tail call replaces the
+calling lambda on the profile stack, as it does on the engine's. Only the
+thread that started the program is profiled, futures are not.
+
+Run python3 profiler.py "(program)" to see the profile of a program.
+"""
+import sys
+import threading
+import time
+
+import eval as evaluator
+from eval import *
+
+
+# name of the frame at the bottom of every profile stack
+PROGRAM = "<program>"
+
+# handlers left unwrapped: the loop and dispatch every form goes through
+UNPROFILED = ["eval_expr", "eval_form", "eval_program"]
+
+# classes whose instances are counted as allocations
+ALLOCATED = [Cons, Frame, Lambda, Delay, TailCall]
+
+COLLAPSED_EXTENSION = ".folded"
+
+
+class Profiler():
+    """
+    stack of [name, start, child time, allocations, child allocations]
+    entries, and per name totals of
+    [calls, inclusive time, exclusive time, inclusive allocations,
+    exclusive allocations]. Inclusive totals count only the outermost of
+    recursive calls. collapsed maps each stack, joined by ;, to the time
+    spent in its top entry.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.stack = []
+        self.active = {}
+        self.stats = {}
+        self.collapsed = {}
+        # id of the first body form of a lambda to that form and its name
+        self.names = {}
+        self.thread = threading.get_ident()
+        self.saved = {}
+        self.evaluators = {}
+
+    def enter(self, name):
+        self.stack.append([name, time.perf_counter(), 0.0, 0, 0])
+        self.active[name] = self.active.get(name, 0) + 1
+
+    def leave(self):
+        name, start, child_time, allocs, child_allocs = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        self.active[name] -= 1
+        stats = self.stats.setdefault(name, [0, 0.0, 0.0, 0, 0])
+        stats[0] += 1
+        if self.active[name] == 0:
+            stats[1] += elapsed
+            stats[3] += allocs + child_allocs
+        stats[2] += elapsed - child_time
+        stats[4] += allocs
+        path = ";".join([entry[0] for entry in self.stack] + [name])
+        self.collapsed[path] = self.collapsed.get(path, 0.0) + elapsed - child_time
+        if self.stack != []:
+            parent = self.stack[-1]
+            parent[2] += elapsed
+            parent[4] += allocs + child_allocs
+
+    def name_lambda(self, _lambda, name):
+        # defines rename the lambdas they bind, other lambdas keep their params
+        first = _lambda.get_bodies()[0]
+        if name is None:
+            if id(first) in self.names:
+                return
+            name = f"(lambda ({' '.join(_lambda.get_args())}))"
+        self.names[id(first)] = (first, name)
+
+    def enter_body(self, expr, depth):
+        # lambda bodies run as [BEGIN] + bodies, see Lambda.get_body
+        if type(expr) != list or len(expr) < 2 or expr[0] != BEGIN:
+            return
+        named = self.names.get(id(expr[1]))
+        if named is None or named[0] is not expr[1]:
+            return
+        if len(self.stack) > depth:
+            # a tail call replaces the lambda that made it
+            self.leave()
+        self.enter(named[1])
+
+    def eval_expr(self, expr, ctx, in_quasi, budget=None):
+        if budget is not None or threading.get_ident() != self.thread:
+            return self.saved["eval_expr"](expr, ctx, in_quasi, budget)
+        depth = len(self.stack)
+        try:
+            self.enter_body(expr, depth)
+            value = eval_form(expr, ctx, in_quasi)
+            while type(value) == TailCall:
+                self.enter_body(value.expr, depth)
+                value = eval_form(value.expr, value.ctx, in_quasi)
+            return value
+        finally:
+            while len(self.stack) > depth:
+                self.leave()
+
+    def define_name(self, name, value, ctx):
+        if type(value) == Lambda and threading.get_ident() == self.thread:
+            self.name_lambda(value, name.get_name() if type(name) == LocalRef else name)
+        return self.saved["define_name"](name, value, ctx)
+
+    def wrap_handler(self, name, handler):
+        def profiled(*args):
+            if threading.get_ident() != self.thread:
+                return handler(*args)
+            self.enter(name)
+            try:
+                value = handler(*args)
+            finally:
+                self.leave()
+            if type(value) == Lambda:
+                self.name_lambda(value, None)
+            return value
+        return profiled
+
+    def wrap_init(self, init):
+        def counted(obj, *args, **kwargs):
+            if self.stack != [] and threading.get_ident() == self.thread:
+                self.stack[-1][3] += 1
+            init(obj, *args, **kwargs)
+        return counted
+
+    def install(self):
+        module = vars(evaluator)
+        for name, value in list(module.items()):
+            if name.startswith("eval_") and callable(value) and name not in UNPROFILED:
+                self.saved[name] = value
+                module[name] = self.wrap_handler(name, value)
+        for name in ["eval_expr", "define_name"]:
+            self.saved[name] = module[name]
+            module[name] = getattr(self, name)
+        for cls in ALLOCATED:
+            self.saved[cls] = cls.__init__
+            cls.__init__ = self.wrap_init(cls.__init__)
+        # eval_form calls the handlers through its table
+        self.evaluators = dict(EVALUATORS)
+        for symbol, handler in self.evaluators.items():
+            if handler.__name__ in self.saved:
+                EVALUATORS[symbol] = module[handler.__name__]
+
+    def uninstall(self):
+        module = vars(evaluator)
+        for key, value in self.saved.items():
+            if type(key) == str:
+                module[key] = value
+            else:
+                key.__init__ = value
+        EVALUATORS.update(self.evaluators)
+        self.saved = {}
+
+    def table(self):
+        """
+        one row per lambda and handler, by exclusive time
+        """
+        rows = sorted(self.stats.items(), key=lambda item: item[1][2], reverse=True)
+        lines = [f"{'name':<32}{'calls':>10}{'incl s':>10}{'excl s':>10}"
+                 f"{'incl alloc':>12}{'excl alloc':>12}"]
+        for name, (calls, inclusive, exclusive, alloc_inclusive, alloc_exclusive) in rows:
+            lines.append(f"{name[:31]:<32}{calls:>10}{inclusive:>10.4f}{exclusive:>10.4f}"
+                         f"{alloc_inclusive:>12}{alloc_exclusive:>12}")
+        return "\n".join(lines)
+
+    def write_collapsed(self, file_name):
+        """
+        writes one stack per line with its exclusive time in microseconds,
+        the collapsed format flamegraph tools read
+        """
+        fp = open(file_name, "w")
+        for path, elapsed in sorted(self.collapsed.items()):
+            micros = round(elapsed * 1e6)
+            if micros > 0:
+                fp.write(f"{path} {micros}\n")
+        fp.close()
+
+
+def profile_program(expr, ctx):
+    """
+    returns the value of the parsed program with the global context ctx,
+    as eval_program does, and the profiler that watched it run
+    """
+    profiler = Profiler()
+    profiler.install()
+    profiler.enter(PROGRAM)
+    try:
+        value = evaluator.eval_program(expr, ctx)
+    finally:
+        while profiler.stack != []:
+            profiler.leave()
+        profiler.uninstall()
+    return value, profiler
+
+
+if __name__ == "__main__":
+    programs = sys.argv[1:] or [
+        r'(begin (define (fib n) (if (lt? n 2) n (+ (fib (- n 1)) (fib (- n 2))))) (map (lambda (k) (fib k)) (list 5 10 15)))']
+    for string in programs:
+        print("-" * 70)
+        value, profiler = profile_program(frontend(string), {})
+        print(expr_to_str(value))
+        print(profiler.table())
@@ -1,27 +1,80 @@
-
-from eval import eval_expr, frontend, expr_to_str
+from eval import eval_program, compile_expr, run_machine, frontend, expr_to_str, fork_globals
+from vm import run_vm
+from fold import fold_program
+from profiler import profile_program, COLLAPSED_EXTENSION
+from cache import cached_frontend
+from server import serve
 
 
 import sys
 import os.path
 
 
-def file_evaluator(file_name):
+ENGINE_FLAG = "--engine="
+FOLD_FLAG = "--fold"
+PROFILE_FLAG = "--profile"
+NO_CACHE_FLAG = "--no-cache"
+SERVE_FLAG = "--serve"
+SOCKET_FLAG = "--socket="
+DEFAULT_ENGINE = "tree"
+
+
+def eval_tree(expr, context, budget=None):
+    return eval_program(expr, context, budget)
+
+
+def eval_closure(expr, context, budget=None):
+    return compile_expr(expr)(context, budget)
+
+
+ENGINES = {
+    "tree": eval_tree,
+    "closure": eval_closure,
+    "machine": run_machine,
+    "vm": run_vm,
+}
+
+
+def fold(expr):
+    expr, removed = fold_program(expr)
+    print(f"\tFolded Away {removed} Nodes", file=sys.stderr)
+    return expr
+
+
+def profile(expr, context, file_name):
+    _, profiler = profile_program(expr, context)
+    collapsed_name = os.path.splitext(file_name)[0] + COLLAPSED_EXTENSION
+    profiler.write_collapsed(collapsed_name)
+    print(profiler.table(), file=sys.stderr)
+    print(f"\tCollapsed Stacks Written to {collapsed_name}", file=sys.stderr)
+
+
+def file_evaluator(file_name, engine=DEFAULT_ENGINE, is_folded=False, is_profiled=False,
+                   is_cached=True):
     fp = open(file_name, "r")
     s = fp.read()
     fp.close()
 
     context = {}
     try:
-        eval_expr(frontend(s), context, False)
+        # the parsed program is cached next to the file, see cache.py
+        expr = cached_frontend(file_name, s) if is_cached else frontend(s)
+        if is_folded:
+            expr = fold(expr)
+        if is_profiled:
+            profile(expr, context, file_name)
+        else:
+            ENGINES[engine](expr, context)
     except:
         print("Error")
         exit(1)
     exit(0)
 
 
-def interpreter():
-    context = {}
+def interpreter(engine=DEFAULT_ENGINE, is_folded=False):
+    # reset-context goes back to the base, which snapshot-context replaces
+    base, base_macros = {}, {}
+    context, macros = fork_globals(base), {}
     try:
         while(True):
             expr_string = input("> ")
@@ -32,11 +85,19 @@ def interpreter():
             elif expr_string.lower() == "reset-context":
                 print("\tResetting Interpreter Context...")
                 print("\n")
-                context = {}
+                context, macros = fork_globals(base), dict(base_macros)
+                continue
+            elif expr_string.lower() == "snapshot-context":
+                print("\tSnapshotting Interpreter Context...")
+                print("\n")
+                base, base_macros = context, macros
+                context, macros = fork_globals(base), dict(base_macros)
                 continue
             try:
-                value = expr_to_str(
-                    eval_expr(frontend(expr_string), context, False))
+                expr = frontend(expr_string, macros)
+                if is_folded:
+                    expr = fold(expr)
+                value = expr_to_str(ENGINES[engine](expr, context))
                 print(value)
                 print("\n")
             except:
@@ -49,19 +110,56 @@ def interpreter():
 
 def main():
     args = sys.argv[1:]
+    engine = DEFAULT_ENGINE
+    socket_path = None
+    for arg in args:
+        if arg.startswith(ENGINE_FLAG):
+            engine = arg[len(ENGINE_FLAG):]
+        elif arg.startswith(SOCKET_FLAG):
+            socket_path = arg[len(SOCKET_FLAG):]
+    is_folded = FOLD_FLAG in args
+    is_profiled = PROFILE_FLAG in args
+    is_cached = NO_CACHE_FLAG not in args
+    is_serving = SERVE_FLAG in args
+    args = [arg for arg in args
+            if not arg.startswith(ENGINE_FLAG) and not arg.startswith(SOCKET_FLAG)
+            and arg not in [FOLD_FLAG, PROFILE_FLAG, NO_CACHE_FLAG, SERVE_FLAG]]
+    if engine not in ENGINES:
+        print(f"\tUnknown Engine {engine}, choose from: {', '.join(ENGINES)}")
+        exit(0)
+    elif is_profiled and engine != DEFAULT_ENGINE:
+        print(f"\tProfiling Runs on the {DEFAULT_ENGINE} Engine Only")
+        exit(0)
+    elif is_serving and engine != DEFAULT_ENGINE:
+        print(f"\tServing Runs on the {DEFAULT_ENGINE} Engine Only")
+        exit(0)
+
+    if is_serving:
+        # the file, if any, is the prelude every request starts from
+        if len(args) > 1:
+            print(f"\tToo Many Arguments: {args}")
+        elif args != [] and not os.path.exists(args[0]):
+            print(f"\tNo Path to File {args[0]}.")
+        else:
+            serve(args[0] if args != [] else None, socket_path)
+        exit(0)
+
     if args == []:
         print("\t----- Scheme Interpreter -----")
-        interpreter()
+        interpreter(engine, is_folded)
         exit(0)
     elif args[0] == "--help":
-        print("\tUsage: python3 scheme.py [file.scm]")
+        print(
+            f"\tUsage: python3 scheme.py [{ENGINE_FLAG}{'|'.join(ENGINES)}] [{FOLD_FLAG}] [{PROFILE_FLAG}] [{NO_CACHE_FLAG}] [file.scm]")
+        print(
+            f"\t       python3 scheme.py {SERVE_FLAG} [{SOCKET_FLAG}path] [prelude.scm]")
         exit(0)
     elif len(args) == 1:
         file_name = args[0]
         if not os.path.exists(file_name):
             print(f"\tNo Path to File {file_name}.")
             exit(0)
-        file_evaluator(file_name)
+        file_evaluator(file_name, engine, is_folded, is_profiled, is_cached)
         exit(0)
     else:
         print(f"\tToo Many Arguments: {args}")
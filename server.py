@@ -0,0 +1,266 @@
+"""
+Warm scheme server for batches of small programs
+
+serve(prelude_file, socket_path) evaluates the prelude file, if given, and
+then forks a pool of worker processes that start with its definitions and
+macros in place. It reads requests as JSON lines, one object per line:
+
+    {"id": 1, "code": "(+ 1 2)", "timeout": 2.5}
+
+from stdin, or from each connection to the Unix socket at socket_path, and
+writes one JSON line per request, to stdout or that connection:
+
+    {"id": 1, "value": "3", "output": ""}
+    {"id": 2, "error": "Unbound symbol: x.", "output": ""}
+
+output holds whatever the program printed. Replies come in the order the
+requests finish, not the order they came in. timeout, in seconds, defaults
+to SERVER_TIMEOUT and is charged as a Budget on the tree engine. A worker
+still busy SERVER_GRACE seconds past it, say in a long builtin, is killed
+and forked anew.
+
+Every request runs in a fork of the prelude's global context, made without
+copying it, so its own defines and set!s, and those of the prelude
+procedures it calls, are gone by the next request. A request that writes
+state the prelude made in place, a variable a prelude closure captured or
+a prelude hash table, is answered and then its worker is forked anew, so
+that no request ever sees another's writes.
+
+Run python3 scheme.py --serve [--socket=path] [prelude.scm] to serve.
+"""
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import sys
+import threading
+
+import eval as evaluator
+from eval import *
+
+
+SERVER_WORKERS = os.cpu_count() or 1
+SERVER_TIMEOUT = 10.0
+SERVER_GRACE = 1.0
+
+# workers copy the parent after the prelude is loaded
+FORK = multiprocessing.get_context("fork")
+
+
+def run_request(code, timeout, prelude_ctx, macros):
+    """
+    returns the reply to one request, without its id, and whether it wrote
+    state of the prelude
+    """
+    output = io.StringIO()
+    reply = {}
+    base_writes = []
+    try:
+        with contextlib.redirect_stdout(output):
+            expr = frontend(code, dict(macros))
+            ctx = fork_globals(prelude_ctx, base_writes)
+            value = eval_program(expr, ctx, Budget(seconds=timeout))
+            reply["value"] = expr_to_str(value)
+    except Exception as e:
+        reply["error"] = str(e) or type(e).__name__
+    reply["output"] = output.getvalue()
+    return reply, base_writes != []
+
+
+def worker_loop(connection, prelude_ctx, macros):
+    # the parent's pools and their threads are not copied by the fork
+    evaluator.FUTURE_POOL = None
+    evaluator.PMAP_POOL = None
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        code, timeout = request
+        connection.send(run_request(code, timeout, prelude_ctx, macros))
+
+
+class Worker():
+    """
+    worker process and the parent's end of the pipe to it
+    """
+
+    def __init__(self, prelude_ctx, macros):
+        super().__init__()
+        self.prelude_ctx = prelude_ctx
+        self.macros = macros
+        self.process = None
+        self.connection = None
+        self.start()
+
+    def start(self):
+        connection, child_connection = FORK.Pipe()
+        self.process = FORK.Process(
+            target=worker_loop, args=(child_connection, self.prelude_ctx, self.macros),
+            daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.connection = connection
+
+    def restart(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+        self.start()
+
+    def run(self, code, timeout):
+        try:
+            self.connection.send((code, timeout))
+            if self.connection.poll(timeout + SERVER_GRACE):
+                reply, is_dirty = self.connection.recv()
+                if is_dirty:
+                    # the next request must start from the prelude as loaded
+                    self.restart()
+                return reply
+        except (EOFError, OSError):
+            self.restart()
+            return {"error": "Worker exited.", "output": ""}
+        self.restart()
+        return {"error": f"Request timed out after {timeout} seconds.", "output": ""}
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join()
+        self.connection.close()
+
+
+class Server():
+    """
+    pool of workers, each with a thread of the parent that hands it jobs
+    from the shared queue and replies to them
+    """
+
+    def __init__(self, prelude_ctx, macros, workers=SERVER_WORKERS):
+        super().__init__()
+        self.jobs = queue.Queue()
+        self.workers = [Worker(prelude_ctx, macros) for _ in range(workers)]
+        self.threads = [threading.Thread(target=self.dispatch, args=(worker,), daemon=True)
+                        for worker in self.workers]
+        for thread in self.threads:
+            thread.start()
+
+    def dispatch(self, worker):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                worker.stop()
+                return
+            request_id, code, timeout, respond = job
+            reply = worker.run(code, timeout)
+            respond({"id": request_id, **reply})
+
+    def submit(self, line, respond):
+        """
+        queues the request on the JSON line, or replies to it at once if it
+        is malformed
+        """
+        try:
+            request = json.loads(line)
+            assert type(request) == dict
+        except (ValueError, AssertionError):
+            return respond({"id": None, "error": f"Malformed request: {line.strip()}."})
+        request_id = request.get("id")
+        code = request.get("code")
+        timeout = request.get("timeout", SERVER_TIMEOUT)
+        if type(code) != str:
+            return respond({"id": request_id, "error": "Request code must be a string."})
+        elif type(timeout) not in [int, float] or timeout <= 0:
+            return respond({"id": request_id, "error": "Request timeout must be a positive number."})
+        self.jobs.put((request_id, code, timeout, respond))
+
+    def stop(self):
+        # after every job queued so far
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+def responder(stream):
+    lock = threading.Lock()
+
+    def respond(reply):
+        line = json.dumps(reply) + "\n"
+        with lock:
+            try:
+                stream.write(line)
+                stream.flush()
+            except (OSError, ValueError):
+                # the client went away
+                pass
+    return respond
+
+
+def serve_lines(server, lines, respond):
+    for line in lines:
+        if line.strip() != "":
+            server.submit(line, respond)
+
+
+def serve_socket(server, socket_path):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen()
+    try:
+        while True:
+            connection, _ = listener.accept()
+            stream = connection.makefile("rw")
+            threading.Thread(target=serve_lines, args=(server, stream, responder(stream)),
+                             daemon=True).start()
+    finally:
+        listener.close()
+        os.remove(socket_path)
+
+
+def load_prelude(prelude_file):
+    """
+    returns the global context and macros of the prelude file
+    """
+    prelude_ctx = {}
+    macros = {}
+    if prelude_file is not None:
+        fp = open(prelude_file, "r")
+        string = fp.read()
+        fp.close()
+        # macros the prelude defines are kept for the requests
+        eval_program(frontend(string, macros), prelude_ctx)
+    return prelude_ctx, macros
+
+
+def serve(prelude_file=None, socket_path=None, workers=SERVER_WORKERS):
+    """
+    serves requests on stdin, or on the Unix socket at socket_path, until
+    stdin ends or the server is interrupted
+    """
+    prelude_ctx, macros = load_prelude(prelude_file)
+    server = Server(prelude_ctx, macros, workers)
+    try:
+        if socket_path is None:
+            serve_lines(server, sys.stdin, responder(sys.stdout))
+        else:
+            serve_socket(server, socket_path)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    serve(*sys.argv[1:2])
@@ -1,6 +1,17 @@
-from eval import expr_to_str, frontend, eval_expr
+import sys
+import threading
+
+from eval import Budget, ResourceExhausted, eval_async, eval_program, expr_to_str, fork_globals, frontend, \
+    import_past_ast
+from fold import fold_program
+from scheme import ENGINES, ENGINE_FLAG, DEFAULT_ENGINE
 
 if __name__ == "__main__":
+    # python3 test.py [--engine=closure] runs the tests on another engine
+    engine = DEFAULT_ENGINE
+    for arg in sys.argv[1:]:
+        if arg.startswith(ENGINE_FLAG):
+            engine = arg[len(ENGINE_FLAG):]
     tests = [r'(+ 1 (+ 3 4) (- 1 2))',
              r'1',
              r'#t',
@@ -40,6 +51,7 @@ if __name__ == "__main__":
              r'(map * (quote (1 2 3)) (quote (1 2 3)) (quote (1 2 3)))',
              r'(define-macro (when x y) (eq? x y))',
              r'(begin (define-macro (when x y) (eq? x y)) (when 3 4))',
+             r'(begin (define x 1) (define-macro (getx d) (+ x d)) (let ((x 5)) (getx 0)))',
              r'(neq? 1 2)',
              r'(neq? 0 0)',
              r'(lt? 0 0)',
@@ -53,6 +65,17 @@ if __name__ == "__main__":
              r'(delay (/ 1 0))',
              r'(force (delay (/ 2 1)))',
              r'(begin (define p (delay (/ 1 1))) (force p))',
+             r'(begin (define n 0) (define p (delay (begin (set! n (+ n 1)) n))) (force p) (list (force p) n))',
+             r'(begin (define (loop k) (if (eq? k 0) (make-promise 7) (delay-force (loop (- k 1))))) (force (loop 5000)))',
+             r'(stream->list (stream-take 5 (stream-map (lambda (x) (* x x)) (integers-from 1))))',
+             r'(begin (define (ints k) (cons-stream k (ints (+ k 1)))) (stream->list (stream-take 3 (stream-filter (lambda (x) (gt? x 10)) (ints 0)))))',
+             r'(begin (define-memo (fib n) #:max-size 50 (if (lt? n 2) n (+ (fib (- n 1)) (fib (- n 2))))) (list (fib 60) (memo-stats fib)))',
+             r'(begin (define x 1) (define f (future (begin (define x 2) (* x 10)))) (list (touch f) x (future-all (list (future (+ x 1)) f))))',
+             r'(begin (define h (make-hash)) (hash-set! h (list 1 2) 3) (hash-set! h "k" 4) (hash-remove! h "k") (define i (hash-set (hash 1 2) 3 4)) (list h (hash-ref h (list 1 2)) (hash-ref h 5 0) (hash-count i) (hash-ref i 3)))',
+             r'(begin (define v (list->vector (list 1 2 3))) (list v (vector-ref v 2) (vector-sum (vector* v (make-vector 3 2))) (vector-dot v v) (vector->list (vector-map lt? v (make-vector 3 2))) (map + v v)))',
+             r'(begin (define bv (list->vector (list #t #t))) (map + bv bv))',
+             r'(begin (define (square x) (* x x)) (define h (make-hash)) (define (look x) (hash-ref h x 0)) (list (pmap square (list 1 2 3 4) #:chunk-size 1) (pmap look (list 1 2)) (hash-set! h 1 5) (pmap look (list 1 2))))',
+             r'(begin (define c (make-channel)) (channel-put! c 1) (channel-put! c (list 2 3)) (list (channel-get c) c (channel-get c) (sleep 0)))',
              r'(begin (define (decr count) (if (eq? count 0) (println "Done") (begin (println count) (decr (- count 1))) )) (decr 3))',
              r'(cons-stream 2 3)',
              r'(cdr-stream (cons-stream 2 3))',
@@ -102,9 +125,73 @@ if __name__ == "__main__":
              r"(+ `3 '3)",
              r"`(+ 3 @(list 3 (+ 2 3)))",
              r"'(+ 3 @(list 3 (+ 2 3)))",
-             r"`(+ 3 @(list 3 '(+ 2 3)))"]
+             r"`(+ 3 @(list 3 '(+ 2 3)))",
+             r'(begin (define (fib n) (if (lt? n 2) n (+ (fib (- n 1)) (fib (- n 2))))) (fib 10))',
+             r'(begin (define (make-adder n) (lambda (x) (+ x n))) (list ((make-adder 1) 2) ((make-adder 5) 2)))',
+             r'(begin (define y 10) (let ((y 4)) (set! y 7)) y)',
+             r'(begin (define (f n) (define sq (* n n)) (+ sq 1)) (f 4))',
+             r'(map (lambda (x) (* x x)) (list 1 2 3))',
+             r'(begin (define (decr count) (if (eq? count 0) (quote done) (decr (- count 1)))) (decr 10000))',
+             r'(begin (define (even? n) (cond ((eq? n 0) #t) (else (let ((m (- n 1))) (odd? m))))) (define (odd? n) (match n (0 #f) (k (even? (- k 1))))) (even? 10000))']
     for string in tests:
         context = {}
         print("-------------------")
         print(expr_to_str(frontend(string)))
-        print(expr_to_str(eval_expr(frontend(string), context, False)))
+        print(expr_to_str(ENGINES[engine](frontend(string), context)))
+
+    # entry points that take more than a program
+    print("-------------------")
+    budget = Budget(max_steps=10000)
+    try:
+        eval_program(frontend(r'(begin (define (loop) (loop)) (loop))'), {}, budget)
+    except ResourceExhausted as e:
+        print(e)
+    assert budget.get_steps() >= 10000
+    # a budget is only charged by the evaluation it was given to, not by
+    # one running on another thread meanwhile
+    replies = {}
+
+    def run_thread(name, string, budget):
+        try:
+            replies[name] = expr_to_str(ENGINES[engine](frontend(string), {}, budget))
+        except ResourceExhausted as e:
+            replies[name] = str(e)
+    threads = [threading.Thread(target=run_thread, args=(
+                   "limited", r'(begin (define (loop) (loop)) (loop))', Budget(max_steps=20000))),
+               threading.Thread(target=run_thread, args=(
+                   "free", r'(begin (define (count n) (if (eq? n 0) (quote done) (count (- n 1)))) (count 50000))', None))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(replies["limited"], replies["free"])
+    assert replies["free"] == "done"
+    # procedures of a base context run in a fork read and write the fork
+    base = {}
+    ENGINES[engine](frontend(r'(begin (define counter 0) (define (bump) (set! counter (+ counter 1)) counter) (define limit 5) (define (get-limit) limit))'), base)
+    bumps = [expr_to_str(ENGINES[engine](frontend(r'(bump)'), fork_globals(base))) for _ in range(3)]
+    limit = expr_to_str(ENGINES[engine](frontend(r'(begin (define limit 99) (get-limit))'), fork_globals(base)))
+    print(bumps, limit, base["counter"])
+    assert bumps == ["1", "1", "1"] and limit == "99" and base["counter"] == 0
+    # but the variables its closures captured, and its hash tables, are the
+    # base's own, which a fork may not write
+    ENGINES[engine](frontend(r'(begin (define next-id (let ((n 0)) (lambda () (begin (set! n (+ n 1)) n)))) (define h (make-hash)))'), base)
+    for string in [r'(next-id)', r'(hash-set! h 1 2)']:
+        try:
+            ENGINES[engine](frontend(string), fork_globals(base))
+            assert False, string
+        except RuntimeError as e:
+            print(e)
+    ids = expr_to_str(ENGINES[engine](frontend(r'(list (next-id) (next-id) h)'), base))
+    print(ids)
+    assert ids == "(1 2 #hash())"
+    # a task waits on a channel while another sleeps and fills it
+    asyncio = import_past_ast("asyncio")
+    program = frontend(r'(let ((c (make-channel))) (begin (spawn (lambda () (begin (sleep 10) (channel-put! c 42)))) (list (channel-get c) (touch (spawn (lambda () (* 6 7)))))))')
+    print(expr_to_str(asyncio.run(eval_async(program, {}))))
+    # folding leaves the value of a program as it was
+    program = frontend(r'(let ((x 2)) (if (lt? x 3) (* x (+ 4 6)) (/ 1 0)))')
+    folded, removed = fold_program(program)
+    print(expr_to_str(folded), removed)
+    assert removed > 0
+    assert expr_to_str(ENGINES[engine](folded, {})) == expr_to_str(ENGINES[engine](program, {}))
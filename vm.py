@@ -0,0 +1,801 @@
+"""
+Compiles resolved scheme programs to bytecode and runs them on a stack VM
+
+A CodeObject is a flat list of opcodes, each followed inline by its
+operands, plus a constant pool. Lambda bodies are compiled once into their
+own CodeObjects, which are constants of the enclosing code. The VM keeps
+an operand stack shared by all calls and a stack of return records, calls
+in tail position reuse the caller's record.
+
+Run python3 vm.py "(program)" to see the disassembly and value of a program.
+"""
+import sys
+
+from eval import *
+
+
+(CONST, LOCAL0, LOCAL1, LOCAL, GLOBAL, STORE_LOCAL, SET_LOCAL, SET_GLOBAL,
+ DEFINE_LOCAL, DEFINE_GLOBAL, POP, JUMP, JUMP_IF_FALSE, JUMP_IF_NOT_TRUE,
+ OP_ADD, OP_SUB, OP_MUL, OP_DIV, OP_EXP, OP_CONCAT, OP_EQ, OP_NEQ, OP_LT,
+ OP_GT, OP_LTE, OP_GTE, OP_NOT, OP_AND, OP_OR, OP_LIST, OP_CONS, OP_CAR,
+ OP_CDR, OP_APPEND, OP_PRINTLN, MAKE_CLOSURE, MAKE_DELAY, MAKE_STREAM,
+ OP_FORCE, OP_CDR_STREAM, CALL, TAIL_CALL, OP_APPLY, TAIL_APPLY, OP_MAP,
+ OP_FOR, QUASI_LIST, PUSH_FRAME, PUSH_EMPTY_FRAME, POP_FRAME, MATCH_DISPATCH,
+ RETURN, MAKE_FUTURE) = range(53)
+
+# name and number of inline operands of each opcode
+OPCODES = {
+    CONST: ("CONST", 1),
+    LOCAL0: ("LOCAL0", 1),
+    LOCAL1: ("LOCAL1", 1),
+    LOCAL: ("LOCAL", 2),
+    GLOBAL: ("GLOBAL", 1),
+    STORE_LOCAL: ("STORE_LOCAL", 1),
+    SET_LOCAL: ("SET_LOCAL", 2),
+    SET_GLOBAL: ("SET_GLOBAL", 1),
+    DEFINE_LOCAL: ("DEFINE_LOCAL", 2),
+    DEFINE_GLOBAL: ("DEFINE_GLOBAL", 1),
+    POP: ("POP", 0),
+    JUMP: ("JUMP", 1),
+    JUMP_IF_FALSE: ("JUMP_IF_FALSE", 1),
+    JUMP_IF_NOT_TRUE: ("JUMP_IF_NOT_TRUE", 1),
+    OP_ADD: ("ADD", 1),
+    OP_SUB: ("SUB", 1),
+    OP_MUL: ("MUL", 1),
+    OP_DIV: ("DIV", 0),
+    OP_EXP: ("EXP", 0),
+    OP_CONCAT: ("CONCAT", 0),
+    OP_EQ: ("EQ", 0),
+    OP_NEQ: ("NEQ", 0),
+    OP_LT: ("LT", 0),
+    OP_GT: ("GT", 0),
+    OP_LTE: ("LTE", 0),
+    OP_GTE: ("GTE", 0),
+    OP_NOT: ("NOT", 0),
+    OP_AND: ("AND", 1),
+    OP_OR: ("OR", 1),
+    OP_LIST: ("LIST", 1),
+    OP_CONS: ("CONS", 0),
+    OP_CAR: ("CAR", 0),
+    OP_CDR: ("CDR", 0),
+    OP_APPEND: ("APPEND", 1),
+    OP_PRINTLN: ("PRINTLN", 1),
+    MAKE_CLOSURE: ("MAKE_CLOSURE", 1),
+    MAKE_DELAY: ("MAKE_DELAY", 2),
+    MAKE_STREAM: ("MAKE_STREAM", 1),
+    OP_FORCE: ("FORCE", 0),
+    OP_CDR_STREAM: ("CDR_STREAM", 0),
+    CALL: ("CALL", 1),
+    TAIL_CALL: ("TAIL_CALL", 1),
+    OP_APPLY: ("APPLY", 1),
+    TAIL_APPLY: ("TAIL_APPLY", 1),
+    OP_MAP: ("MAP", 1),
+    OP_FOR: ("FOR", 2),
+    QUASI_LIST: ("QUASI_LIST", 3),
+    PUSH_FRAME: ("PUSH_FRAME", 1),
+    PUSH_EMPTY_FRAME: ("PUSH_EMPTY_FRAME", 1),
+    POP_FRAME: ("POP_FRAME", 0),
+    MATCH_DISPATCH: ("MATCH_DISPATCH", 2),
+    RETURN: ("RETURN", 0),
+    MAKE_FUTURE: ("MAKE_FUTURE", 1),
+}
+
+# operators with a fixed number of operands
+BINARY_OPCODES = {
+    DIV: OP_DIV,
+    EXP: OP_EXP,
+    CONCAT: OP_CONCAT,
+    EQ: OP_EQ,
+    NEQ: OP_NEQ,
+    LT: OP_LT,
+    GT: OP_GT,
+    LTE: OP_LTE,
+    GTE: OP_GTE,
+    CONS: OP_CONS,
+}
+UNARY_OPCODES = {
+    NOT: OP_NOT,
+    CAR: OP_CAR,
+    CDR: OP_CDR,
+    FORCE: OP_FORCE,
+    CDR_STREAM: OP_CDR_STREAM,
+}
+# operators taking any number of operands, the count is the operand, with
+# the least number of operands the tree walker accepts
+VARIADIC_OPCODES = {
+    ADD: (OP_ADD, 2),
+    SUB: (OP_SUB, 2),
+    MUL: (OP_MUL, 2),
+    AND: (OP_AND, 1),
+    OR: (OP_OR, 1),
+    LIST: (OP_LIST, 0),
+    APPEND: (OP_APPEND, 2),
+    PRINTLN: (OP_PRINTLN, 1),
+}
+
+
+class CodeObject():
+    def __init__(self, name, code, constants):
+        super().__init__()
+        self.name = name
+        self.code = code
+        self.constants = constants
+
+    def get_name(self):
+        return self.name
+
+    def get_code(self):
+        return self.code
+
+    def get_constants(self):
+        return self.constants
+
+
+class Procedure():
+    """
+    compile time description of a lambda, its constant for MAKE_CLOSURE
+    """
+
+    def __init__(self, params, bodies, is_variadic, code):
+        super().__init__()
+        self.params = params
+        self.bodies = bodies
+        self.is_variadic = is_variadic
+        self.code = code
+
+
+class BytecodeCompiler():
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+        self.code = []
+        self.constants = []
+        self.constant_slots = {}
+
+    def emit(self, opcode, *operands):
+        self.code.append(opcode)
+        self.code += operands
+        return len(self.code) - 1
+
+    def label(self):
+        return len(self.code)
+
+    def patch(self, operand_position, target):
+        self.code[operand_position] = target
+
+    def constant(self, value):
+        # atoms are shared in the pool, anything else gets its own entry
+        key = None
+        if type(value) in [int, bool, str]:
+            key = (type(value), value)
+        if key is not None and key in self.constant_slots:
+            return self.constant_slots[key]
+        self.constants.append(value)
+        if key is not None:
+            self.constant_slots[key] = len(self.constants) - 1
+        return len(self.constants) - 1
+
+    def finish(self):
+        self.emit(RETURN)
+        return CodeObject(self.name, self.code, self.constants)
+
+    def compile(self, expr, tail):
+        if type(expr) in [int, bool, String, Keyword]:
+            self.emit(CONST, self.constant(expr))
+        elif type(expr) == LocalRef:
+            depth, slot = expr.get_depth(), expr.get_slot()
+            if depth == 0:
+                self.emit(LOCAL0, slot)
+            elif depth == 1:
+                self.emit(LOCAL1, slot)
+            else:
+                self.emit(LOCAL, depth, slot)
+        elif expr == NIL:
+            self.emit(OP_LIST, 0)
+        elif type(expr) == str:
+            self.emit(GLOBAL, self.constant(expr))
+        elif type(expr) == GlobalRef:
+            self.emit(GLOBAL, self.constant(expr.get_name()))
+        else:
+            assert type(expr) == list
+            assert len(expr) >= 1
+            first = expr[0]
+            if type(first) == str and first in SPECIAL_FORMS:
+                self.compile_special(expr, tail)
+            else:
+                self.compile_call(CALL, TAIL_CALL, expr, tail)
+
+    def compile_all(self, exprs):
+        for e in exprs:
+            self.compile(e, False)
+
+    def compile_call(self, opcode, tail_opcode, exprs, tail):
+        self.compile_all(exprs)
+        self.emit(tail_opcode if tail else opcode, len(exprs) - 1)
+
+    def compile_body(self, bodies, tail):
+        for body in bodies[:-1]:
+            self.compile(body, False)
+            self.emit(POP)
+        self.compile(bodies[-1], tail)
+
+    def compile_special(self, expr, tail):
+        first = expr[0]
+        operands = expr[1:]
+        if first in BINARY_OPCODES:
+            assert len(operands) == 2
+            self.compile_all(operands)
+            self.emit(BINARY_OPCODES[first])
+        elif first in UNARY_OPCODES:
+            assert len(operands) == 1
+            self.compile_all(operands)
+            self.emit(UNARY_OPCODES[first])
+        elif first in VARIADIC_OPCODES:
+            opcode, least = VARIADIC_OPCODES[first]
+            assert len(operands) >= least
+            self.compile_all(operands)
+            self.emit(opcode, len(operands))
+        elif first == QUOTE:
+            assert len(expr) == 2
+            self.emit(CONST, self.constant(expr[1]))
+        elif first == QUASIQUOTE:
+            assert len(expr) == 2
+            self.compile_quasi(expr[1])
+        elif first in [UNQUOTE, UNQUOTE_SPLICING]:
+            raise RuntimeError(
+                f"{first} must be located within quasiquote: {expr}.")
+        elif first == IF:
+            assert len(expr) >= 4
+            self.compile(expr[1], False)
+            to_else = self.emit(JUMP_IF_FALSE, None)
+            self.compile(expr[2], tail)
+            to_end = self.emit(JUMP, None)
+            self.patch(to_else, self.label())
+            self.compile(expr[3], tail)
+            self.patch(to_end, self.label())
+        elif first == BEGIN:
+            assert len(expr) >= 2
+            self.compile_body(operands, tail)
+        elif first == LET:
+            assert len(expr) >= 3
+            self.compile_all([e for (_, e) in expr[1]])
+            self.emit(PUSH_FRAME, len(expr[1]))
+            self.compile_framed_body(expr[2:], tail)
+        elif first == LETSTAR:
+            assert len(expr) >= 3
+            self.emit(PUSH_EMPTY_FRAME, len(expr[1]))
+            for slot, (_, e) in enumerate(expr[1]):
+                self.compile(e, False)
+                self.emit(STORE_LOCAL, slot)
+            self.compile_framed_body(expr[2:], tail)
+        elif first == DEFINE:
+            assert len(expr) >= 3
+            names = expr[1]
+            if type(names) == list and len(names) >= 1:
+                target = names[0]
+                self.compile_lambda(target, names[1:], expr[2:])
+            else:
+                assert expr[3:] == []
+                target = names
+                self.compile(expr[2], False)
+            self.compile_define(target)
+        elif first == LAMBDA:
+            assert len(expr) >= 3
+            self.compile_lambda(LAMBDA, expr[1], expr[2:])
+        elif first == SET:
+            assert len(expr) == 3
+            var = expr[1]
+            self.compile(expr[2], False)
+            if type(var) == LocalRef:
+                self.emit(SET_LOCAL, var.get_depth(), var.get_slot())
+            else:
+                assert type(var) == str
+                self.emit(SET_GLOBAL, self.constant(var))
+        elif first == COND:
+            self.compile_cond(expr, tail)
+        elif first in [FOR, FORLIST]:
+            assert len(expr) >= 3
+            self.compile_all([lst for (_, lst) in expr[1]])
+            body = self.compile_code(FOR, expr[2:])
+            self.emit(OP_FOR, self.constant(body),
+                      self.constant(first == FORLIST))
+            self.code.append(len(expr[1]))
+        elif first in [DELAY, DELAY_FORCE]:
+            assert len(expr) == 2
+            self.emit(MAKE_DELAY, self.constant(expr[1]),
+                      self.constant(first == DELAY_FORCE))
+        elif first == FUTURE:
+            assert len(expr) == 2
+            body = self.compile_code(FUTURE, [expr[1]])
+            self.emit(MAKE_FUTURE, self.constant(body))
+        elif first == CONS_STREAM:
+            assert len(expr) == 3
+            self.compile(expr[1], False)
+            self.emit(MAKE_STREAM, self.constant(expr[2]))
+        elif first == APPLY:
+            assert len(expr) >= 3
+            self.compile_call(OP_APPLY, TAIL_APPLY, operands, tail)
+        elif first == MAP:
+            assert len(expr) >= 3
+            self.compile_all(operands)
+            self.emit(OP_MAP, len(operands) - 1)
+        elif first == MATCH:
+            self.compile_match(expr, tail)
+        else:
+            raise RuntimeError(f"Expression could not be compiled: {expr}.")
+
+    def compile_framed_body(self, bodies, tail):
+        self.compile_body(bodies, tail)
+        if not tail:
+            self.emit(POP_FRAME)
+
+    def compile_code(self, name, bodies):
+        compiler = BytecodeCompiler(name)
+        compiler.compile_body(bodies, True)
+        return compiler.finish()
+
+    def compile_lambda(self, name, params, bodies):
+        final_params, is_variadic = parse_params(params)
+        if type(name) == LocalRef:
+            name = name.get_name()
+        code = self.compile_code(name, bodies)
+        procedure = Procedure(final_params, bodies, is_variadic, code)
+        self.emit(MAKE_CLOSURE, self.constant(procedure))
+
+    def compile_define(self, target):
+        if type(target) == LocalRef:
+            self.emit(DEFINE_LOCAL, target.get_slot(),
+                      self.constant(target.get_name()))
+        else:
+            assert type(target) == str
+            self.emit(DEFINE_GLOBAL, self.constant(target))
+
+    def compile_cond(self, expr, tail):
+        assert len(expr) >= 2
+        clauses = expr[1:]
+        to_ends = []
+        for i, clause in enumerate(clauses):
+            assert type(clause) == list
+            assert len(clause) == 2
+            test, e = clause
+            if test == ELSE:
+                if i != len(clauses) - 1:
+                    raise RuntimeError(
+                        f"Else must be last condition in cond: {expr}.")
+                self.compile(e, tail)
+                break
+            self.compile(test, False)
+            # unlike if, cond requires its tests to be bools
+            to_next = self.emit(JUMP_IF_NOT_TRUE, None)
+            self.compile(e, tail)
+            to_ends.append(self.emit(JUMP, None))
+            self.patch(to_next, self.label())
+        else:
+            # undefined return on no matching conditions
+            self.emit(CONST, self.constant(0))
+        for to_end in to_ends:
+            self.patch(to_end, self.label())
+
+    def compile_match(self, expr, tail):
+        assert len(expr) == 3
+        self.compile(expr[1], False)
+        tree = expr[2].get_tree()
+        targets = self.constant(None)
+        self.emit(MATCH_DISPATCH, self.constant(tree), targets)
+        # no match , return any value, say 0
+        self.emit(CONST, self.constant(0))
+        to_ends = [self.emit(JUMP, None)]
+        labels = []
+        for clause in expr[2].get_clauses():
+            labels.append(self.label())
+            self.compile_framed_body(clause[1:], tail)
+            to_ends.append(self.emit(JUMP, None))
+        self.constants[targets] = tuple(labels)
+        for to_end in to_ends:
+            self.patch(to_end, self.label())
+
+    def compile_quasi(self, node):
+        kind = node[0]
+        if kind == QUOTED:
+            self.emit(CONST, self.constant(node[1]))
+        elif kind == HOLE:
+            self.compile(node[1], False)
+        elif kind == BAD_SPLICE:
+            raise RuntimeError(
+                f"Inner Form in Unquote-Splicing must be a list form: {node[1]}.")
+        else:
+            spliced = []
+            for item in node[1]:
+                if item[0] == SPLICE:
+                    self.compile(item[1], False)
+                else:
+                    self.compile_quasi(item)
+                spliced.append(item[0] == SPLICE)
+            self.emit(QUASI_LIST, len(spliced), self.constant(tuple(spliced)),
+                      self.constant(node[2]))
+
+
+def compile_program(expr):
+    """
+    compiles a parsed program to the CodeObject run by run_code
+    """
+    compiler = BytecodeCompiler("program")
+    compiler.compile(resolve(expr), True)
+    return compiler.finish()
+
+
+def lambda_code(_lambda):
+    # lambdas made by other engines are compiled on their first call
+    if _lambda.bytecode is None:
+        _lambda.bytecode = BytecodeCompiler(LAMBDA).compile_code(
+            LAMBDA, _lambda.get_bodies())
+    return _lambda.bytecode
+
+
+def make_closure(procedure, env):
+    _lambda = Lambda(procedure.params, procedure.bodies,
+                     procedure.is_variadic, env)
+    _lambda.bytecode = procedure.code
+    return _lambda
+
+
+def make_future(code_object, env):
+    # the future runs on its own VM loop, in a child frame of env
+    child = child_frame(env)
+    return future_of(child.globals, run_code, code_object, child)
+
+
+def call_value(procedure, args):
+    """
+    calls a procedure from python, as map and for do, on a nested VM loop
+    """
+    if type(procedure) == Lambda:
+        return run_code(lambda_code(procedure), bind_args(procedure, args))
+    return apply_procedure(procedure, args)
+
+
+def run_vm(expr, ctx, budget=None):
+    """
+    compiles a parsed program to bytecode and runs it with the global
+    context ctx, giving the same value as eval_program(expr, ctx, budget).
+    The budget is charged a step for each procedure call.
+    """
+    if budget is not None:
+        budget.start()
+    return in_budget(budget, in_globals, ctx, run_code, compile_program(expr), global_frame(ctx))
+
+
+def run_code(code_object, env):
+    code = code_object.code
+    constants = code_object.constants
+    budget = BUDGET.get()
+    if budget is not None:
+        budget.charge()
+    pc = 0
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    # return records of the callers: code object, pc and frame
+    calls = []
+    while True:
+        op = code[pc]
+        if op == LOCAL0:
+            push(env.slots[code[pc + 1]])
+            pc += 2
+        elif op == CONST:
+            push(constants[code[pc + 1]])
+            pc += 2
+        elif op == LOCAL1:
+            push(env.parent.slots[code[pc + 1]])
+            pc += 2
+        elif op == GLOBAL:
+            push(lookup_global(constants[code[pc + 1]], env))
+            pc += 2
+        elif op == JUMP_IF_FALSE:
+            # require to be explicitly true
+            if pop() == True:
+                pc += 2
+            else:
+                pc = code[pc + 1]
+        elif op == JUMP_IF_NOT_TRUE:
+            b = pop()
+            assert type(b) == bool
+            if b:
+                pc += 2
+            else:
+                pc = code[pc + 1]
+        elif op == JUMP:
+            pc = code[pc + 1]
+        elif op == OP_EQ:
+            second = pop()
+            stack[-1] = stack[-1] == second
+            pc += 1
+        elif op == OP_SUB:
+            n = code[pc + 1]
+            if n == 2:
+                second = pop()
+                stack[-1] = stack[-1] - second
+            else:
+                vals = stack[-n:]
+                del stack[-n:]
+                push(BUILTINS[SUB].get_function()(*vals))
+            pc += 2
+        elif op == OP_ADD:
+            n = code[pc + 1]
+            if n == 2:
+                second = pop()
+                stack[-1] = stack[-1] + second
+            else:
+                vals = stack[-n:]
+                del stack[-n:]
+                push(sum(vals))
+            pc += 2
+        elif op == CALL or op == TAIL_CALL or op == OP_APPLY or op == TAIL_APPLY:
+            n = code[pc + 1]
+            args = stack[-n:] if n > 0 else []
+            del stack[len(stack) - n:]
+            procedure = pop()
+            if op == OP_APPLY or op == TAIL_APPLY:
+                # last arg must be a list
+                args = args[:-1] + list_values(args[-1])
+            if type(procedure) != Lambda:
+                push(apply_procedure(procedure, args))
+                pc += 2
+                continue
+            if op == CALL or op == OP_APPLY:
+                calls.append((code_object, pc + 2, env))
+            if budget is not None:
+                budget.charge()
+            env = bind_args(procedure, args)
+            code_object = lambda_code(procedure)
+            code = code_object.code
+            constants = code_object.constants
+            pc = 0
+        elif op == RETURN:
+            if calls == []:
+                return pop()
+            code_object, pc, env = calls.pop()
+            code = code_object.code
+            constants = code_object.constants
+        elif op == POP:
+            pop()
+            pc += 1
+        elif op == LOCAL:
+            push(env.lookup(code[pc + 1], code[pc + 2]))
+            pc += 3
+        elif op == OP_LT:
+            second = pop()
+            stack[-1] = stack[-1] < second
+            pc += 1
+        elif op == OP_GT:
+            second = pop()
+            stack[-1] = stack[-1] > second
+            pc += 1
+        elif op == OP_LTE:
+            second = pop()
+            stack[-1] = stack[-1] <= second
+            pc += 1
+        elif op == OP_GTE:
+            second = pop()
+            stack[-1] = stack[-1] >= second
+            pc += 1
+        elif op == OP_NEQ:
+            second = pop()
+            stack[-1] = stack[-1] != second
+            pc += 1
+        elif op == OP_MUL:
+            n = code[pc + 1]
+            vals = stack[-n:]
+            del stack[-n:]
+            push(BUILTINS[MUL].get_function()(*vals))
+            pc += 2
+        elif op == OP_DIV:
+            second = pop()
+            stack[-1] = int(stack[-1] / second)
+            pc += 1
+        elif op == OP_EXP:
+            second = pop()
+            stack[-1] = stack[-1] ** second
+            pc += 1
+        elif op == OP_CONCAT:
+            second = pop()
+            assert type(second) == String and type(stack[-1]) == String
+            stack[-1] = stack[-1] + second
+            pc += 1
+        elif op == OP_NOT:
+            assert type(stack[-1]) == bool
+            stack[-1] = not stack[-1]
+            pc += 1
+        elif op == OP_AND or op == OP_OR:
+            n = code[pc + 1]
+            vals = stack[-n:]
+            del stack[-n:]
+            for b in vals:
+                assert type(b) == bool
+            push(all(vals) if op == OP_AND else any(vals))
+            pc += 2
+        elif op == OP_LIST:
+            n = code[pc + 1]
+            vals = stack[-n:] if n > 0 else []
+            del stack[len(stack) - n:]
+            push(make_list(vals))
+            pc += 2
+        elif op == OP_CONS:
+            second = pop()
+            stack[-1] = Cons(stack[-1], second)
+            pc += 1
+        elif op == OP_CAR:
+            stack[-1] = cons_left(stack[-1])
+            pc += 1
+        elif op == OP_CDR:
+            stack[-1] = cons_right(stack[-1])
+            pc += 1
+        elif op == OP_APPEND:
+            n = code[pc + 1]
+            vals = stack[-n:]
+            del stack[-n:]
+            push(append_lists(*vals))
+            pc += 2
+        elif op == OP_PRINTLN:
+            n = code[pc + 1]
+            vals = stack[-n:]
+            del stack[-n:]
+            push(print_values(*vals))
+            pc += 2
+        elif op == STORE_LOCAL:
+            env.slots[code[pc + 1]] = pop()
+            pc += 2
+        elif op == SET_LOCAL:
+            env.assign(code[pc + 1], code[pc + 2], pop())
+            push(0)
+            pc += 3
+        elif op == SET_GLOBAL:
+            set_global(env.globals, constants[code[pc + 1]], pop())
+            push(0)
+            pc += 2
+        elif op == DEFINE_LOCAL:
+            env.define(code[pc + 1], pop())
+            push(constants[code[pc + 2]])
+            pc += 3
+        elif op == DEFINE_GLOBAL:
+            name = constants[code[pc + 1]]
+            set_global(env.globals, name, pop())
+            push(name)
+            pc += 2
+        elif op == MAKE_CLOSURE:
+            push(make_closure(constants[code[pc + 1]], env))
+            pc += 2
+        elif op == MAKE_DELAY:
+            push(Delay(constants[code[pc + 1]], env, constants[code[pc + 2]]))
+            pc += 3
+        elif op == MAKE_FUTURE:
+            push(make_future(constants[code[pc + 1]], env))
+            pc += 2
+        elif op == MAKE_STREAM:
+            stack[-1] = Cons(stack[-1], Delay(constants[code[pc + 1]], env))
+            pc += 2
+        elif op == OP_FORCE:
+            stack[-1] = force_delay(stack[-1])
+            pc += 1
+        elif op == OP_CDR_STREAM:
+            stack[-1] = force_delay(cons_right(stack[-1]))
+            pc += 1
+        elif op == OP_MAP:
+            n = code[pc + 1]
+            lists = stack[-n:]
+            del stack[-n:]
+            procedure = pop()
+            # last arg must be a list
+            assert len(lists) > 0
+            if type(lists[0]) == Vector:
+                push(vector_map(procedure, *lists))
+            else:
+                lists = [list_values(lst) for lst in lists]
+                for lst in lists:
+                    assert len(lst) == len(lists[0])
+                push(make_list([call_value(procedure, list(row)) for row in zip(*lists)]))
+            pc += 2
+        elif op == OP_FOR:
+            body = constants[code[pc + 1]]
+            is_forlist = constants[code[pc + 2]]
+            n = code[pc + 3]
+            lists = stack[-n:] if n > 0 else []
+            del stack[len(stack) - n:]
+            final_list = []
+            for row in zip(*map(list_values, lists)):
+                # fresh frame for each iteration, one slot per variable
+                final_list.append(run_code(body, Frame(list(row), env)))
+            # for does not return list
+            push(make_list(final_list) if is_forlist else 0)
+            pc += 4
+        elif op == QUASI_LIST:
+            n = code[pc + 1]
+            spliced = constants[code[pc + 2]]
+            vals = stack[-n:]
+            del stack[-n:]
+            lst = []
+            for is_splice, val in zip(spliced, vals):
+                if is_splice:
+                    lst += list_values(val)
+                else:
+                    lst.append(val)
+            push(cons_chain(lst, constants[code[pc + 3]]))
+            pc += 4
+        elif op == PUSH_FRAME:
+            n = code[pc + 1]
+            vals = stack[-n:] if n > 0 else []
+            del stack[len(stack) - n:]
+            env = Frame(vals, env)
+            pc += 2
+        elif op == PUSH_EMPTY_FRAME:
+            env = Frame([None] * code[pc + 1], env)
+            pc += 2
+        elif op == POP_FRAME:
+            env = env.parent
+            pc += 1
+        elif op == MATCH_DISPATCH:
+            # binds the clause that matched straight into its frame
+            matched = run_match_tree(constants[code[pc + 1]], pop(), env)
+            if matched is None:
+                pc += 3
+            else:
+                clause, env = matched
+                pc = constants[code[pc + 2]][clause]
+        else:
+            raise RuntimeError(f"Unknown opcode {op} at {pc}.")
+
+
+def disassemble(code_object):
+    """
+    returns a listing of a code object, followed by the listings of the
+    lambda bodies in its constant pool
+    """
+    lines = [f"code {code_object.name}:"]
+    code = code_object.code
+    constants = code_object.constants
+    nested = []
+    pc = 0
+    while pc < len(code):
+        name, num_operands = OPCODES[code[pc]]
+        operands = code[pc + 1:pc + 1 + num_operands]
+        if code[pc] == OP_FOR:
+            # also takes the number of lists
+            operands.append(code[pc + 3])
+            num_operands += 1
+        notes = []
+        if code[pc] in [CONST, GLOBAL, SET_GLOBAL, DEFINE_GLOBAL, MAKE_DELAY,
+                        MAKE_STREAM, MAKE_CLOSURE, MAKE_FUTURE, OP_FOR,
+                        QUASI_LIST]:
+            index = operands[0] if code[pc] != QUASI_LIST else operands[1]
+            constant = constants[index]
+            if type(constant) == Procedure:
+                nested.append(constant.code)
+                notes.append(f"<code {constant.code.name}>")
+            elif type(constant) == CodeObject:
+                nested.append(constant)
+                notes.append(f"<code {constant.name}>")
+            elif type(constant) == tuple:
+                notes.append(str(constant))
+            else:
+                notes.append(expr_to_str(constant))
+        if code[pc] == DEFINE_LOCAL:
+            notes.append(expr_to_str(constants[operands[1]]))
+        elif code[pc] == MATCH_DISPATCH:
+            notes.append(f"clauses at {constants[operands[1]]}")
+        operand_str = " ".join(map(str, operands))
+        note_str = f"  ; {' '.join(notes)}" if notes != [] else ""
+        lines.append(f"{pc:>6} {name:<18}{operand_str}{note_str}")
+        pc += 1 + num_operands
+    for nested_code in nested:
+        lines.append("")
+        lines.append(disassemble(nested_code))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    programs = sys.argv[1:] or [
+        r'(begin (define (decr count) (if (eq? count 0) 0 (decr (- count 1)))) (decr 10))']
+    for string in programs:
+        print("-" * 70)
+        print(disassemble(compile_program(frontend(string))))
+        print(expr_to_str(run_vm(frontend(string), {})))